@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from benchmarks.generator import RepoSpec, generate_repo, generate_tree
+
+SPECS = {
+    "small": RepoSpec(files=50),
+    "many-files": RepoSpec(files=1000, keys=5),
+    "many-rules": RepoSpec(files=200, rules=100),
+    "big-documents": RepoSpec(files=20, documents=20, keys=200),
+    "deep": RepoSpec(files=100, keys=20, depth=10),
+    "thousands-of-keys": RepoSpec(files=5, keys=5000, encrypted_ratio=0.5),
+    "unencrypted": RepoSpec(files=200, encrypted_ratio=0.0),
+    "gitignore": RepoSpec(files=200, gitignore_patterns=200),
+}
+
+# Number of files of the tree used to measure the file discovery alone
+TREE_FILES = int(os.environ.get("ISOPS_BENCHMARK_TREE_FILES", "100000"))
+
+
+@pytest.fixture(scope="session", params=list(SPECS))
+def repo(request, tmp_path_factory):
+    return generate_repo(tmp_path_factory.mktemp(request.param), SPECS[request.param])
+
+
+@pytest.fixture(scope="session")
+def small_repo(tmp_path_factory):
+    return generate_repo(tmp_path_factory.mktemp("small"), SPECS["small"])
+
+
+@pytest.fixture(scope="session", params=["big-documents", "thousands-of-keys"])
+def large_manifests(request, tmp_path_factory):
+    return generate_repo(tmp_path_factory.mktemp(request.param), SPECS[request.param])
+
+
+@pytest.fixture(scope="session")
+def large_tree(tmp_path_factory):
+    return generate_tree(tmp_path_factory.mktemp("large-tree"), TREE_FILES)
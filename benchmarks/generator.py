@@ -0,0 +1,151 @@
+import random
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple
+
+import click
+from ruamel.yaml import YAML
+
+ENC_VALUE = (
+    "ENC[AES256_GCM,data:XFJC29P4T44=,iv:LC2cNV1I2MT3pREbWwq8UFS62PS2LreFhxrrOrWt/1U=,"
+    "tag:0DyNMTHMUljO/ncBwbcxQQ==,type:str]"
+)
+ENCRYPTED_REGEX = "^(data|stringData)$"
+CONFIG_REGEX = r"\.sops\.yaml$"
+
+
+class RepoSpec(NamedTuple):
+    """The shape of a synthetic repository.
+
+    Attributes:
+        files (int): Number of secret files.
+        rules (int): Number of creation rules in the config file.
+        documents (int): Number of YAML documents in each file.
+        keys (int): Number of secret keys in each document.
+        depth (int): Nesting depth of the secret keys under 'data'.
+        encrypted_ratio (float): Fraction of the secret values that are encrypted.
+        gitignore_patterns (int): Number of patterns in the root .gitignore,
+            each one also matching an ignored directory of the tree.
+        seed (int): Seed of the random generator.
+    """
+
+    files: int = 100
+    rules: int = 5
+    documents: int = 1
+    keys: int = 10
+    depth: int = 1
+    encrypted_ratio: float = 0.9
+    gitignore_patterns: int = 5
+    seed: int = 0
+
+
+def _secret(name: str, spec: RepoSpec, rng: random.Random) -> Dict:
+    data: Dict = {}
+    for i in range(spec.keys):
+        value = ENC_VALUE if rng.random() < spec.encrypted_ratio else f"plain-{i}"
+        data[f"key{i}"] = value
+    for level in reversed(range(spec.depth - 1)):
+        data = {f"level{level}": data}
+    return {
+        "apiVersion": "v1",
+        "kind": "Secret",
+        "metadata": {"name": name, "labels": {"app": name}},
+        "type": "Opaque",
+        "data": data,
+    }
+
+
+def generate_repo(root: Path, spec: RepoSpec) -> Path:
+    """Create a synthetic repository of sops secrets.
+
+    The secret files are spread across one directory per creation rule,
+    plus a catch-all rule for the ones that don't match any other rule.
+
+    Args:
+        root (Path): The directory to create the repository in.
+        spec (RepoSpec): The shape of the repository.
+
+    Returns:
+        Path: The root of the repository.
+    """
+    rng = random.Random(spec.seed)
+    yaml = YAML(typ="safe")
+    yaml.default_flow_style = False
+    root.mkdir(parents=True, exist_ok=True)
+
+    rules: List[Dict] = [
+        {"path_regex": f"team{i}/.*\\.yaml$", "encrypted_regex": ENCRYPTED_REGEX}
+        for i in range(spec.rules - 1)
+    ]
+    rules.append({"path_regex": r"\.yaml$", "encrypted_regex": ENCRYPTED_REGEX})
+    with open(root / ".sops.yaml", "w") as f:
+        yaml.dump({"creation_rules": rules}, f)
+
+    gitignore = []
+    for i in range(spec.gitignore_patterns):
+        gitignore.append(f"build{i}/" if i % 2 else f"*.tmp{i}.yaml")
+        ignored = root / f"build{i}" if i % 2 else root / "ignored"
+        ignored.mkdir(exist_ok=True)
+        with open(ignored / (f"secret.tmp{i}.yaml" if i % 2 == 0 else "secret.yaml"), "w") as f:
+            yaml.dump(_secret(f"ignored{i}", spec, rng), f)
+    (root / ".gitignore").write_text("".join(f"{pattern}\n" for pattern in gitignore))
+
+    for i in range(spec.files):
+        directory = root / f"team{i % spec.rules}" / f"app{i % 7}"
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / f"secret{i}.yaml", "w") as f:
+            yaml.dump_all([_secret(f"s{i}-{d}", spec, rng) for d in range(spec.documents)], f)
+
+    return root
+
+
+def generate_tree(root: Path, files: int, files_per_directory: int = 1000) -> Path:
+    """Create a large tree of empty files, to measure the file discovery alone.
+
+    A quarter of the files are not YAML files. The directories are two
+    levels deep, with 'files_per_directory' files each.
+
+    Args:
+        root (Path): The directory to create the tree in.
+        files (int): Number of files.
+        files_per_directory (int): Number of files in each directory.
+
+    Returns:
+        Path: The root of the tree.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    (root / ".gitignore").write_text("*.tmp\nbuild/\n")
+    for i in range(0, files, files_per_directory):
+        directory = (
+            root / f"dir{i // (files_per_directory * 10)}" / f"sub{i // files_per_directory}"
+        )
+        directory.mkdir(parents=True, exist_ok=True)
+        for j in range(i, min(i + files_per_directory, files)):
+            (directory / f"file{j}.{'txt' if j % 4 == 0 else 'yaml'}").touch()
+    return root
+
+
+DEFAULT_SPEC = RepoSpec()
+
+
+@click.command()
+@click.argument("root", type=click.Path(file_okay=False))
+@click.option("--files", type=int, default=DEFAULT_SPEC.files, show_default=True)
+@click.option("--rules", type=int, default=DEFAULT_SPEC.rules, show_default=True)
+@click.option("--documents", type=int, default=DEFAULT_SPEC.documents, show_default=True)
+@click.option("--keys", type=int, default=DEFAULT_SPEC.keys, show_default=True)
+@click.option("--depth", type=int, default=DEFAULT_SPEC.depth, show_default=True)
+@click.option(
+    "--encrypted-ratio", type=float, default=DEFAULT_SPEC.encrypted_ratio, show_default=True
+)
+@click.option(
+    "--gitignore-patterns", type=int, default=DEFAULT_SPEC.gitignore_patterns, show_default=True
+)
+@click.option("--seed", type=int, default=DEFAULT_SPEC.seed, show_default=True)
+def main(root: str, **spec: Any) -> None:
+    """Generate a synthetic repository of sops secrets in ROOT."""
+    generate_repo(Path(root), RepoSpec(**spec))
+    click.echo(f"Generated {spec['files']} files in {root}")
+
+
+if __name__ == "__main__":
+    main()
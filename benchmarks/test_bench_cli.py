@@ -0,0 +1,27 @@
+import pytest
+from click.testing import CliRunner
+
+from benchmarks.generator import CONFIG_REGEX
+from isops.cli import cli
+
+pytest.importorskip("pytest_benchmark")
+
+
+def test_bench_cli(benchmark, repo):
+    runner = CliRunner()
+
+    result = benchmark(runner.invoke, cli, [str(repo), "--config-regex", CONFIG_REGEX])
+
+    assert result.exit_code in (0, 1)
+    assert "not a valid YAML" not in result.output
+
+
+@pytest.mark.parametrize("jobs", [1, 0])
+def test_bench_cli_jobs(benchmark, small_repo, jobs):
+    runner = CliRunner()
+
+    result = benchmark(
+        runner.invoke, cli, [str(small_repo), "--config-regex", CONFIG_REGEX, "--jobs", str(jobs)]
+    )
+
+    assert result.exit_code in (0, 1)
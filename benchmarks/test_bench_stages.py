@@ -0,0 +1,188 @@
+import io
+import re
+import time
+
+import pytest
+
+import isops.utils.checker as checker_module
+from benchmarks.generator import ENC_VALUE, ENCRYPTED_REGEX
+from isops.utils import (
+    DocumentCache,
+    check_file,
+    check_files,
+    find_all_files_by_regex,
+    find_by_key,
+    load_all_yaml_bytes,
+    load_all_yaml_with_encoding,
+    verify_encryption_regex,
+)
+from isops.utils.checker import _classify_keys
+from isops.utils.output import OutputWriter
+from isops.utils.parser import c_parser_available, get_yaml
+from isops.utils.sops import KeyMatcher, RuleMatcher
+
+pytest.importorskip("pytest_benchmark")
+
+YAML_REGEX = re.compile(r"\.yaml$")
+
+
+def test_bench_find_all_files_by_regex(benchmark, repo):
+    files = benchmark(lambda: list(find_all_files_by_regex(YAML_REGEX, repo)))
+
+    assert files
+
+
+@pytest.mark.parametrize("threads", [0, 8])
+def test_bench_find_all_files_large_tree(benchmark, large_tree, threads):
+    files = benchmark.pedantic(
+        lambda: list(find_all_files_by_regex(YAML_REGEX, large_tree, threads=threads)),
+        rounds=3,
+    )
+
+    assert files
+
+
+def _rule_paths(rules):
+    # The creation rules of a generated repository, and the paths of a tree
+    # where half the files are secrets and half match no rule
+    regexes = [f"team{i}/.*\\.yaml$" for i in range(rules - 1)] + [r"\.yaml$"]
+    paths = []
+    for i in range(1000):
+        paths.append(f"team{i % rules}/app{i % 7}/secret{i}.yaml")
+        paths.append(f"team{i % rules}/app{i % 7}/src/module{i}.py")
+    return regexes, paths
+
+
+@pytest.mark.parametrize("matching", ["one-at-a-time", "combined"])
+@pytest.mark.parametrize("rules", [10, 100, 1000])
+def test_bench_rule_matcher(benchmark, rules, matching):
+    regexes, paths = _rule_paths(rules)
+    patterns = [re.compile(regex) for regex in regexes]
+
+    def one_at_a_time(path):
+        return next((i for i, pattern in enumerate(patterns) if pattern.search(path)), None)
+
+    def run():
+        # A new matcher per round, like a new scanner per run
+        first = RuleMatcher(patterns).first if matching == "combined" else one_at_a_time
+        return [first(path) for path in paths]
+
+    matches = benchmark(run)
+
+    assert matches == [one_at_a_time(path) for path in paths]
+
+
+def test_bench_load_all_yaml_with_encoding(benchmark, repo):
+    files = list(find_all_files_by_regex(YAML_REGEX, repo))
+
+    loaded = benchmark(lambda: [load_all_yaml_with_encoding(file) for file in files])
+
+    assert all(documents for documents, _ in loaded)
+
+
+@pytest.mark.parametrize("parser", ["c", "pure"])
+def test_bench_parser_backends(benchmark, large_manifests, parser):
+    if parser == "c" and not c_parser_available():
+        pytest.skip("ruamel.yaml.clib is not installed")
+    files = [file.read_bytes() for file in find_all_files_by_regex(YAML_REGEX, large_manifests)]
+    yaml = get_yaml(parser)
+
+    loaded = benchmark(lambda: [load_all_yaml_bytes(data, yaml) for data in files])
+
+    assert all(documents for documents, _ in loaded)
+
+
+def test_bench_find_by_key(benchmark, repo):
+    files = list(find_all_files_by_regex(YAML_REGEX, repo))
+    documents = [document for file in files for document in load_all_yaml_with_encoding(file)[0]]
+    encrypted_regex = re.compile(ENCRYPTED_REGEX)
+
+    matches = benchmark(
+        lambda: [
+            match for document in documents for match in find_by_key(document, encrypted_regex)
+        ]
+    )
+
+    assert matches
+
+
+@pytest.mark.parametrize("values", ["encrypted", "plain"])
+def test_bench_verify_encryption_regex(benchmark, values):
+    # The cost of each value found under an encrypted key
+    value = ENC_VALUE if values == "encrypted" else "plain-" + "x" * 100
+    batch = [value] * 1000
+
+    matches = benchmark(lambda: [verify_encryption_regex(value) for value in batch])
+
+    assert all(matches) == (values == "encrypted")
+
+
+@pytest.mark.parametrize("key_matching", ["search", "memo"])
+def test_bench_classify_keys(benchmark, repo, key_matching):
+    files = list(find_all_files_by_regex(YAML_REGEX, repo))
+    documents = [
+        (index, document)
+        for file in files
+        for index, document in enumerate(load_all_yaml_with_encoding(file)[0])
+    ]
+    encrypted_regex = re.compile(ENCRYPTED_REGEX)
+    search = (
+        KeyMatcher(encrypted_regex).search if key_matching == "memo" else encrypted_regex.search
+    )
+
+    keys = benchmark(
+        lambda: [
+            key for index, document in documents for key in _classify_keys(document, search, index)
+        ]
+    )
+
+    assert keys
+
+
+def test_bench_check_file(benchmark, repo):
+    files = list(find_all_files_by_regex(YAML_REGEX, repo))
+    encrypted_regexes = [re.compile(ENCRYPTED_REGEX)]
+
+    results = benchmark(lambda: [check_file(file, encrypted_regexes) for file in files])
+
+    assert all(result.is_valid for result in results)
+
+
+def test_bench_output(benchmark, repo):
+    files = list(find_all_files_by_regex(YAML_REGEX, repo))
+    encrypted_regexes = [re.compile(ENCRYPTED_REGEX)]
+    lines = [
+        (result.path, key.key, key.is_safe, result.encoding)
+        for result in (check_file(file, encrypted_regexes) for file in files)
+        for key in result.keys
+    ]
+
+    def print_all():
+        output = OutputWriter(io.StringIO())
+        for line in lines:
+            output.status(*line)
+        output.flush()
+
+    benchmark(print_all)
+
+
+@pytest.mark.parametrize("prefetch", [0, 8])
+def test_bench_check_files_prefetch(benchmark, monkeypatch, small_repo, prefetch):
+    # Every open waits like on a network file system
+    real_open_file = checker_module.open_file
+
+    def slow_open_file(*args):
+        time.sleep(0.002)
+        return real_open_file(*args)
+
+    monkeypatch.setattr(checker_module, "open_file", slow_open_file)
+    tasks = [
+        (file, [re.compile(ENCRYPTED_REGEX)])
+        for file in find_all_files_by_regex(YAML_REGEX, small_repo)
+    ]
+
+    results = benchmark(
+        lambda: list(check_files(tasks, DocumentCache(max_size=0), prefetch=prefetch))
+    )
+
+    assert all(result.is_valid for result in results)
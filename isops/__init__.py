@@ -1,6 +1,38 @@
-try:
-    from importlib.metadata import version
-except ImportError:
-    from importlib_metadata import version  # type: ignore[import-not-found,no-redef]
+# Not imported from typing, which takes longer to import than the client to run
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any
 
-__version__ = version("isops")
+    __version__: str
+    from isops.scanner import Scanner
+    from isops.utils.checker import FileResult
+    from isops.utils.helpers import KeyResult
+    from isops.utils.sops import CreationRule, InvalidRuleError
+
+__all__ = ["__version__", "Scanner", "FileResult", "KeyResult", "CreationRule", "InvalidRuleError"]
+
+# The version and the modules of the public API are looked up on first use, so
+# that the client forwarding a command to a daemon starts without loading them
+_EXPORTS = {
+    "Scanner": "isops.scanner",
+    "FileResult": "isops.utils.checker",
+    "KeyResult": "isops.utils.helpers",
+    "CreationRule": "isops.utils.sops",
+    "InvalidRuleError": "isops.utils.sops",
+}
+
+
+def __getattr__(name: str) -> "Any":
+    """Look up the version and the classes of the public API on first use."""
+    if name == "__version__":
+        from importlib.metadata import version
+
+        value = version("isops")
+    elif name in _EXPORTS:
+        from importlib import import_module
+
+        value = getattr(import_module(_EXPORTS[name]), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
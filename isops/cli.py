@@ -1,56 +1,192 @@
+import os
 import re
+import signal
 from pathlib import Path
-from typing import Dict, List, Optional, Pattern, Tuple
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Pattern, Tuple
 
 import click
 
 from isops import __version__
+from isops.daemon import Daemon
+from isops.scanner import Scanner, Task
 from isops.utils import (
-    all_dict_values,
+    CreationRule,
+    DocumentCache,
+    InvalidRuleError,
     find_all_files_by_regex,
-    find_by_key,
-    load_all_yaml,
-    load_all_yaml_with_encoding,
-    verify_encryption_regex,
 )
+from isops.utils.cache import (
+    DEFAULT_PARSE_CACHE_SIZE,
+    DEFAULT_RESULT_CACHE_DIR,
+    BaseResultCache,
+    ResultCache,
+    fingerprint_files,
+)
+from isops.utils.checker import FileResult, check_files
+from isops.utils.git import GitError, changed_files
+from isops.utils.ignore import IGNORE_FILES
+from isops.utils.memory import MemoryLimitError
+from isops.utils.output import OutputWriter
+from isops.utils.parser import (
+    DEFAULT_PARSER,
+    PARSERS,
+    ParserUnavailableError,
+    set_parser,
+)
+from isops.utils.profiling import PROFILE_FORMATS, Profiler
+from isops.utils.reporters import DEFAULT_FORMAT, REPORTERS, Reporter
+from isops.utils.watch import create_watcher
+
+# (safe keys, unsafe keys, is_valid) of a checked file
+FileCounts = Tuple[int, int, bool]
+
+
+def _load_scanner(
+    reporter: Reporter,
+    config_regex: Pattern[str],
+    path: Path,
+    documents: DocumentCache,
+    threads: int = 0,
+    config_paths: Optional[Iterable[Path]] = None,
+) -> Optional[Scanner]:
+    # One list of creation rules per config file: sops applies the first
+    # matching rule of a config, so the rules of different files don't mix.
+    # The files matching the regex can be given, e.g. by a daemon session.
+    if config_paths is None:
+        config_paths = find_all_files_by_regex(config_regex, path, threads)
+    rule_sets: List[List[Dict]] = []
+    config_files: List[Path] = []
+    for match_path in config_paths:
+        configs, _ = documents.load(match_path)
+        for config in configs:
+            # Skip None (empty YAML documents)
+            if config is None:
+                continue
+            try:
+                rule_sets.append(list(config["creation_rules"]))
+                config_files.append(match_path)
+                reporter.message(f"Found config file: {match_path}", bold=True, fg="blue")
+            except KeyError:
+                reporter.message(f"WARNING: skipping '{match_path}'", fg="yellow")
+                continue
 
-DEFAULT_PATH_REGEX = r".ya?ml$"
-DEFAULT_ENCRYPTED_REGEX = r""
-
+    if not any(rule_sets):
+        reporter.message("No valid config file found.", bold=True, fg="red")
+        return None
 
-def _categorize_keys_based_on_their_values(
-    secret: Dict, encrypted_regex: Pattern[str]
-) -> Tuple[List[str], ...]:
-    bad_keys: List[str] = []
-    good_keys: List[str] = []
-    for match in find_by_key(secret, encrypted_regex):
-        for key, value in all_dict_values(match):
-            if not verify_encryption_regex(str(value)):
-                bad_keys.append(key)
-            else:
-                good_keys.append(key)
-    return good_keys, bad_keys
+    reporter.start()
 
+    try:
+        rules = [[CreationRule.from_config(rule) for rule in rule_set] for rule_set in rule_sets]
+    except InvalidRuleError as error:
+        reporter.message(str(error), bold=False, fg="red")
+        return None
+
+    return Scanner(rules, documents, config_files, threads)
+
+
+def _report_results(
+    reporter: Reporter,
+    results: Generator[FileResult, None, None],
+    profiler: Profiler,
+    checked: Dict[Path, FileCounts],
+    stop_on_invalid: bool = True,
+) -> int:
+    # Returns the number of reported files
+    reported = 0
+    for result in results:
+        file, encoding = result.path, result.encoding
+        if not result.is_valid and not file.exists():
+            # Deleted after the tree was walked: there's nothing left to check
+            checked.pop(file, None)
+            continue
+        reported += 1
+        profiler.record_file(file, result.timings, result.counts)
+
+        if not result.is_valid:
+            reporter.invalid_file(file)
+            checked[file] = (0, 0, False)
+            if stop_on_invalid:
+                results.close()
+                break
+            continue
 
-def _print_status(file: Path, key: str, is_safe: bool, encoding: Optional[str]) -> None:
-    """Print status line with optional encoding warning.
+        safe = 0
+        with profiler.stage("output"):
+            for key in result.keys:
+                reporter.key(file, key, encoding)
+                safe += key.is_safe
+        checked[file] = (safe, len(result.keys) - safe, True)
+    return reported
 
-    Args:
-        file: The file path being checked.
-        key: The secret key name.
-        is_safe: Whether the secret is safely encrypted.
-        encoding: The detected file encoding, or None.
-    """
-    status = "[SAFE]" if is_safe else "[UNSAFE]"
-    color = "green" if is_safe else "red"
 
-    click.secho(message=f"{file}::{key} ", bold=False, nl=False)
-    click.secho(message=status, bold=False, fg=color, nl=False)
+def _most_recent_first(tasks: List[Task]) -> List[Task]:
+    # The files just edited are the likeliest to be unsafe. The sort is
+    # stable, so files with the same mtime stay sorted by path.
+    def mtime(task: Task) -> int:
+        try:
+            return os.stat(task[0]).st_mtime_ns
+        except OSError:
+            return 0
+
+    return sorted(tasks, key=mtime, reverse=True)
+
+
+def _totals(checked: Dict[Path, FileCounts]) -> Tuple[int, int, Optional[Path]]:
+    # The safe and unsafe keys, and the first broken file
+    broken = [file for file, (_, _, is_valid) in checked.items() if not is_valid]
+    return (
+        sum(safe for safe, _, _ in checked.values()),
+        sum(unsafe for _, unsafe, _ in checked.values()),
+        min(broken) if broken else None,
+    )
+
+
+def _watch(
+    path: Path,
+    config_regex: Pattern[str],
+    new_reporter: Callable[[], Reporter],
+    documents: DocumentCache,
+    scanner: Scanner,
+    checked: Dict[Path, FileCounts],
+    run_checks: Callable[[Reporter, List[Task]], None],
+    flush_output: Callable[[], None],
+) -> None:
+    # Check the changed files again, until interrupted. The rules are only
+    # reloaded, and the whole tree checked again, if a config file changes.
+    config_pattern = re.compile(config_regex)
+    with create_watcher(path) as watcher:
+        while True:
+            changed = watcher.wait()
+            reporter = new_reporter()
+
+            if any(
+                config_pattern.search(str(file)) or file.name in IGNORE_FILES for file in changed
+            ):
+                reporter.message("Config files changed, reloading the rules.", fg="blue")
+                reloaded = _load_scanner(reporter, config_regex, path, documents, scanner.threads)
+                if reloaded is None:
+                    flush_output()
+                    continue
+                scanner = reloaded
+                checked.clear()
+                tasks = scanner.tasks(path)
+            else:
+                # A deleted or moved directory is reported as a single path
+                removed = [file for file in changed if not file.is_file()]
+                for file in [
+                    file
+                    for file in checked
+                    if any(file == gone or gone in file.parents for gone in removed)
+                ]:
+                    del checked[file]
+                tasks = scanner.tasks(path, [file for file in changed if file.is_file()])
+                if not tasks:
+                    continue
+                reporter.start()
 
-    if encoding and encoding.startswith("utf-16"):
-        click.secho(message=" [UTF-16 ENCODING]", bold=False, fg="yellow")
-    else:
-        click.echo()  # Just newline
+            run_checks(reporter, tasks)
+            flush_output()
 
 
 def _validate_regex(ctx: click.Context, param: click.Parameter, value: str) -> str:
@@ -80,130 +216,316 @@ def _validate_regex(ctx: click.Context, param: click.Parameter, value: str) -> s
     default=False,
     help="Print a summary at the end of the checks.",
 )
+@click.option(
+    "-q",
+    "--quiet",
+    "--only-unsafe",
+    "quiet",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="Don't print the SAFE keys.",
+)
+@click.option(
+    "-f",
+    "--format",
+    "output_format",
+    type=click.Choice(list(REPORTERS)),
+    default=DEFAULT_FORMAT,
+    show_default=True,
+    help="The format of the report. Other messages go to stderr, except with 'text'.",
+)
+@click.option(
+    "--parse-cache-size",
+    type=click.IntRange(min=0),
+    default=DEFAULT_PARSE_CACHE_SIZE // (1024 * 1024),
+    show_default=True,
+    help="Memory bound, in MiB of source files, of the parsed YAML cache.",
+)
+@click.option(
+    "--max-memory",
+    type=click.IntRange(min=1),
+    default=None,
+    metavar="MIB",
+    help="Memory limit of each process: the files too big for it are parsed one document at a "
+    "time, and the checks stop if one needs more.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    help="Number of processes used to check the files, 0 means one per CPU.",
+)
+@click.option(
+    "--discovery-threads",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Number of threads listing the directories, e.g. on a network file system.",
+)
+@click.option(
+    "--prefetch",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Number of files read ahead while the current one is parsed, e.g. on a network "
+    "file system. Only used with a single process.",
+)
+@click.option(
+    "--parser",
+    type=click.Choice(PARSERS),
+    default=DEFAULT_PARSER,
+    show_default=True,
+    help="The YAML parser, 'auto' uses the C one (libyaml) when it is installed.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    is_flag=False,
+    flag_value=DEFAULT_RESULT_CACHE_DIR,
+    default=None,
+    help=f"Cache the results of unchanged files in this directory [{DEFAULT_RESULT_CACHE_DIR}].",
+)
+@click.option(
+    "--since",
+    type=str,
+    default=None,
+    metavar="REF",
+    help="Only check the files changed since this git ref.",
+)
+@click.option(
+    "--staged",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="Only check the files staged for commit.",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(PROFILE_FORMATS),
+    is_flag=False,
+    flag_value="table",
+    default=None,
+    help="Print the time spent in each stage and the slowest files to stderr [table].",
+)
+@click.option(
+    "-w",
+    "--watch",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="Keep running and check again the files that change.",
+)
+@click.option(
+    "--fail-fast",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="Stop at the first unsafe key or invalid YAML, checking the most recently modified "
+    "files first.",
+)
+@click.option(
+    "--serve",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="Keep running and answer the checks sent to --socket, e.g. by a pre-commit hook.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="The Unix domain socket of the daemon. Without --serve the checks are sent to it, "
+    "and run here if no daemon answers.",
+)
 @click.argument("path", nargs=1, type=click.Path())
 @click.command(no_args_is_help=True)
 @click.pass_context
-def cli(ctx: click.Context, path: Path, config_regex: Pattern[str], summary: bool) -> None:
+def cli(
+    ctx: click.Context,
+    path: Path,
+    config_regex: Pattern[str],
+    summary: bool,
+    quiet: bool,
+    output_format: str,
+    parse_cache_size: int,
+    max_memory: Optional[int],
+    jobs: int,
+    discovery_threads: int,
+    prefetch: int,
+    parser: str,
+    cache_dir: Optional[str],
+    since: Optional[str],
+    staged: bool,
+    profile: Optional[str],
+    watch: bool,
+    fail_fast: bool,
+    serve: bool,
+    socket_path: Optional[str],
+) -> None:
     """Ensure your SOPS secrets are encrypterd."""
     ctx.ensure_object(dict)
+    # Set when the command is run by a daemon, for one of its clients
+    daemon: Optional[Daemon] = ctx.obj.get("daemon")
 
-    received_path = Path(path)
-
-    creation_rules = []
-    for match_path in find_all_files_by_regex(config_regex, received_path):
-        for config in load_all_yaml(Path(match_path)):
-            # Skip None (empty YAML documents)
-            if config is None:
-                continue
-            try:
-                creation_rules += config["creation_rules"]
-                click.secho(message=f"Found config file: {match_path}", bold=True, fg="blue")
-            except KeyError:
-                click.secho(message=f"WARNING: skipping '{match_path}'", fg="yellow")
-                continue
+    profiler = Profiler(enabled=profile is not None)
+    if profile is not None:
+        ctx.call_on_close(lambda: click.echo(profiler.report(profile), err=True))
 
-    if not creation_rules:
-        click.secho(
-            message="No valid config file found.",
-            bold=True,
-            fg="red",
-        )
-        ctx.exit(1)
+    # The output is written in large chunks, once the checks are over or the buffer is full
+    output = OutputWriter(quiet=quiet, color=ctx.color)
+    reporter = REPORTERS[output_format](output, summary=summary)
 
-    click.secho(message="---", bold=True, nl=True)
+    def flush_output() -> None:
+        with profiler.stage("output"):
+            output.flush()
 
-    good_keys: List[str] = []
-    bad_keys: List[str] = []
+    ctx.call_on_close(flush_output)
 
-    bad_keys_summary: List[str] = []
-    bad_keys_number: int = 0
-    good_keys_number: int = 0
+    try:
+        set_parser(parser)
+    except ParserUnavailableError as error:
+        raise click.BadParameter(str(error), param_hint="'--parser'")
 
-    broken_yaml_found: str = ""
+    received_path = Path(path)
+    if daemon is not None and (watch or serve):
+        raise click.UsageError("--watch and --serve can't be sent to a daemon.")
+    if watch and not received_path.is_dir():
+        raise click.BadParameter("--watch needs a directory.", param_hint="'PATH'")
+    if serve:
+        if watch:
+            raise click.UsageError("--watch and --serve are mutually exclusive.")
+        if socket_path is None:
+            raise click.BadParameter("--serve needs --socket.", param_hint="'--serve'")
+        if not received_path.is_dir():
+            raise click.BadParameter("--serve needs a directory.", param_hint="'PATH'")
+        daemon = Daemon()
+        ctx.call_on_close(daemon.close)
+
+    # A daemon keeps the config files, the files to check and their results
+    # of each tree between requests
+    session = None
+    if daemon is not None and received_path.is_dir():
+        session = daemon.session(
+            received_path, config_regex, parse_cache_size * 1024 * 1024, discovery_threads
+        )
 
-    for rule in creation_rules:
-        if "path_regex" not in rule:
-            rule["path_regex"] = DEFAULT_PATH_REGEX
-        if "encrypted_regex" not in rule:
-            rule["encrypted_regex"] = DEFAULT_ENCRYPTED_REGEX
+    # Every file is read and parsed at most once, even if it is both
+    # a config file and a secret or is matched by several rules.
+    if session is not None:
+        documents = session.documents
+    else:
+        documents = DocumentCache(max_size=parse_cache_size * 1024 * 1024)
+
+    with profiler.stage("config"):
+        scanner = _load_scanner(
+            reporter,
+            config_regex,
+            received_path,
+            documents,
+            discovery_threads,
+            session.config_files() if session is not None else None,
+        )
+    if scanner is None:
+        ctx.exit(1)
 
+    # With --since/--staged only the changed files are candidates: the tree isn't walked
+    candidates: Optional[List[Path]] = None
+    if since is not None or staged:
         try:
-            path_regex = rule["path_regex"]
-            re.compile(path_regex)
-        except re.error:
-            click.secho(
-                message=f"Invalid regex for 'path_regex': {path_regex}",
-                bold=False,
-                fg="red",
-            )
+            candidates = changed_files(received_path, since=since, staged=staged)
+        except GitError as error:
+            reporter.message(f"Cannot list the changed files: {error}", bold=True, fg="red")
             ctx.exit(1)
 
+    # Sorting makes the output independent of the file system and of --jobs
+    with profiler.stage("discovery"):
+        if session is not None:
+            tasks = session.tasks(scanner, candidates)
+        else:
+            tasks = scanner.tasks(received_path, candidates)
+
+    results_cache: Optional[BaseResultCache] = None
+    if cache_dir is not None:
+        results_cache = ResultCache(Path(cache_dir), fingerprint_files(scanner.config_files))
+        ctx.call_on_close(results_cache.close)
+    elif session is not None:
+        results_cache = session.results
+
+    def run_checks(reporter: Reporter, tasks: List[Task]) -> None:
+        if fail_fast:
+            with profiler.stage("discovery"):
+                tasks = _most_recent_first(tasks)
+        results = profiler.timed(
+            "check",
+            check_files(
+                tasks,
+                documents,
+                jobs=jobs,
+                results_cache=results_cache,
+                profile=profiler.enabled,
+                max_memory=max_memory * 1024 * 1024 if max_memory is not None else None,
+                prefetch=prefetch,
+                fail_fast=fail_fast,
+            ),
+        )
+        # A broken file stops the checks, unless they are watched, and so does an
+        # unsafe key with --fail-fast
         try:
-            encrypted_regex = rule["encrypted_regex"]
-            re.compile(encrypted_regex)
-        except re.error:
-            click.secho(
-                message=f"Invalid regex for 'encrypted_regex': {encrypted_regex}",
-                bold=False,
-                fg="red",
+            reported = _report_results(
+                reporter, results, profiler, checked, stop_on_invalid=not watch
             )
-            ctx.exit(1)
-
-    for rule in creation_rules:
-        path_regex = rule["path_regex"]
-        encrypted_regex = rule["encrypted_regex"]
-
-        if broken_yaml_found:
-            break
-
-        for file in find_all_files_by_regex(path_regex, received_path):
-            yaml_data, encoding = load_all_yaml_with_encoding(file)
-
-            if not yaml_data:
-                click.secho(message=f"{file} is not a valid YAML!", bold=True, fg="red")
-                broken_yaml_found = f"{file}"
-                break
-
-            for secret in yaml_data:
-                # Skip None (empty YAML documents)
-                if secret is None:
-                    continue
+        except MemoryLimitError as error:
+            # The file is counted as broken, and the remaining ones are not checked
+            reporter.message(str(error), bold=True, fg="red")
+            checked[error.path] = (0, 0, False)
+        else:
+            if fail_fast and reported < len(tasks):
+                reporter.message(
+                    f"Stopped at the first failure, {len(tasks) - reported} files not checked.",
+                    fg="yellow",
+                )
+        with profiler.stage("output"):
+            reporter.finish(*_totals(checked))
 
-                if "sops" in secret:
-                    secret.pop("sops", None)
+    # The counts of safe and unsafe keys of each checked file
+    checked: Dict[Path, FileCounts] = {}
+    run_checks(reporter, tasks)
 
-                good_keys, bad_keys = _categorize_keys_based_on_their_values(
-                    secret, encrypted_regex
-                )
-                all_keys: List[str] = good_keys + bad_keys
-
-                for key in all_keys:
-                    if key in good_keys:
-                        _print_status(file, key, True, encoding)
-                        good_keys_number += 1
-                    else:
-                        _print_status(file, key, False, encoding)
-                        bad_keys_number += 1
-                        if summary:
-                            summary_line = f"UNSAFE secret '{key}' in '{file}'"
-                            bad_keys_summary.append(summary_line)
-
-    if summary:
-        click.secho(message="---", bold=True, nl=True)
-        click.secho(message="Summary:", bold=True, nl=True, fg="blue")
-        if broken_yaml_found:
-            click.secho(
-                message=f"The yaml '{broken_yaml_found}' is broken, checks incomplete!",
-                bold=True,
-                nl=True,
-                fg="red",
+    if watch:
+        flush_output()
+        try:
+            _watch(
+                received_path,
+                config_regex,
+                lambda: REPORTERS[output_format](output, summary=summary),
+                documents,
+                scanner,
+                checked,
+                run_checks,
+                flush_output,
             )
-        else:
-            for entry in bad_keys_summary:
-                click.secho(message=entry, bold=False, fg="red", nl=True)
-            click.secho(message=f"{good_keys_number} safe ", bold=True, nl=False, fg="green")
-            click.secho(message=f"{bad_keys_number} unsafe", bold=True, nl=True, fg="red")
+        except KeyboardInterrupt:
+            pass
+
+    if serve and daemon is not None and socket_path is not None:
+        reporter.message(f"Listening on {socket_path}.", bold=True, fg="blue")
+        flush_output()
+        # Stopped by a service manager like by Ctrl-C, removing the socket
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            daemon.serve(Path(socket_path))
+        except KeyboardInterrupt:
+            pass
+        except OSError as error:
+            reporter.message(f"Cannot serve: {error}", bold=True, fg="red")
+            ctx.exit(1)
+        ctx.exit(0)
 
+    _, bad_keys_number, broken_yaml_found = _totals(checked)
     if bad_keys_number or broken_yaml_found:
         ctx.exit(1)
 
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sys
+
+# Only a few modules of the standard library are imported until the checks run
+# in this process: a command answered by a daemon doesn't pay for the others
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Sequence
+
+# How long to wait for the daemon to accept the request, in seconds
+CONNECT_TIMEOUT = 1.0
+
+# The options that are never forwarded to a daemon
+_LOCAL_OPTIONS = {"--serve", "-w", "--watch", "-h", "--help", "-v", "--version"}
+# The short options followed by a value, e.g. '-r' in '-qr.sops.yaml'
+_SHORT_VALUE_OPTIONS = {"-f", "-j", "-r"}
+
+
+def build_id() -> str:
+    """Identify the installation of isops, without reading its metadata.
+
+    A daemon only runs the commands of the clients of the same installation:
+    upgrading isops changes the id.
+
+    Returns:
+        str: The id.
+    """
+    stat = os.stat(__file__)
+    return f"{os.path.dirname(os.path.abspath(__file__))}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _socket_option(args: Sequence[str]) -> Optional[str]:
+    # The value of --socket, if given
+    for index, arg in enumerate(args):
+        if arg == "--":
+            break
+        if arg == "--socket" and index + 1 < len(args):
+            return args[index + 1]
+        if arg.startswith("--socket="):
+            return arg[len("--socket=") :]
+    return None
+
+
+def _runs_locally(args: Sequence[str]) -> bool:
+    # Whether an option that is never forwarded is given, as click reads it:
+    # '--watch' or '--watch=...', or '-w' in a group like '-qw'. A value that
+    # looks like one of them, e.g. '-r -w', only makes the checks run here.
+    for arg in args:
+        if arg == "--":
+            break
+        if arg.startswith("--"):
+            if arg.split("=", 1)[0] in _LOCAL_OPTIONS:
+                return True
+        elif arg.startswith("-"):
+            for char in arg[1:]:
+                if f"-{char}" in _LOCAL_OPTIONS:
+                    return True
+                if f"-{char}" in _SHORT_VALUE_OPTIONS:
+                    # The rest of the group is its value
+                    break
+    return False
+
+
+def request(socket_path: str, args: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """Ask a daemon to run a command line.
+
+    Args:
+        socket_path (str): The Unix domain socket of the daemon.
+        args (Sequence[str]): The arguments of the command line.
+
+    Returns:
+        Optional[Dict[str, Any]]: The 'stdout', 'stderr' and 'exit_code' of
+            the command, or None if no daemon could run it.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    message = {
+        "build": build_id(),
+        "cwd": os.getcwd(),
+        "args": list(args),
+        "color": sys.stdout.isatty() or None,
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(CONNECT_TIMEOUT)
+            client.connect(socket_path)
+            client.sendall(json.dumps(message).encode() + b"\n")
+            # The checks can take any time
+            client.settimeout(None)
+            with client.makefile("rb") as stream:
+                response = json.loads(stream.readline())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(response, dict) or "error" in response:
+        return None
+    return response
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """Run isops, through a daemon if --socket is given and one is listening.
+
+    Without a daemon, e.g. because it isn't running or runs another version
+    of isops, the checks run in this process.
+
+    Args:
+        args (Optional[List[str]]): The arguments of the command line, those
+            of the process by default.
+    """
+    if args is None:
+        args = sys.argv[1:]
+
+    socket_path = _socket_option(args)
+    if socket_path is not None and not _runs_locally(args):
+        response = request(socket_path, args)
+        if response is not None:
+            sys.stdout.write(response.get("stdout", ""))
+            sys.stdout.flush()
+            sys.stderr.write(response.get("stderr", ""))
+            sys.stderr.flush()
+            sys.exit(response.get("exit_code", 1))
+
+    from isops.cli import cli
+
+    cli.main(args, prog_name="isops")
@@ -0,0 +1,352 @@
+import io
+import json
+import os
+import re
+import socket
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    Union,
+)
+
+import click
+
+from isops.client import build_id
+from isops.utils.cache import DocumentCache, MemoryResultCache
+from isops.utils.helpers import find_all_files_by_regex
+from isops.utils.ignore import IGNORE_FILES, IgnoreMatcher
+from isops.utils.watch import create_watcher
+
+if TYPE_CHECKING:
+    from isops.scanner import Scanner, Task
+
+# The trees kept warm at once, the least recently used one is dropped first
+MAX_SESSIONS = 8
+# How long a client has to send its request, in seconds
+REQUEST_TIMEOUT = 10.0
+
+# (working directory, path, config regex) of the requests sharing a session
+SessionKey = Tuple[str, str, str]
+
+
+class Session:
+    """The state of the checks of a directory tree, kept between requests.
+
+    The config files, the ignore files, the list of files to check and the
+    results of the checked files are computed once. A watcher records the
+    files that change, and each request first reads what it recorded so far
+    and looks only at those files again. If a config or ignore file changes,
+    everything but the results (keyed by the stat of each file and its
+    rules) is computed again.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        config_regex: Union[str, Pattern[str]],
+        documents: Optional[DocumentCache] = None,
+        threads: int = 0,
+    ) -> None:
+        """Start watching a directory tree.
+
+        Args:
+            path (Path): The root of the tree, as given in the requests.
+            config_regex (Union[str, Pattern[str]]): The regex that matches all the config files.
+            documents (Optional[DocumentCache]): The cache to load the files from.
+            threads (int): Number of threads listing the directories of the tree.
+        """
+        self.path = Path(path)
+        self.root = Path(os.path.abspath(path))
+        self.config_pattern = re.compile(config_regex)
+        self.documents = documents if documents is not None else DocumentCache()
+        self.threads = threads
+        self.results = MemoryResultCache()
+        self.matcher = IgnoreMatcher(self.path)
+
+        self._config_files: Optional[List[Path]] = None
+        # Sorted by path, like the tasks of a scanner
+        self._tasks: List["Task"] = []
+        self._task_paths: List[Path] = []
+        # The (path_regex, encrypted_regex) of the rules the tasks were found with
+        self._rules: Optional[List[List[Tuple[str, str]]]] = None
+        # The changed files not applied to the tasks yet
+        self._pending: Set[Path] = set()
+        # Started before the tree is walked, so that no change is missed
+        self._watcher = create_watcher(self.root)
+
+    def reset(self) -> None:
+        """Forget everything but the results, e.g. because a config file changed."""
+        self.matcher = IgnoreMatcher(self.path)
+        self._config_files = None
+        self._tasks = []
+        self._task_paths = []
+        self._rules = None
+        self._pending.clear()
+
+    def refresh(self) -> None:
+        """Apply the changes recorded by the watcher up to now."""
+        # Read right away rather than by a thread of its own, which could lag
+        # behind a request sent just after a file changed
+        changed = self._watcher.poll()
+        if not changed:
+            return
+
+        # Like the paths found by walking the tree from 'path'
+        files = [self.path / file.relative_to(self.root) for file in changed]
+        for file in files:
+            self.results.discard(file)
+
+        config_files = self._config_files or []
+        if any(
+            self.config_pattern.search(str(file)) or file.name in IGNORE_FILES for file in files
+        ) or not all(config.is_file() for config in config_files):
+            self.reset()
+        else:
+            self._pending.update(files)
+
+    def config_files(self) -> List[Path]:
+        """Find the config files of the tree.
+
+        Returns:
+            List[Path]: The files matching the config regex.
+        """
+        self.refresh()
+        if self._config_files is None:
+            self._config_files = list(
+                find_all_files_by_regex(self.config_pattern, self.path, self.threads, self.matcher)
+            )
+        return self._config_files
+
+    def tasks(self, scanner: "Scanner", files: Optional[Iterable[Path]] = None) -> List["Task"]:
+        """Find the files of the tree that some rule applies to, like Scanner.tasks.
+
+        Args:
+            scanner (Scanner): The scanner with the rules of the tree.
+            files (Optional[Iterable[Path]]): If given, only these files are
+                considered instead of the whole tree.
+
+        Returns:
+            List[Task]: The files, sorted, each with the 'encrypted_regex'
+                of the rules applied to it.
+        """
+        self.refresh()
+        if files is not None:
+            return scanner.tasks(self.path, files, self.matcher)
+
+        rules = [
+            [(rule.path_regex.pattern, rule.encrypted_regex.pattern) for rule in rule_set]
+            for rule_set in scanner.rule_sets
+        ]
+        if rules != self._rules:
+            self._tasks = scanner.tasks(self.path, matcher=self.matcher)
+            self._task_paths = [file for file, _ in self._tasks]
+            self._rules = rules
+            self._pending.clear()
+        elif self._pending:
+            self._update(scanner, self._pending)
+            self._pending.clear()
+        return list(self._tasks)
+
+    def _update(self, scanner: "Scanner", changed: Iterable[Path]) -> None:
+        # Drop the changed paths, with the files under the deleted directories,
+        # and add back the ones that still exist
+        existing = []
+        for file in changed:
+            start = end = bisect_left(self._task_paths, file)
+            while end < len(self._task_paths) and (
+                self._task_paths[end] == file or file in self._task_paths[end].parents
+            ):
+                end += 1
+            del self._tasks[start:end]
+            del self._task_paths[start:end]
+            if file.is_file():
+                existing.append(file)
+
+        for task in scanner.tasks(self.path, existing, self.matcher):
+            index = bisect_left(self._task_paths, task[0])
+            self._task_paths.insert(index, task[0])
+            self._tasks.insert(index, task)
+
+    def close(self) -> None:
+        """Stop watching the tree."""
+        self._watcher.close()
+
+
+class Daemon:
+    """Run the checks requested by the clients of a Unix domain socket.
+
+    The requests are the arguments of the command line, run one at a time
+    in the working directory of the client. The state of each checked tree
+    is kept in a Session, so that the next check of the same tree only
+    looks at the files that changed.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS) -> None:
+        """Create a daemon without sessions.
+
+        Args:
+            max_sessions (int): The number of trees kept warm at once.
+        """
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[SessionKey, Session]" = OrderedDict()
+
+    def session(
+        self,
+        path: Path,
+        config_regex: Union[str, Pattern[str]],
+        parse_cache_size: int,
+        threads: int = 0,
+    ) -> Session:
+        """Return the session of a tree, creating it if needed.
+
+        Args:
+            path (Path): The root of the tree, relative to the working directory.
+            config_regex (Union[str, Pattern[str]]): The regex that matches all the config files.
+            parse_cache_size (int): Maximum total size, in bytes, of the parsed
+                files kept by a new session.
+            threads (int): Number of threads listing the directories of the tree.
+
+        Returns:
+            Session: The session.
+        """
+        key = (os.getcwd(), str(path), re.compile(config_regex).pattern)
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+            session.threads = threads
+            return session
+
+        session = Session(path, config_regex, DocumentCache(max_size=parse_cache_size), threads)
+        self._sessions[key] = session
+        while len(self._sessions) > self.max_sessions:
+            _, oldest = self._sessions.popitem(last=False)
+            oldest.close()
+        return session
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the command line of a request.
+
+        Args:
+            request (Dict[str, Any]): The 'build' id of the client, its working
+                directory 'cwd', the arguments 'args' and whether to 'color'
+                the output.
+
+        Returns:
+            Dict[str, Any]: The 'stdout', 'stderr' and 'exit_code' of the
+                command, or an 'error' if it wasn't run.
+        """
+        # Imported here since the cli module imports this one
+        from isops.cli import cli
+
+        if request.get("build") != build_id():
+            return {"error": "The daemon runs another installation of isops."}
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        cwd = os.getcwd()
+        try:
+            os.chdir(request["cwd"])
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    exit_code = cli.main(
+                        list(request["args"]),
+                        prog_name="isops",
+                        standalone_mode=False,
+                        obj={"daemon": self},
+                        color=request.get("color"),
+                    )
+                except click.ClickException as error:
+                    error.show()
+                    exit_code = error.exit_code
+                except click.Abort:
+                    exit_code = 1
+                except Exception as error:
+                    click.secho(f"Error: {error}", err=True, fg="red")
+                    exit_code = 1
+        except (KeyError, TypeError, OSError) as error:
+            return {"error": f"Invalid request: {error}"}
+        finally:
+            os.chdir(cwd)
+
+        return {
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+            "exit_code": exit_code or 0,
+        }
+
+    def serve(self, socket_path: Path) -> None:
+        """Answer the requests of a Unix domain socket until interrupted.
+
+        Args:
+            socket_path (Path): The path of the socket. A stale one, left by a
+                daemon that didn't exit cleanly, is replaced.
+
+        Raises:
+            OSError: If Unix domain sockets aren't supported, or another
+                daemon is listening on the socket.
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("Unix domain sockets are not supported on this platform.")
+        # The requests are run from the working directory of each client
+        address = os.path.abspath(socket_path)
+        if os.path.exists(address):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(address)
+            except OSError:
+                os.unlink(address)
+            else:
+                raise OSError(f"Another daemon is listening on {socket_path}.")
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            # Only the owner can send requests
+            umask = os.umask(0o177)
+            try:
+                server.bind(address)
+            finally:
+                os.umask(umask)
+            try:
+                server.listen()
+                while True:
+                    connection, _ = server.accept()
+                    connection.settimeout(REQUEST_TIMEOUT)
+                    with connection, connection.makefile("rwb") as stream:
+                        self._answer(stream)
+            finally:
+                os.unlink(address)
+
+    def _answer(self, stream: io.BufferedIOBase) -> None:
+        # One request per connection: a line of JSON, answered by another one
+        try:
+            request = json.loads(stream.readline())
+            if not isinstance(request, dict):
+                raise ValueError("not an object")
+        except OSError:
+            # The client went away, or didn't send anything
+            return
+        except ValueError as error:
+            response = {"error": f"Invalid request: {error}"}
+        else:
+            response = self.handle(request)
+        try:
+            stream.write(json.dumps(response).encode() + b"\n")
+            stream.flush()
+        except OSError:
+            # The client went away
+            pass
+
+    def close(self) -> None:
+        """Stop watching the trees of all the sessions."""
+        while self._sessions:
+            _, session = self._sessions.popitem()
+            session.close()
@@ -0,0 +1,237 @@
+import re
+from pathlib import Path
+from typing import (
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from isops.utils.cache import BaseResultCache, DocumentCache
+from isops.utils.checker import FileResult, check_bytes, check_document, check_files
+from isops.utils.helpers import (
+    KeyResult,
+    find_all_files_by_regex,
+    find_all_files_by_rules,
+)
+from isops.utils.ignore import IgnoreMatcher
+from isops.utils.sops import CreationRule, RuleMatcher
+
+# A file to check, with the 'encrypted_regex' of the rules applied to it
+Task = Tuple[Path, List[Pattern[str]]]
+
+
+class Scanner:
+    """Check sops secrets against a fixed set of creation rules.
+
+    The rules are compiled once and the parsed files are kept across calls
+    (the YAML parser is shared by the whole process), so a scanner can be
+    created at startup and reused by a long-running service. A scanner is
+    not thread-safe.
+    """
+
+    def __init__(
+        self,
+        rule_sets: Sequence[Sequence[CreationRule]],
+        documents: Optional[DocumentCache] = None,
+        config_files: Sequence[Path] = (),
+        threads: int = 0,
+    ) -> None:
+        """Create a scanner.
+
+        Args:
+            rule_sets (Sequence[Sequence[CreationRule]]): The creation rules,
+                grouped by config file. Within each group the first matching
+                rule applies, like sops does.
+            documents (Optional[DocumentCache]): The cache to load the files from.
+            config_files (Sequence[Path]): The config files the rules come from.
+            threads (int): Number of threads listing the directories of a
+                tree, 0 lists them serially.
+        """
+        self.rule_sets = [list(rule_set) for rule_set in rule_sets]
+        self.documents = documents if documents is not None else DocumentCache()
+        self.config_files = list(config_files)
+        self.threads = threads
+        # Kept across calls, with the alternations they compiled
+        self._matchers = [
+            RuleMatcher([rule.path_regex for rule in rule_set]) for rule_set in self.rule_sets
+        ]
+
+    @classmethod
+    def from_config_files(
+        cls, paths: Iterable[Path], documents: Optional[DocumentCache] = None
+    ) -> "Scanner":
+        """Create a scanner from the 'creation_rules' of some sops config files.
+
+        Config files without 'creation_rules' are skipped.
+
+        Args:
+            paths (Iterable[Path]): The config files.
+            documents (Optional[DocumentCache]): The cache to load the files from.
+
+        Raises:
+            InvalidRuleError: If a rule has an invalid regex.
+
+        Returns:
+            Scanner: The scanner.
+        """
+        if documents is None:
+            documents = DocumentCache()
+        rule_sets: List[List[CreationRule]] = []
+        config_files: List[Path] = []
+        for path in paths:
+            configs, _ = documents.load(path)
+            for config in configs:
+                # Skip None (empty YAML documents) and non sops configs
+                if not isinstance(config, dict) or "creation_rules" not in config:
+                    continue
+                rule_sets.append(
+                    [CreationRule.from_config(rule) for rule in config["creation_rules"]]
+                )
+                config_files.append(path)
+        return cls(rule_sets, documents, config_files)
+
+    @classmethod
+    def from_config_regex(
+        cls,
+        config_regex: Union[str, Pattern[str]],
+        path: Path,
+        documents: Optional[DocumentCache] = None,
+    ) -> "Scanner":
+        """Create a scanner from the sops config files found in a directory tree.
+
+        Args:
+            config_regex (Union[str, Pattern[str]]): The regex that matches all the config files.
+            path (Path): The root directory to search.
+            documents (Optional[DocumentCache]): The cache to load the files from.
+
+        Raises:
+            InvalidRuleError: If a rule has an invalid regex.
+
+        Returns:
+            Scanner: The scanner.
+        """
+        return cls.from_config_files(
+            find_all_files_by_regex(re.compile(config_regex), Path(path)), documents
+        )
+
+    def encrypted_regexes(self, path: Union[str, Path]) -> List[Pattern[str]]:
+        """Return the 'encrypted_regex' of the rules that apply to a file.
+
+        Args:
+            path (Union[str, Path]): The file, as matched by the 'path_regex'.
+
+        Returns:
+            List[Pattern[str]]: One regex per config file with a matching rule.
+        """
+        path_str = str(path)
+        regexes = []
+        for rule_set, matcher in zip(self.rule_sets, self._matchers):
+            index = matcher.first(path_str)
+            if index is not None:
+                regexes.append(rule_set[index].encrypted_regex)
+        return regexes
+
+    def tasks(
+        self,
+        path: Path,
+        files: Optional[Iterable[Path]] = None,
+        matcher: Optional[IgnoreMatcher] = None,
+    ) -> List[Task]:
+        """Find the files of a directory tree that some rule applies to.
+
+        Args:
+            path (Path): The root directory to search.
+            files (Optional[Iterable[Path]]): If given, only these files (inside
+                'path') are considered instead of walking the whole tree.
+            matcher (Optional[IgnoreMatcher]): The ignore files of the tree,
+                if already loaded.
+
+        Returns:
+            List[Task]: The files, sorted, each with the 'encrypted_regex'
+                of the rules applied to it.
+        """
+        # Sorting makes the results independent of the file system
+        return [
+            (file, [self.rule_sets[s][r].encrypted_regex for s, r in matches])
+            for file, matches in sorted(
+                find_all_files_by_rules(self._matchers, Path(path), files, self.threads, matcher)
+            )
+        ]
+
+    def scan_path(
+        self,
+        path: Path,
+        jobs: int = 1,
+        results_cache: Optional[BaseResultCache] = None,
+        profile: bool = False,
+        max_memory: Optional[int] = None,
+        prefetch: int = 0,
+        fail_fast: bool = False,
+    ) -> Generator[FileResult, None, None]:
+        """Check a file, or all the files of a directory tree.
+
+        Args:
+            path (Path): A file, or the root directory to search.
+            jobs (int): Number of worker processes, as in check_files.
+            results_cache (Optional[BaseResultCache]): The cache of the results of
+                unchanged files.
+            profile (bool): Record the time spent in each stage of the checks.
+            max_memory (Optional[int]): The memory limit of each process, in
+                bytes, as in check_file.
+            prefetch (int): Number of files read ahead, as in check_files.
+            fail_fast (bool): Stop after the first file that is not valid or
+                has an unsafe key.
+
+        Raises:
+            MemoryLimitError: If a process grows past 'max_memory'.
+
+        Yields:
+            Generator[FileResult, None, None]: The result of each file some
+                rule applies to.
+        """
+        path = Path(path)
+        if path.is_dir():
+            tasks = self.tasks(path)
+        else:
+            regexes = self.encrypted_regexes(path)
+            tasks = [(path, regexes)] if regexes else []
+        yield from check_files(
+            tasks,
+            self.documents,
+            jobs=jobs,
+            results_cache=results_cache,
+            profile=profile,
+            max_memory=max_memory,
+            prefetch=prefetch,
+            fail_fast=fail_fast,
+        )
+
+    def scan_bytes(self, data: bytes, name: Union[str, Path]) -> FileResult:
+        """Check the content of a file.
+
+        Args:
+            data (bytes): The content, e.g. the body of a request.
+            name (Union[str, Path]): The file name the rules are matched against.
+
+        Returns:
+            FileResult: The result. It has no keys if no rule applies.
+        """
+        return check_bytes(data, self.encrypted_regexes(name), Path(name))
+
+    def scan_document(self, document: Dict, name: Union[str, Path]) -> List[KeyResult]:
+        """Check an already parsed YAML document, e.g. a Kubernetes object.
+
+        Args:
+            document (Dict): The document.
+            name (Union[str, Path]): The file name the rules are matched against.
+
+        Returns:
+            List[KeyResult]: The checked keys. Empty if no rule applies.
+        """
+        return check_document(document, self.encrypted_regexes(name))
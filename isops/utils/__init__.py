@@ -1,21 +1,63 @@
+from isops.utils.cache import DocumentCache
+from isops.utils.checker import (
+    FileResult,
+    check_bytes,
+    check_document,
+    check_file,
+    check_files,
+)
 from isops.utils.helpers import (
+    KeyResult,
     all_dict_values,
+    detect_bytes_encoding,
     detect_encoding,
     find_all_files_by_regex,
+    find_all_files_by_rules,
     find_by_key,
+    iter_all_yaml,
     load_all_yaml,
+    load_all_yaml_bytes,
     load_all_yaml_with_encoding,
     load_yaml,
+    open_file,
+    prescan_yaml,
+    read_file,
+    scan_yaml_events,
+)
+from isops.utils.sops import (
+    CreationRule,
+    InvalidRuleError,
+    KeyMatcher,
+    RuleMatcher,
+    verify_encryption_regex,
 )
-from isops.utils.sops import verify_encryption_regex
 
 __all__ = [
     "load_yaml",
     "load_all_yaml",
     "load_all_yaml_with_encoding",
+    "load_all_yaml_bytes",
+    "read_file",
+    "open_file",
+    "iter_all_yaml",
     "detect_encoding",
+    "detect_bytes_encoding",
+    "prescan_yaml",
+    "scan_yaml_events",
     "find_by_key",
     "all_dict_values",
     "verify_encryption_regex",
     "find_all_files_by_regex",
+    "find_all_files_by_rules",
+    "DocumentCache",
+    "FileResult",
+    "KeyResult",
+    "check_file",
+    "check_files",
+    "check_bytes",
+    "check_document",
+    "CreationRule",
+    "InvalidRuleError",
+    "RuleMatcher",
+    "KeyMatcher",
 ]
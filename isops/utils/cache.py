@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from types import TracebackType
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Tuple, Type
+
+from isops import __version__
+from isops.utils.helpers import (
+    Buffer,
+    KeyResult,
+    load_all_yaml_bytes,
+    load_all_yaml_with_encoding,
+)
+
+DEFAULT_PARSE_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_RESULT_CACHE_DIR = ".isops-cache"
+
+_CacheKey = Tuple[str, int, int]
+_CacheEntry = Tuple[List[Dict], Optional[str]]
+
+# A FileResult without its path (and timings): (keys, encoding, is_valid)
+CachedResult = Tuple[List[KeyResult], Optional[str], bool]
+
+# Bumped whenever the stored results change shape
+_RESULT_FORMAT = 2
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DocumentCache:
+    """A per-run cache of parsed YAML files.
+
+    Entries are keyed by (path, mtime, size), so a file that changes on disk
+    is parsed again. The cache is bounded by the total size of the cached
+    source files and evicts the least recently used entries first. The
+    returned documents are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_PARSE_CACHE_SIZE) -> None:
+        """Create an empty cache.
+
+        Args:
+            max_size (int): Maximum total size, in bytes, of the cached files.
+                0 disables the cache.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self._entries: "OrderedDict[_CacheKey, _CacheEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached files."""
+        return len(self._entries)
+
+    def load(self, path: Path, data: Optional[Buffer] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Like load_all_yaml_with_encoding, but parse each file version once.
+
+        Args:
+            path (Path): The path of the YAML file.
+            data (Optional[Buffer]): The content of the file, if it was
+                already read, so that it isn't opened again.
+
+        Returns:
+            Tuple[List[Dict], Optional[str]]: The yaml blocks and the detected
+                encoding, as returned by load_all_yaml_with_encoding.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return [], None
+
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        entry = load_all_yaml_with_encoding(path) if data is None else load_all_yaml_bytes(data)
+        if stat.st_size <= self.max_size:
+            self._entries[key] = entry
+            self.size += stat.st_size
+            while self.size > self.max_size:
+                (_, _, size), _ = self._entries.popitem(last=False)
+                self.size -= size
+        return entry
+
+
+def fingerprint_files(paths: Iterable[Path]) -> str:
+    """Compute a fingerprint of the content of some files.
+
+    Args:
+        paths (Iterable[Path]): The files to fingerprint, e.g. the config files.
+
+    Returns:
+        str: A hex digest that changes whenever any of the files changes.
+    """
+    digest = hashlib.sha256(__version__.encode())
+    for path in sorted(paths):
+        digest.update(str(path).encode() + b"\0")
+        try:
+            digest.update(Path(path).read_bytes())
+        except OSError:
+            pass
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class BaseResultCache(ABC):
+    """A cache of file results, to report unchanged files without checking them."""
+
+    @abstractmethod
+    def key(self, path: Path, encrypted_regexes: Sequence[Pattern[str]]) -> Optional[str]:
+        """Compute the cache key of a file.
+
+        Args:
+            path (Path): The file to check.
+            encrypted_regexes (Sequence[Pattern[str]]): The 'encrypted_regex'
+                of each rule that applies to the file.
+
+        Returns:
+            Optional[str]: The key, or None if the file can't be read.
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CachedResult]:
+        """Look up a result.
+
+        Args:
+            key (str): The cache key of the file.
+
+        Returns:
+            Optional[CachedResult]: The cached (keys, encoding, is_valid), or None.
+        """
+
+    @abstractmethod
+    def put(self, key: str, result: CachedResult) -> None:
+        """Store a result.
+
+        Args:
+            key (str): The cache key of the file.
+            result (CachedResult): The (keys, encoding, is_valid) of the file.
+        """
+
+    def close(self) -> None:  # noqa: B027
+        """Save the new results."""
+
+
+class ResultCache(BaseResultCache):
+    """A persistent cache of file results, stored in a SQLite database.
+
+    Results are keyed by the content of the file, the 'encrypted_regex' of
+    the rules applied to it and the isops version, so an unchanged file is
+    reported without being parsed again. The whole cache is invalidated
+    when the config fingerprint changes.
+    """
+
+    def __init__(self, directory: Path, fingerprint: str) -> None:
+        """Open (or create) the cache in 'directory'.
+
+        Args:
+            directory (Path): The cache directory, e.g. '.isops-cache'.
+            fingerprint (str): The fingerprint of the config files in use.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        gitignore = directory / ".gitignore"
+        if not gitignore.exists():
+            gitignore.write_text("# Created by isops\n*\n")
+
+        self._db = sqlite3.connect(str(directory / "results.sqlite"))
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)")
+
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self._db.execute("DELETE FROM results")
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('fingerprint', ?)",
+                (fingerprint,),
+            )
+            self._db.commit()
+
+    def __enter__(self) -> "ResultCache":
+        """Use the cache as a context manager that saves it on exit."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        """Save the new results and close the database."""
+        self.close()
+
+    @staticmethod
+    def key(path: Path, encrypted_regexes: Sequence[Pattern[str]]) -> Optional[str]:
+        """Compute the cache key of a file.
+
+        Args:
+            path (Path): The file to check.
+            encrypted_regexes (Sequence[Pattern[str]]): The 'encrypted_regex'
+                of each rule that applies to the file.
+
+        Returns:
+            Optional[str]: The key, or None if the file can't be read.
+        """
+        regexes = [getattr(regex, "pattern", regex) for regex in encrypted_regexes]
+        digest = hashlib.sha256(json.dumps([__version__, _RESULT_FORMAT, regexes]).encode())
+        try:
+            # In chunks, so that big files are never held in memory
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """Look up a result.
+
+        Args:
+            key (str): The cache key of the file.
+
+        Returns:
+            Optional[CachedResult]: The cached (keys, encoding, is_valid), or None.
+        """
+        row = self._db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        keys, encoding, is_valid = json.loads(row[0])
+        return (
+            [KeyResult(document, tuple(path), is_safe) for document, path, is_safe in keys],
+            encoding,
+            is_valid,
+        )
+
+    def put(self, key: str, result: CachedResult) -> None:
+        """Store a result.
+
+        Args:
+            key (str): The cache key of the file.
+            result (CachedResult): The (keys, encoding, is_valid) of the file.
+        """
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, result) VALUES (?, ?)",
+            (key, json.dumps(result)),
+        )
+
+    def close(self) -> None:
+        """Save the new results and close the database."""
+        self._db.commit()
+        self._db.close()
+
+
+class MemoryResultCache(BaseResultCache):
+    """An in-memory cache of file results, for a long-running process.
+
+    Results are keyed by the path, modification time and size of the file,
+    so looking one up only needs a stat. Only the latest result of each
+    file is kept.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty cache."""
+        self._results: Dict[str, CachedResult] = {}
+        # The key of the stored result of each file
+        self._keys: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        """Return the number of cached files."""
+        return len(self._keys)
+
+    def key(self, path: Path, encrypted_regexes: Sequence[Pattern[str]]) -> Optional[str]:
+        """Compute the cache key of a file.
+
+        Args:
+            path (Path): The file to check.
+            encrypted_regexes (Sequence[Pattern[str]]): The 'encrypted_regex'
+                of each rule that applies to the file.
+
+        Returns:
+            Optional[str]: The key, or None if the file can't be read.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        regexes = [getattr(regex, "pattern", regex) for regex in encrypted_regexes]
+        return json.dumps(
+            [os.path.abspath(path), stat.st_mtime_ns, stat.st_size, __version__, regexes]
+        )
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """Look up a result.
+
+        Args:
+            key (str): The cache key of the file.
+
+        Returns:
+            Optional[CachedResult]: The cached (keys, encoding, is_valid), or None.
+        """
+        return self._results.get(key)
+
+    def put(self, key: str, result: CachedResult) -> None:
+        """Store a result, replacing the one of a previous version of the file.
+
+        Args:
+            key (str): The cache key of the file.
+            result (CachedResult): The (keys, encoding, is_valid) of the file.
+        """
+        path = json.loads(key)[0]
+        previous = self._keys.pop(path, None)
+        if previous is not None:
+            del self._results[previous]
+        self._keys[path] = key
+        self._results[key] = result
+
+    def discard(self, path: Path) -> None:
+        """Forget the result of a file, e.g. because it was deleted.
+
+        Args:
+            path (Path): The file.
+        """
+        key = self._keys.pop(os.path.abspath(path), None)
+        if key is not None:
+            del self._results[key]
@@ -0,0 +1,543 @@
+import mmap
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import (
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Match,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from ruamel.yaml import YAML
+from ruamel.yaml.parser import ParserError
+from ruamel.yaml.scanner import ScannerError
+
+from isops.utils.cache import BaseResultCache, CachedResult, DocumentCache
+from isops.utils.helpers import (
+    Buffer,
+    KeyPath,
+    KeyResult,
+    detect_bytes_encoding,
+    iter_all_yaml,
+    load_all_yaml_bytes,
+    open_file,
+    prescan_yaml,
+    scan_yaml_events,
+)
+from isops.utils.memory import LOAD_FACTOR, MemoryLimitError, current_rss
+from isops.utils.parser import get_parser, set_parser
+from isops.utils.profiling import StageTimer, Timings
+from isops.utils.sops import ENCRYPTION_PATTERN, KeyMatcher, KeyRegex
+
+# Parsed documents of the files checked by a worker process
+_worker_documents: Optional[DocumentCache] = None
+_worker_profile = False
+_worker_max_memory: Optional[int] = None
+# The KeyMatcher of each (encrypted_regex, counted), shared by the files of the process
+_key_matchers: Dict[Tuple[Pattern[str], bool], KeyMatcher] = {}
+
+# The name of checked content that isn't read from a file
+CONTENT_PATH = Path("-")
+# Files at least this big are checked as a stream, one document at a time
+STREAM_THRESHOLD = 64 * 1024 * 1024
+# The encrypted regexes whose key names are remembered at once
+MAX_KEY_MATCHERS = 64
+
+# An opened file: what closes it, its content (or stream, None if it can't
+# be read) and the timer of the check, which includes the read
+_OpenedFile = Tuple[ExitStack, Optional[Union[Buffer, BinaryIO]], StageTimer]
+
+
+class FileResult(NamedTuple):
+    """The outcome of checking a single file.
+
+    Attributes:
+        path (Path): The checked file.
+        keys (List[KeyResult]): The checked keys, in the order they are
+            found in the file, for each rule applied to the file in turn.
+        encoding (Optional[str]): The detected file encoding.
+        is_valid (bool): False if the file is not a valid YAML.
+        timings (Optional[Timings]): The time spent in each stage of the
+            check, if it was profiled.
+        counts (Optional[Dict[str, int]]): The key names looked up
+            ('key_lookups') and found in a KeyMatcher ('key_memo_hits'),
+            if the check was profiled.
+    """
+
+    path: Path
+    keys: List[KeyResult]
+    encoding: Optional[str]
+    is_valid: bool
+    timings: Optional[Timings] = None
+    counts: Optional[Dict[str, int]] = None
+
+
+def _classify_keys(
+    data: Dict,
+    search: Callable[[str], Optional[Union[bool, Match[str]]]],
+    document: int,
+    path: KeyPath = (),
+    check: bool = False,
+) -> Generator[KeyResult, None, None]:
+    # A single walk that both finds the keys matching 'search' (like
+    # find_by_key) and checks every scalar under them (like all_dict_values)
+    is_encrypted = ENCRYPTION_PATTERN.fullmatch
+    for key, value in data.items():
+        # The 'sops' metadata is skipped
+        if not path and key == "sops":
+            continue
+        key_path = path + (key,)
+        checked = check or bool(search(key))
+        if isinstance(value, dict):
+            yield from _classify_keys(value, search, document, key_path, checked)
+        elif isinstance(value, list):
+            for index, elem in enumerate(value):
+                if isinstance(elem, dict):
+                    yield from _classify_keys(elem, search, document, key_path + (index,), checked)
+        elif checked:
+            yield KeyResult(document, key_path, bool(is_encrypted(str(value))))
+
+
+def _classify_documents(
+    yaml_data: List[Dict], encrypted_regexes: Sequence[KeyRegex]
+) -> List[KeyResult]:
+    keys: List[KeyResult] = []
+    for encrypted_regex in encrypted_regexes:
+        for document, secret in enumerate(yaml_data):
+            # Skip None (empty YAML documents)
+            if secret is None:
+                continue
+            keys += _classify_keys(secret, encrypted_regex.search, document)
+    return keys
+
+
+def _prescan_bytes(
+    data: Buffer, encrypted_regexes: Sequence[KeyRegex], timer: StageTimer
+) -> Optional[List[KeyResult]]:
+    # Fully encrypted UTF-8 files are proven safe without being parsed
+    try:
+        with timer.stage("decode"):
+            text = str(data, "utf-8")
+    except UnicodeDecodeError:
+        return None
+
+    keys: List[KeyResult] = []
+    with timer.stage("prescan"):
+        for encrypted_regex in encrypted_regexes:
+            prescanned = prescan_yaml(text, encrypted_regex)
+            if prescanned is None:
+                return None
+            keys += prescanned
+    return keys
+
+
+def _check_content(
+    path: Path,
+    data: Buffer,
+    encrypted_regexes: Sequence[KeyRegex],
+    timer: StageTimer,
+    documents: Optional[DocumentCache] = None,
+    yaml: Optional[YAML] = None,
+) -> FileResult:
+    # Every stage works on the same buffer: the file is never opened again
+    timings = timer.timings if timer.enabled else None
+
+    prescanned = _prescan_bytes(data, encrypted_regexes, timer)
+    if prescanned is not None:
+        return FileResult(path, prescanned, "utf-8", True, timings)
+
+    # The documents are only built when the event scanner can't handle the file
+    with timer.stage("scan"):
+        scanned = scan_yaml_events(data, encrypted_regexes, yaml)
+    if scanned is not None:
+        keys, is_valid = scanned
+        if not is_valid:
+            return FileResult(path, [], None, False, timings)
+        return FileResult(path, keys, detect_bytes_encoding(data), True, timings)
+
+    with timer.stage("parse"):
+        if documents is None:
+            yaml_data, encoding = load_all_yaml_bytes(data, yaml)
+        else:
+            yaml_data, encoding = documents.load(path, data)
+    if not yaml_data:
+        return FileResult(path, [], None, False, timings)
+
+    with timer.stage("classify"):
+        keys = _classify_documents(yaml_data, encrypted_regexes)
+
+    return FileResult(path, keys, encoding, True, timings)
+
+
+def _stream_threshold(max_memory: Optional[int]) -> int:
+    # Files that can't be loaded whole within the memory limit are streamed
+    if max_memory is None:
+        return STREAM_THRESHOLD
+    return min(STREAM_THRESHOLD, max_memory // LOAD_FACTOR)
+
+
+def _check_stream(
+    path: Path,
+    stream: BinaryIO,
+    encrypted_regexes: Sequence[KeyRegex],
+    timer: StageTimer,
+    max_memory: Optional[int] = None,
+) -> FileResult:
+    # Like _check_content, but only one document is held in memory at a time
+    timings = timer.timings if timer.enabled else None
+    encoding = detect_bytes_encoding(stream.read(2))
+
+    with timer.stage("scan"):
+        scanned = scan_yaml_events(stream, encrypted_regexes)
+    if scanned is not None:
+        keys, is_valid = scanned
+        if not is_valid:
+            return FileResult(path, [], None, False, timings)
+        return FileResult(path, keys, encoding, True, timings)
+
+    # The keys of each regex, in the same order as _classify_documents
+    results: List[List[KeyResult]] = [[] for _ in encrypted_regexes]
+    documents = 0
+    stream.seek(0)
+    try:
+        with timer.stage("parse"):
+            for document, secret in enumerate(iter_all_yaml(stream)):
+                documents += 1
+                # Skip None (empty YAML documents)
+                if secret is not None:
+                    for result, encrypted_regex in zip(results, encrypted_regexes):
+                        result += _classify_keys(secret, encrypted_regex.search, document)
+                if max_memory is not None and (current_rss() or 0) > max_memory:
+                    raise MemoryLimitError(path, max_memory)
+    except (ParserError, ScannerError, UnicodeDecodeError):
+        return FileResult(path, [], None, False, timings)
+    if not documents:
+        return FileResult(path, [], None, False, timings)
+    return FileResult(path, [key for result in results for key in result], encoding, True, timings)
+
+
+def _get_key_matchers(
+    encrypted_regexes: Sequence[Pattern[str]], counted: bool = False
+) -> List[KeyMatcher]:
+    # Key names repeat across files, so their matches are remembered for
+    # the whole run rather than for a single file
+    matchers = []
+    for regex in encrypted_regexes:
+        matcher = _key_matchers.get((regex, counted))
+        if matcher is None:
+            if len(_key_matchers) >= MAX_KEY_MATCHERS:
+                del _key_matchers[next(iter(_key_matchers))]
+            matcher = _key_matchers[regex, counted] = KeyMatcher(regex, counted=counted)
+        matchers.append(matcher)
+    return matchers
+
+
+def _key_counts(matchers: Sequence[KeyMatcher]) -> Tuple[int, int]:
+    # The lookups and misses of some counted matchers, each one counted once
+    unique = {id(matcher): matcher for matcher in matchers}.values()
+    return sum(matcher.lookups for matcher in unique), sum(matcher.misses for matcher in unique)
+
+
+def _open(path: Path, profile: bool, max_memory: Optional[int], ahead: bool = False) -> _OpenedFile:
+    # Read a file, or open it if it's to be streamed. When it's read ahead of
+    # its check, the pages of a mapped file are requested right away too.
+    timer = StageTimer(enabled=profile)
+    stack = ExitStack()
+    try:
+        with timer.stage("read"):
+            data = stack.enter_context(open_file(path, _stream_threshold(max_memory)))
+            if ahead and isinstance(data, mmap.mmap) and hasattr(mmap, "MADV_WILLNEED"):
+                data.madvise(mmap.MADV_WILLNEED)
+    except OSError:
+        stack.close()
+        return stack, None, timer
+    return stack, data, timer
+
+
+def _check_opened(
+    path: Path,
+    opened: _OpenedFile,
+    encrypted_regexes: Sequence[Pattern[str]],
+    documents: Optional[DocumentCache],
+    max_memory: Optional[int],
+) -> FileResult:
+    stack, data, timer = opened
+    with stack:
+        if data is None:
+            return FileResult(path, [], None, False, timer.timings if timer.enabled else None)
+        matchers = _get_key_matchers(encrypted_regexes, counted=timer.enabled)
+        before = _key_counts(matchers) if timer.enabled else (0, 0)
+        if isinstance(data, (bytes, mmap.mmap)):
+            result = _check_content(path, data, matchers, timer, documents)
+        else:
+            result = _check_stream(path, data, matchers, timer, max_memory)
+    if timer.enabled:
+        lookups, misses = _key_counts(matchers)
+        lookups, misses = lookups - before[0], misses - before[1]
+        result = result._replace(counts={"key_lookups": lookups, "key_memo_hits": lookups - misses})
+    return result
+
+
+def check_file(
+    path: Path,
+    encrypted_regexes: Sequence[Pattern[str]],
+    documents: Optional[DocumentCache] = None,
+    profile: bool = False,
+    max_memory: Optional[int] = None,
+) -> FileResult:
+    """Check that the keys of a file matching some 'encrypted_regex' are encrypted.
+
+    The file is opened once, and memory-mapped if it is big. Files too big
+    to be loaded whole (STREAM_THRESHOLD, or less within 'max_memory') are
+    read as a stream, one YAML document at a time.
+
+    Args:
+        path (Path): The path of the YAML file.
+        encrypted_regexes (Sequence[Pattern[str]]): The 'encrypted_regex' of
+            each rule that applies to the file.
+        documents (Optional[DocumentCache]): The cache to load the file from.
+        profile (bool): Record the time spent in each stage of the check.
+        max_memory (Optional[int]): The memory limit of the process, in bytes.
+
+    Raises:
+        MemoryLimitError: If the process grows past 'max_memory' while a
+            streamed file is checked.
+
+    Returns:
+        FileResult: The good and bad keys found in the file.
+    """
+    encrypted_regexes = [re.compile(regex) for regex in encrypted_regexes]
+    return _check_opened(
+        path, _open(path, profile, max_memory), encrypted_regexes, documents, max_memory
+    )
+
+
+def check_bytes(
+    data: bytes,
+    encrypted_regexes: Sequence[Pattern[str]],
+    path: Path = CONTENT_PATH,
+    yaml: Optional[YAML] = None,
+) -> FileResult:
+    """Like check_file, but for the content of a file.
+
+    Args:
+        data (bytes): The content of a YAML file.
+        encrypted_regexes (Sequence[Pattern[str]]): The 'encrypted_regex' of
+            each rule that applies to the content.
+        path (Path): The name of the file, only reported in the result.
+        yaml (Optional[YAML]): The safe YAML instance to use, the one of the
+            selected parser backend by default.
+
+    Returns:
+        FileResult: The good and bad keys found in the content.
+    """
+    matchers = _get_key_matchers([re.compile(regex) for regex in encrypted_regexes])
+    return _check_content(path, data, matchers, StageTimer(enabled=False), yaml=yaml)
+
+
+def check_document(
+    document: Dict, encrypted_regexes: Sequence[Pattern[str]], index: int = 0
+) -> List[KeyResult]:
+    """Check that the keys of a parsed YAML document matching some 'encrypted_regex' are encrypted.
+
+    Args:
+        document (Dict): The document, e.g. a Kubernetes object.
+        encrypted_regexes (Sequence[Pattern[str]]): The 'encrypted_regex' of
+            each rule that applies to the document.
+        index (int): The index of the document, reported in the results.
+
+    Returns:
+        List[KeyResult]: The checked keys.
+    """
+    return [
+        key
+        for matcher in _get_key_matchers([re.compile(regex) for regex in encrypted_regexes])
+        for key in _classify_keys(document, matcher.search, index)
+    ]
+
+
+def _init_worker(
+    parse_cache_size: int, profile: bool, parser: str, max_memory: Optional[int]
+) -> None:
+    global _worker_documents, _worker_profile, _worker_max_memory
+    # The workers may not inherit the parser backend of the parent, e.g. when spawned
+    set_parser(parser)
+    _worker_documents = DocumentCache(max_size=parse_cache_size)
+    _worker_profile = profile
+    _worker_max_memory = max_memory
+
+
+def _check_file_in_worker(task: Tuple[Path, Sequence[Pattern[str]]]) -> FileResult:
+    path, encrypted_regexes = task
+    return check_file(
+        path, encrypted_regexes, _worker_documents, _worker_profile, _worker_max_memory
+    )
+
+
+def _check_files_ahead(
+    tasks: Sequence[Tuple[Path, Sequence[Pattern[str]]]],
+    documents: DocumentCache,
+    profile: bool,
+    max_memory: Optional[int],
+    prefetch: int,
+) -> Generator[FileResult, None, None]:
+    # The next 'prefetch' files are read by a pool of threads while the
+    # current one is parsed: reading releases the GIL, parsing doesn't need it
+    executor = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="isops-prefetch")
+    pending: Deque[Tuple[Path, Sequence[Pattern[str]], "Future[_OpenedFile]"]] = deque()
+    remaining = iter(tasks)
+
+    def read_next() -> None:
+        task = next(remaining, None)
+        if task is not None:
+            path, encrypted_regexes = task
+            future = executor.submit(_open, path, profile, max_memory, True)
+            pending.append((path, [re.compile(regex) for regex in encrypted_regexes], future))
+
+    try:
+        for _ in range(prefetch):
+            read_next()
+        while pending:
+            path, encrypted_regexes, future = pending.popleft()
+            read_next()
+            opened = future.result()
+            yield _check_opened(path, opened, encrypted_regexes, documents, max_memory)
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        # Close the files read ahead that won't be checked
+        for _, _, future in pending:
+            if not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+
+
+def _passed(result: FileResult) -> bool:
+    # A valid file without unsafe keys
+    return result.is_valid and all(key.is_safe for key in result.keys)
+
+
+def _check_files(
+    tasks: Sequence[Tuple[Path, Sequence[Pattern[str]]]],
+    documents: DocumentCache,
+    jobs: int,
+    profile: bool,
+    max_memory: Optional[int],
+    prefetch: int = 0,
+    chunksize: Optional[int] = None,
+) -> Generator[FileResult, None, None]:
+    if jobs == 1:
+        if prefetch > 0:
+            yield from _check_files_ahead(tasks, documents, profile, max_memory, prefetch)
+            return
+        for path, encrypted_regexes in tasks:
+            yield check_file(path, encrypted_regexes, documents, profile, max_memory)
+        return
+
+    workers = jobs or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(documents.max_size, profile, get_parser(), max_memory),
+    )
+    try:
+        if chunksize is None:
+            chunksize = max(1, len(tasks) // (workers * 4))
+        yield from executor.map(_check_file_in_worker, tasks, chunksize=chunksize)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def check_files(
+    tasks: Iterable[Tuple[Path, Sequence[Pattern[str]]]],
+    documents: DocumentCache,
+    jobs: int = 1,
+    results_cache: Optional[BaseResultCache] = None,
+    profile: bool = False,
+    max_memory: Optional[int] = None,
+    prefetch: int = 0,
+    fail_fast: bool = False,
+) -> Generator[FileResult, None, None]:
+    """Check many files, optionally spreading them across a process pool.
+
+    Results are yielded in the same order as the tasks. Closing the
+    iterator early cancels the files that are still waiting to be checked.
+    Files checked in this process can be read ahead by a pool of threads,
+    so that waiting for a slow file system overlaps with parsing.
+
+    Args:
+        tasks (Iterable[Tuple[Path, Sequence[Pattern[str]]]]): The files to
+            check, each with the 'encrypted_regex' of the rules applied to it.
+        documents (DocumentCache): The cache to load files from when
+            checking them in this process.
+        jobs (int): Number of worker processes. 1 checks the files serially,
+            0 uses one worker per CPU.
+        results_cache (Optional[BaseResultCache]): If given, unchanged files are
+            reported from this cache instead of being checked, and new
+            results are stored in it.
+        profile (bool): Record the time spent in each stage of the checks.
+            Results from the cache have no timings.
+        max_memory (Optional[int]): The memory limit of each process, in
+            bytes, as in check_file.
+        prefetch (int): Number of files read ahead, when 'jobs' is 1. 0
+            reads each file when it is checked.
+        fail_fast (bool): Stop after the first file that is not valid or has
+            an unsafe key. The worker processes are then given one file at a
+            time, so that little is left running when the checks stop.
+
+    Raises:
+        MemoryLimitError: If a process grows past 'max_memory'.
+
+    Yields:
+        Generator[FileResult, None, None]: The result of each file.
+    """
+    tasks = list(tasks)
+    chunksize = 1 if fail_fast else None
+    if results_cache is None:
+        results = _check_files(tasks, documents, jobs, profile, max_memory, prefetch, chunksize)
+        try:
+            for result in results:
+                yield result
+                if fail_fast and not _passed(result):
+                    return
+        finally:
+            results.close()
+        return
+
+    lookups: List[Tuple[Optional[str], Optional[CachedResult]]] = []
+    misses = []
+    for path, encrypted_regexes in tasks:
+        key = results_cache.key(path, encrypted_regexes)
+        cached = results_cache.get(key) if key else None
+        lookups.append((key, cached))
+        if cached is None:
+            misses.append((path, encrypted_regexes))
+
+    fresh = _check_files(misses, documents, jobs, profile, max_memory, prefetch, chunksize)
+    try:
+        for (path, _), (key, cached) in zip(tasks, lookups):
+            if cached is not None:
+                result = FileResult(path, *cached)
+            else:
+                result = next(fresh)
+                if key is not None:
+                    results_cache.put(key, (result.keys, result.encoding, result.is_valid))
+            yield result
+            if fail_fast and not _passed(result):
+                return
+    finally:
+        fresh.close()
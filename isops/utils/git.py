@@ -0,0 +1,64 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+
+
+class GitError(Exception):
+    """Raised when the changed files can't be obtained from git."""
+
+
+def _git(path: Path, *args: str) -> str:
+    try:
+        process = subprocess.run(
+            ["git", "-C", str(path), *args],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        raise GitError("git is not installed.") from None
+    except subprocess.CalledProcessError as error:
+        raise GitError(error.stderr.strip() or f"git {args[0]} failed.") from None
+    return process.stdout
+
+
+def changed_files(path: Path, since: Optional[str] = None, staged: bool = False) -> List[Path]:
+    """List the files inside a directory that changed according to git.
+
+    Deleted files are left out. The returned paths start with 'path', like
+    the ones found by walking it, so that they match the same regexes.
+
+    Args:
+        path (Path): A directory inside a git work tree.
+        since (Optional[str]): The files changed in the work tree since this
+            git ref (commit, branch or tag).
+        staged (bool): The files staged in the index. If both 'since' and
+            'staged' are given, the files staged since 'since'.
+
+    Raises:
+        GitError: If 'path' is not in a git work tree or the ref is unknown.
+
+    Returns:
+        List[Path]: The changed files inside 'path'.
+    """
+    toplevel = _git(path, "rev-parse", "--show-toplevel").strip()
+
+    args = ["diff", "--name-only", "-z", "--no-renames", "--diff-filter=d"]
+    if staged:
+        args.append("--cached")
+    if since is not None:
+        args += [since, "--"]
+    names = _git(path, *args).split("\0")
+
+    root = os.path.realpath(path)
+    files = []
+    for name in names:
+        if not name:
+            continue
+        absolute = os.path.join(toplevel, name)
+        relative = os.path.relpath(absolute, root)
+        if relative.startswith(os.pardir + os.sep) or not os.path.isfile(absolute):
+            continue
+        files.append(path / relative)
+    return files
@@ -1,13 +1,112 @@
+import io
+import mmap
 import os
 import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
 from pathlib import Path
-from typing import Dict, Generator, List, Optional, Pattern, Tuple
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Match,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
-import pathspec
 from ruamel.yaml import YAML, YAMLError
+from ruamel.yaml.events import (
+    AliasEvent,
+    DocumentStartEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+from ruamel.yaml.nodes import ScalarNode
 from ruamel.yaml.parser import ParserError
+from ruamel.yaml.resolver import BaseResolver
 from ruamel.yaml.scanner import ScannerError
 
+from isops.utils.ignore import IgnoreMatcher
+from isops.utils.parser import get_yaml
+from isops.utils.sops import ENCRYPTION_PATTERN, KeyRegex, RuleMatcher
+
+# Files at least this big are memory-mapped instead of being read into a buffer
+MMAP_THRESHOLD = 1024 * 1024
+
+# The content of a file: a read-only mmap for the big files
+Buffer = Union[bytes, mmap.mmap]
+
+
+def read_file(path: Path) -> ContextManager[Buffer]:
+    """Read the content of a file, opening it only once.
+
+    Small files are read with a single call. Bigger files are memory-mapped,
+    so their content is not copied from the page cache, and the mapping is
+    closed on exit: it must not be used afterwards.
+
+    Args:
+        path (Path): The path of the file.
+
+    Raises:
+        OSError: If the file can't be read.
+
+    Returns:
+        ContextManager[Buffer]: The context manager giving the content of the file.
+    """
+    return cast(ContextManager[Buffer], open_file(path))
+
+
+@contextmanager
+def open_file(
+    path: Path, stream_threshold: Optional[int] = None
+) -> Generator[Union[Buffer, BinaryIO], None, None]:
+    """Like read_file, but files too big to be held in memory are not read.
+
+    Args:
+        path (Path): The path of the file.
+        stream_threshold (Optional[int]): Files at least this big, in bytes,
+            are yielded as they are opened, to be consumed as a stream.
+            None never streams them.
+
+    Raises:
+        OSError: If the file can't be read.
+
+    Yields:
+        Generator[Union[Buffer, BinaryIO], None, None]: The content of the
+            file, or the file opened in binary mode.
+    """
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if stream_threshold is not None and size >= stream_threshold:
+            yield f
+            return
+        if size >= MMAP_THRESHOLD:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # e.g. a file system that doesn't support mmap
+                pass
+            else:
+                with data:
+                    yield data
+                return
+        yield f.readall()
+
 
 def detect_encoding(path: Path) -> Optional[str]:
     """Detect the encoding of a file using BOM markers.
@@ -24,21 +123,34 @@ def detect_encoding(path: Path) -> Optional[str]:
     try:
         with open(path, "rb") as f:
             # Read first 2 bytes for BOM check
-            bom = f.read(2)
-            if len(bom) < 2:
-                return None
+            return detect_bytes_encoding(f.read(2))
+    except OSError:
+        return None
 
-            # Check for UTF-16 BOM markers
-            if bom == b"\xfe\xff":
-                return "utf-16-be"
-            elif bom == b"\xff\xfe":
-                return "utf-16-le"
 
-            # Default to UTF-8 for files without BOM
-            return "utf-8"
-    except OSError:
+def detect_bytes_encoding(data: Buffer) -> Optional[str]:
+    """Like detect_encoding, but for the content of a file.
+
+    Args:
+        data (Buffer): The content, or at least its first 2 bytes.
+
+    Returns:
+        Optional[str]: 'utf-16-le', 'utf-16-be', 'utf-8', or None if
+            'data' is too short.
+    """
+    bom = data[:2]
+    if len(bom) < 2:
         return None
 
+    # Check for UTF-16 BOM markers
+    if bom == b"\xfe\xff":
+        return "utf-16-be"
+    elif bom == b"\xff\xfe":
+        return "utf-16-le"
+
+    # Default to UTF-8 for files without BOM
+    return "utf-8"
+
 
 def load_yaml(path: Path) -> Dict:
     """Load a YAML content into a python dictionary.
@@ -50,8 +162,7 @@ def load_yaml(path: Path) -> Dict:
         Dict: The YAML file in a python dictionary form.
     """
     try:
-        yaml = YAML(typ="safe")
-        return yaml.load(path)
+        return get_yaml().load(path)
     except (YAMLError, UnicodeDecodeError):
         return {}
 
@@ -68,8 +179,7 @@ def load_all_yaml(path: Path) -> List[Dict]:
 
     """
     try:
-        yaml = YAML(typ="safe")
-        return list(yaml.load_all(path))
+        return list(get_yaml().load_all(path))
     except (ParserError, ScannerError, UnicodeDecodeError):
         return []
 
@@ -86,20 +196,437 @@ def load_all_yaml_with_encoding(path: Path) -> Tuple[List[Dict], Optional[str]]:
             - The detected encoding (e.g., 'utf-8', 'utf-16') or None
             If parsing fails or file cannot be read, returns ([], None).
     """
-    encoding = detect_encoding(path)
+    # The encoding is detected from the same buffer that is parsed
+    try:
+        with read_file(path) as data:
+            return load_all_yaml_bytes(data)
+    except OSError:
+        return [], None
+
+
+def load_all_yaml_bytes(
+    data: Buffer, yaml: Optional[YAML] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """Like load_all_yaml_with_encoding, but for the content of a file.
+
+    Args:
+        data (Buffer): The content of a YAML file.
+        yaml (Optional[YAML]): The safe YAML instance to use, the one of the
+            selected parser backend by default.
+
+    Returns:
+        Tuple[List[Dict], Optional[str]]: The yaml blocks and the detected
+            encoding, or ([], None) if 'data' is not a valid YAML.
+    """
+    encoding = detect_bytes_encoding(data)
+    if yaml is None:
+        yaml = get_yaml()
+    try:
+        documents = list(yaml.load_all(str(data, encoding or "utf-8")))
+    except (ParserError, ScannerError, UnicodeDecodeError):
+        return [], None
+    return documents, encoding if documents else None
+
+
+def iter_all_yaml(stream: BinaryIO, yaml: Optional[YAML] = None) -> Generator[Any, None, None]:
+    """Like load_all_yaml, but parse the yaml blocks of a stream one at a time.
+
+    Only the block being yielded is held in memory, whatever the size of
+    the stream.
+
+    Args:
+        stream (BinaryIO): The YAML file, opened in binary mode.
+        yaml (Optional[YAML]): The safe YAML instance to use, the one of the
+            selected parser backend by default.
+
+    Raises:
+        YAMLError: If the stream is not a valid YAML.
+        UnicodeDecodeError: If the stream can't be decoded.
+
+    Yields:
+        Generator[Any, None, None]: The yaml blocks.
+    """
+    if yaml is None:
+        yaml = get_yaml()
+    with closing(yaml.load_all(stream)) as documents:
+        yield from documents
+
+
+KeyPath = Tuple[Union[str, int], ...]
+
+
+class KeyResult(NamedTuple):
+    """A key whose value must be encrypted.
+
+    Attributes:
+        document (int): The index of the YAML document the key is in.
+        path (KeyPath): The keys, and the indexes of the sequence items,
+            from the root of the document down to the key.
+        is_safe (bool): Whether the value is encrypted.
+    """
+
+    document: int
+    path: KeyPath
+    is_safe: bool
+
+    @property
+    def key(self) -> str:
+        """The name of the key."""
+        return str(self.path[-1])
+
+
+# The subset of YAML understood by prescan_yaml: block mappings and sequences
+# of plain keys and one-line scalars, which is what sops writes.
+_PRESCAN_KEY = re.compile(r"([A-Za-z_][A-Za-z0-9_./-]*):(?: +(.*))?")
+_PRESCAN_RESERVED_KEYS = {"true", "false", "null", "yes", "no", "on", "off", "y", "n"}
+_PRESCAN_BLOCK_SCALAR = re.compile(r"[|>][+-]?(?: +#.*)?")
+_PRESCAN_EMPTY_COLLECTION = re.compile(r"(?:\[\]|\{\})(?: +#.*)?")
+_PRESCAN_QUOTED = re.compile(r"""(?:"(?:[^"\\]|\\.)*"|'(?:[^']|'')*')(?: +#.*)?""")
+_PRESCAN_UNSUPPORTED_CHARS = re.compile(
+    "[^\n\r\x20-\x7e\xa0-\ud7ff\ue000-\ufefe\uff00-\ufffd\U00010000-\U0010ffff]|[\u2028\u2029]"
+)
+
+
+def _prescan_scalar(value: str) -> Optional[Tuple[str, bool]]:
+    """Split a one-line scalar from its comment.
+
+    Returns:
+        Optional[Tuple[str, bool]]: The scalar and whether it's plain (not
+            quoted), or None if 'value' is not a one-line scalar.
+    """
+    if _PRESCAN_QUOTED.fullmatch(value):
+        return value, False
+    if value[0] in "[]{}&*!%@`,?:#|>\"'" or value == "-" or value.startswith("- "):
+        return None
+
+    comment = value.find(" #")
+    if comment >= 0:
+        value = value[:comment].rstrip(" ")
+    if ": " in value or value.endswith(":"):
+        return None
+    return value, True
+
+
+def prescan_yaml(text: str, encrypted_regex: KeyRegex) -> Optional[List[KeyResult]]:
+    """Prove, without a full parse, that all the values to encrypt are encrypted.
+
+    The YAML is scanned line by line, keeping only the stack of the open
+    mappings and sequences. Every scalar under a key matching the
+    'encrypted_regex' (the 'sops' metadata excluded) must be a sops
+    envelope. Anything outside the simple block style written by sops, or
+    any value that is not encrypted, makes the scan give up: the file must
+    then be parsed with load_all_yaml to get the exact result.
+
+    Args:
+        text (str): The content of a YAML file.
+        encrypted_regex (KeyRegex): The keys that must be encrypted, or
+            their KeyMatcher.
+
+    Returns:
+        Optional[List[KeyResult]]: The (encrypted) keys, in the order
+            find_by_key finds them, or None if the file needs a full parse.
+    """
+    if text.startswith("\ufeff"):
+        text = text[1:]
+    if _PRESCAN_UNSUPPORTED_CHARS.search(text):
+        return None
+
+    search = encrypted_regex.search
+    is_encrypted = ENCRYPTION_PATTERN.fullmatch
+
+    keys: List[KeyResult] = []
+    # Index of the current document, whether it has started and if any wasn't empty
+    document, started, non_empty = 0, False, False
+    # Open collections: [indent, is sequence, under a matching key, ignored, keys,
+    # path, index of the next item of a sequence]
+    stack: List[List] = []
+    # Key with no value on its line: (indent, under a matching key, ignored, path)
+    pending: Optional[Tuple[int, bool, bool, KeyPath]] = None
+    # Indent of the key owning the block scalar being skipped, and of its content
+    block_indent: Optional[int] = None
+    block_content_indent: Optional[int] = None
+
+    lines = text.split("\n")
+    lines.append("---")
+    for line in lines:
+        if line.endswith("\r"):
+            line = line[:-1]
+        if "\r" in line:
+            return None
+
+        stripped = line.lstrip(" ")
+        indent = len(line) - len(stripped)
+        if block_indent is not None:
+            if not stripped:
+                if line and block_content_indent is None:
+                    # Leading blank lines with spaces may be rejected by the parser
+                    return None
+                continue
+            if indent > block_indent:
+                if block_content_indent is None:
+                    block_content_indent = indent
+                elif indent < block_content_indent:
+                    return None
+                continue
+            block_indent = block_content_indent = None
+        if not stripped or stripped.startswith("#"):
+            continue
+
+        if indent == 0 and line.startswith(("---", "...", "%")):
+            if line.rstrip(" ") != "---":
+                return None
+            if pending is not None and pending[1] and not pending[2]:
+                return None
+            if stack:
+                non_empty = True
+            if started:
+                document += 1
+            started, stack, pending = True, [], None
+            continue
+        started = True
+
+        is_dash = stripped == "-" or stripped.startswith("- ")
+        if pending is not None:
+            pending_indent, matched, ignored, key_path = pending
+            pending = None
+            if indent > pending_indent or (indent == pending_indent and is_dash):
+                stack.append([indent, is_dash, matched, ignored, set(), key_path, 0])
+            elif matched and not ignored:
+                # A null value under a matching key is not encrypted
+                return None
+
+        while stack and stack[-1][0] > indent:
+            stack.pop()
+        while stack and stack[-1][0] == indent and stack[-1][1] and not is_dash:
+            stack.pop()
+        if not stack:
+            if indent or is_dash:
+                return None
+            stack.append([0, False, False, False, set(), (), 0])
+        frame = stack[-1]
+        if frame[0] != indent or frame[1] != is_dash:
+            return None
+
+        if is_dash:
+            rest = stripped[1:].lstrip(" ")
+            if not rest or rest.startswith("#"):
+                return None
+            key_match = _PRESCAN_KEY.fullmatch(rest)
+            item = frame[6]
+            frame[6] += 1
+            if key_match is None:
+                # Scalar items are neither searched nor checked by find_by_key
+                if _prescan_scalar(rest) is None:
+                    return None
+                continue
+            indent += len(stripped) - len(rest)
+            frame = [indent, False, frame[2], frame[3], set(), frame[5] + (item,), 0]
+            stack.append(frame)
+        else:
+            key_match = _PRESCAN_KEY.fullmatch(stripped)
+            if key_match is None:
+                return None
+
+        key, value = key_match.group(1), (key_match.group(2) or "").rstrip(" ")
+        if key.lower() in _PRESCAN_RESERVED_KEYS or key in frame[4]:
+            return None
+        frame[4].add(key)
+
+        matched, ignored = frame[2], frame[3]
+        if not ignored:
+            if len(stack) == 1 and key == "sops":
+                ignored = True
+            elif not matched:
+                matched = bool(search(key))
+
+        if not value or value.startswith("#"):
+            pending = (indent, matched, ignored, frame[5] + (key,))
+        elif value[0] in "|>":
+            if not _PRESCAN_BLOCK_SCALAR.fullmatch(value) or (matched and not ignored):
+                return None
+            block_indent = indent
+        elif _PRESCAN_EMPTY_COLLECTION.fullmatch(value):
+            continue
+        else:
+            scalar = _prescan_scalar(value)
+            if scalar is None:
+                return None
+            if matched and not ignored:
+                if not scalar[1] or not is_encrypted(scalar[0]):
+                    return None
+                keys.append(KeyResult(document, frame[5] + (key,), True))
+
+    return keys if non_empty else None
+
+
+_STR_TAG = "tag:yaml.org,2002:str"
+
+# What the event scanner does with a node, for each 'encrypted_regex':
+# look for matching keys (like find_by_key), check all the scalars (like
+# all_dict_values on a match) or ignore it.
+_SEARCH, _CHECK, _IGNORE = 0, 1, 2
+
+
+class _NeedsFullParse(Exception):
+    pass
+
+
+def _scalar_is_str(event: ScalarEvent, resolver: BaseResolver) -> bool:
+    if event.tag is not None:
+        return str(event.tag) == _STR_TAG
+    if event.style:
+        return True
+    return resolver.resolve(ScalarNode, event.value, event.implicit) == _STR_TAG
+
+
+def _open_stream(source: Union[Path, Buffer, BinaryIO]) -> ContextManager[BinaryIO]:
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    if isinstance(source, (str, Path)):
+        return open(source, "rb")
+    # A mapped or open file is read in place, and left open for the caller
+    source.seek(0)
+    return nullcontext(cast(BinaryIO, source))
+
+
+def scan_yaml_events(
+    source: Union[Path, Buffer, BinaryIO],
+    encrypted_regexes: Sequence[KeyRegex],
+    yaml: Optional[YAML] = None,
+) -> Optional[Tuple[List[KeyResult], bool]]:
+    """Classify the keys of a YAML file from its parse events.
+
+    The file is streamed through the YAML parser without building the
+    documents: only the stack of the open mappings and sequences is kept, so
+    memory grows with the nesting depth and not with the file size. Keys are
+    matched against each 'encrypted_regex' on the fly and only the scalars
+    under matching keys are checked, with the same semantics as find_by_key
+    and all_dict_values. The 'sops' metadata is skipped.
+
+    Args:
+        source (Union[Path, Buffer, BinaryIO]): The path of the YAML file, its
+            content, or the file opened in binary mode.
+        encrypted_regexes (Sequence[KeyRegex]): The keys that must be
+            encrypted (or their KeyMatcher), for each rule applied to the file.
+        yaml (Optional[YAML]): The safe YAML instance to use, the one of the
+            selected parser backend by default.
+
+    Returns:
+        Optional[Tuple[List[KeyResult], bool]]: The checked keys, for each
+            regex in turn, and False if the file is not a valid YAML. None if
+            the file uses features that need the documents to be built
+            (aliases, tags, non-string keys or non-mapping documents).
+    """
+    if yaml is None:
+        yaml = get_yaml()
+    resolver = yaml.resolver
+    searches = [regex.search for regex in encrypted_regexes]
+    is_encrypted = ENCRYPTION_PATTERN.fullmatch
+    search_all = (_SEARCH,) * len(searches)
+    ignore_all = (_IGNORE,) * len(searches)
+
+    # The checked keys of each regex
+    results: List[List[KeyResult]] = [[] for _ in encrypted_regexes]
+    documents = 0
+    # Open collections: [is mapping, modes, (key, modes) of the expected value,
+    # path, index of the next item of a sequence]
+    stack: List[List] = []
 
-    # Handle UTF-16 files explicitly
-    if encoding and encoding.startswith("utf-16"):
-        try:
-            yaml = YAML(typ="safe")
-            with open(path, "r", encoding=encoding) as f:
-                return list(yaml.load_all(f)), encoding
-        except (ParserError, ScannerError, UnicodeDecodeError, OSError):
-            return [], None
+    try:
+        with _open_stream(source) as stream, closing(yaml.parse(stream)) as events:
+            for event in events:
+                kind = type(event)
+
+                if kind is ScalarEvent:
+                    if not stack:
+                        # Empty documents are skipped, like in cli()
+                        if event.value in ("", "~", "null") and not event.style:
+                            if event.tag is None:
+                                continue
+                        raise _NeedsFullParse
+                    frame = stack[-1]
+                    if not frame[0]:
+                        # Scalars in a sequence are neither searched nor checked
+                        frame[4] += 1
+                        continue
+
+                    if frame[2] is None:
+                        key = event.value
+                        if not _scalar_is_str(event, resolver):
+                            raise _NeedsFullParse
+                        if len(stack) == 1 and key == "sops":
+                            frame[2] = (key, ignore_all)
+                        elif frame[1] is search_all:
+                            modes = tuple(_CHECK if search(key) else _SEARCH for search in searches)
+                            frame[2] = (key, search_all if _CHECK not in modes else modes)
+                        else:
+                            frame[2] = (
+                                key,
+                                tuple(
+                                    _CHECK if mode == _SEARCH and search(key) else mode
+                                    for mode, search in zip(frame[1], searches)
+                                ),
+                            )
+                        continue
+
+                    key, modes = frame[2]
+                    frame[2] = None
+                    for index, mode in enumerate(modes):
+                        if mode != _CHECK:
+                            continue
+                        if event.tag is not None and str(event.tag) != _STR_TAG:
+                            raise _NeedsFullParse
+                        results[index].append(
+                            KeyResult(
+                                documents - 1, frame[3] + (key,), bool(is_encrypted(event.value))
+                            )
+                        )
+
+                elif kind is MappingStartEvent or kind is SequenceStartEvent:
+                    if event.tag is not None:
+                        raise _NeedsFullParse
+                    is_mapping = kind is MappingStartEvent
+                    if not stack:
+                        if not is_mapping:
+                            raise _NeedsFullParse
+                        stack.append([True, search_all, None, (), 0])
+                        continue
+
+                    frame = stack[-1]
+                    if not frame[0]:
+                        # Only the mappings in a sequence are searched or checked
+                        modes = frame[1] if is_mapping else ignore_all
+                        key_path = frame[3] + (frame[4],)
+                        frame[4] += 1
+                    elif frame[2] is None:
+                        # A collection used as a key
+                        raise _NeedsFullParse
+                    else:
+                        key, modes = frame[2]
+                        key_path = frame[3] + (key,)
+                        frame[2] = None
+                    stack.append([is_mapping, modes, None, key_path, 0])
+
+                elif kind is MappingEndEvent or kind is SequenceEndEvent:
+                    stack.pop()
+
+                elif kind is AliasEvent:
+                    raise _NeedsFullParse
+
+                elif kind is DocumentStartEvent:
+                    if event.version is not None:
+                        raise _NeedsFullParse
+                    documents += 1
+    except _NeedsFullParse:
+        return None
+    except (ParserError, ScannerError, UnicodeDecodeError):
+        return [], False
+    except (YAMLError, OSError):
+        return None
 
-    # For UTF-8 or errors, use standard load_all_yaml
-    data = load_all_yaml(path)
-    return data, encoding if data else None
+    if not documents:
+        return [], False
+    return [key for result in results for key in result], True
 
 
 def find_by_key(data: Dict, target: Pattern[str]) -> Generator[Dict, None, None]:
@@ -113,18 +640,25 @@ def find_by_key(data: Dict, target: Pattern[str]) -> Generator[Dict, None, None]
         Generator[Dict, None, None]: Iterable of the innermost children
             of the 'target' key of the 'data' dictionary
     """
-    pattern: Pattern[str] = re.compile(target)
+    pattern = target if isinstance(target, re.Pattern) else re.compile(target)
+    yield from _find_by_key(data, pattern.search)
+
 
+def _find_by_key(
+    data: Dict, search: Callable[[str], Optional[Match[str]]]
+) -> Generator[Dict, None, None]:
+    # The regex is compiled once by find_by_key and its bound 'search' is
+    # passed down, so nothing is compiled or looked up per key.
     for key, value in data.items():
-        if pattern.search(key):
+        if search(key):
             yield {key: value}
         elif isinstance(value, dict):
-            yield from find_by_key(value, target)
+            yield from _find_by_key(value, search)
         elif isinstance(value, list):
             for elem in value:
                 if not isinstance(elem, dict):
                     continue
-                yield from find_by_key(elem, target)
+                yield from _find_by_key(elem, search)
 
 
 def all_dict_values(data: Dict) -> Generator[Tuple[str, str], None, None]:
@@ -149,38 +683,136 @@ def all_dict_values(data: Dict) -> Generator[Tuple[str, str], None, None]:
             yield key, str(value)
 
 
-def _load_gitignore_spec(search_path: Path) -> Optional[pathspec.PathSpec]:
-    """Load .gitignore patterns from the search path.
+# The names of the files and of the subdirectories of a directory
+_Listing = Tuple[List[str], List[str]]
+
+
+def _list_directory(directory: str) -> _Listing:
+    """List the files and the subdirectories of a directory, like os.walk.
 
     Args:
-        search_path (Path): The root path to search for .gitignore.
+        directory (str): The directory.
 
     Returns:
-        Optional[pathspec.PathSpec]: A PathSpec object, or None if no .gitignore found
-                                     or if parsing fails.
+        _Listing: The names of the files and of the subdirectories. Symbolic
+            links to directories are neither.
     """
-    gitignore_path = search_path / ".gitignore"
-    if not (gitignore_path.exists() and gitignore_path.is_file()):
-        return None
-
+    files: List[str] = []
+    dirs: List[str] = []
     try:
-        with open(gitignore_path, "r", encoding="utf-8") as f:
-            patterns = f.read().splitlines()
-        return pathspec.PathSpec.from_lines("gitwildmatch", patterns)
-    except (OSError, UnicodeDecodeError):
-        # File access or encoding issues - return None
-        return None
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # The type comes from the directory listing, no stat needed
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+    except OSError:
+        pass
+    return files, dirs
+
+
+# A directory of the tree: (its path, the prefix of the paths of its files,
+# its path relative to the root, with a trailing '/', the names of the
+# candidate files, a predicate on the relative paths of its files)
+_Directory = Tuple[Path, str, str, List[str], Callable[[str], bool]]
+
 
+def _file_prefix(directory: str) -> str:
+    # Like str(Path(directory) / name), which is just 'name' for '.'
+    return "" if directory == "." else os.path.join(directory, "")
 
-def find_all_files_by_regex(regex: Pattern[str], path: Path) -> Generator[Path, None, None]:
+
+def _candidate_directories(
+    path: Path,
+    files: Optional[Iterable[Path]] = None,
+    threads: int = 0,
+    matcher: Optional[IgnoreMatcher] = None,
+) -> Generator[_Directory, None, None]:
+    """Walk a directory tree once, pruning .git and ignored directories.
+
+    The paths of the files are left for the caller to build as strings, and
+    only the Path of each directory is created.
+
+    Args:
+        path (Path): Path of the root directory to walk.
+        files (Optional[Iterable[Path]]): If given, these files (inside 'path')
+            are the candidates and the tree is not walked.
+        threads (int): If greater than 0, the directories are listed ahead by
+            this many threads, e.g. on a network file system.
+        matcher (Optional[IgnoreMatcher]): The ignore files of the tree, if
+            already loaded.
+
+    Yields:
+        Generator[_Directory, None, None]: Iterable of the directories of the
+            tree with the files found in them, and a predicate telling whether
+            a file is excluded by the ignore files (see IgnoreMatcher).
+    """
+    if matcher is None:
+        matcher = IgnoreMatcher(path)
+
+    if files is not None:
+        for file_path in files:
+            relative_path = file_path.relative_to(path)
+            if ".git" in relative_path.parts:
+                continue
+            relative = relative_path.parent.as_posix() + "/"
+            yield (
+                file_path.parent,
+                _file_prefix(str(file_path.parent)),
+                "" if relative == "./" else relative,
+                [file_path.name],
+                matcher.is_ignored,
+            )
+        return
+
+    executor = ThreadPoolExecutor(threads) if threads > 0 else None
+    # Directories to list: (path, relative path, listing being made)
+    pending: Deque[Tuple[Path, str, Optional["Future[_Listing]"]]] = deque([(path, "", None)])
+    try:
+        while pending:
+            directory, relative, listing = pending.popleft()
+            prefix = _file_prefix(str(directory))
+            filenames, dirs = listing.result() if listing else _list_directory(str(directory))
+            chain = matcher.chain(relative, filenames)
+
+            for name in dirs:
+                # Exclude .git and the ignored directories
+                if name == ".git" or (chain and matcher.match(relative + name, True, chain)):
+                    continue
+                pending.append(
+                    (
+                        directory / name,
+                        relative + name + "/",
+                        executor.submit(_list_directory, prefix + name) if executor else None,
+                    )
+                )
+
+            yield directory, prefix, relative, filenames, matcher.predicate(relative)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_all_files_by_regex(
+    regex: Pattern[str], path: Path, threads: int = 0, matcher: Optional[IgnoreMatcher] = None
+) -> Generator[Path, None, None]:
     """Find all the files that match a regular expression.
 
-    Respects .gitignore patterns if a .gitignore file exists in the search path.
-    Automatically excludes .git directory.
+    Respects the .gitignore and .isopsignore files of the tree and
+    .git/info/exclude. Automatically excludes .git directory.
 
     Args:
         regex (Pattern[str]): Regex pattern (string or compiled).
         path (Path): Path of the root directory to search.
+        threads (int): Number of threads listing the directories, 0 lists
+            them serially.
+        matcher (Optional[IgnoreMatcher]): The ignore files of the tree, if
+            already loaded, e.g. by a long-running process.
 
     Yields:
         Generator[Path, None, None]: Iterable of all the files
@@ -188,26 +820,62 @@ def find_all_files_by_regex(regex: Pattern[str], path: Path) -> Generator[Path,
     """
     # Ensure pattern is compiled (handles both string and Pattern inputs)
     pattern = re.compile(regex) if isinstance(regex, str) else regex
-    gitignore_spec = _load_gitignore_spec(path)
 
-    for root, dirs, files in os.walk(path):
-        root_path = Path(root)
-        rel_root = root_path.relative_to(path)
+    for directory, prefix, relative, names, is_ignored in _candidate_directories(
+        path, threads=threads, matcher=matcher
+    ):
+        for name in names:
+            # Check if file matches the regex and is not ignored
+            if pattern.search(prefix + name) and not is_ignored(relative + name):
+                yield directory / name
 
-        # Filter directories: exclude .git and gitignored dirs in one pass
-        dirs[:] = [
-            d
-            for d in dirs
-            if d != ".git"
-            and (not gitignore_spec or not gitignore_spec.match_file(str(rel_root / d) + "/"))
-        ]
 
-        for file in files:
-            file_path = root_path / file
+def find_all_files_by_rules(
+    rule_sets: Sequence[Union[RuleMatcher, Sequence[Pattern[str]]]],
+    path: Path,
+    files: Optional[Iterable[Path]] = None,
+    threads: int = 0,
+    matcher: Optional[IgnoreMatcher] = None,
+) -> Generator[Tuple[Path, List[Tuple[int, int]]], None, None]:
+    """Assign every file in a directory tree to the creation rules that apply to it.
 
-            # Check if file matches the regex and is not ignored
-            if pattern.search(str(file_path)):
-                if not gitignore_spec or not gitignore_spec.match_file(
-                    str(file_path.relative_to(path))
-                ):
-                    yield file_path
+    The tree is walked (and .gitignore loaded) only once, no matter how many
+    rules there are. Within each rule set the first matching regex wins, like
+    sops does with the 'creation_rules' of a single config file. Each rule set
+    is matched by a RuleMatcher, rejecting most files with a single search.
+
+    Args:
+        rule_sets (Sequence[Union[RuleMatcher, Sequence[Pattern[str]]]]): The
+            'path_regex' of each rule, grouped by config file, or a RuleMatcher
+            of each group.
+        path (Path): Path of the root directory to search.
+        files (Optional[Iterable[Path]]): If given, only these files (inside
+            'path') are considered instead of walking the whole tree.
+        threads (int): Number of threads listing the directories, 0 lists
+            them serially.
+        matcher (Optional[IgnoreMatcher]): The ignore files of the tree, if
+            already loaded, e.g. by a long-running process.
+
+    Yields:
+        Generator[Tuple[Path, List[Tuple[int, int]]], None, None]: Iterable of
+            the matched files, each with the (rule set, rule) index pairs that
+            apply to it.
+    """
+    matchers = [
+        rule_set if isinstance(rule_set, RuleMatcher) else RuleMatcher(rule_set)
+        for rule_set in rule_sets
+    ]
+
+    for directory, prefix, relative, names, is_ignored in _candidate_directories(
+        path, files, threads, matcher
+    ):
+        for name in names:
+            file_str = prefix + name
+            matches: List[Tuple[int, int]] = []
+            for set_index, rule_matcher in enumerate(matchers):
+                rule_index = rule_matcher.first(file_str)
+                if rule_index is not None:
+                    matches.append((set_index, rule_index))
+
+            if matches and not is_ignored(relative + name):
+                yield directory / name, matches
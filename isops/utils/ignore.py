@@ -0,0 +1,308 @@
+import os
+import re
+from pathlib import Path
+from typing import Callable, Container, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+import pathspec
+
+from isops.utils.regex import can_be_combined
+
+# The ignore files read in every directory, in order of precedence
+IGNORE_FILES = (".gitignore", ".isopsignore")
+# Read only in the root directory, with the lowest precedence
+GIT_EXCLUDE_FILE = os.path.join(".git", "info", "exclude")
+
+_NAMED_GROUP = re.compile(r"\(\?P<\w+>")
+# How pathspec starts the regex of a pattern that matches at any depth
+_ANY_DEPTH = "^(?:.+/)?"
+# What pathspec appends to a pattern that matches a directory, so that it
+# matches the content of the directory too
+_DIR_MARK = "(?P<ps_d>/)"
+# The patterns matching what's inside a directory but not the directory
+# itself: how pathspec ends their regex (depending on its version), and the
+# end that matches like git
+_CONTENT_PATTERNS = (
+    ("/**/", ("(?:/.+)?(?P<ps_d>/).*$", "(?P<ps_d>/)"), r"/[\s\S]+/$"),
+    ("/**", ("/.*$", "/"), r"/[\s\S]"),
+)
+
+# The index of a pattern in its file and whether it ignores what it matches
+_PatternInfo = Tuple[int, bool]
+
+
+class IgnoreFile(NamedTuple):
+    """The compiled patterns of an ignore file.
+
+    The patterns are combined in two regexes with one group per pattern, the
+    last pattern first: one for the patterns of a single segment that can
+    match at any depth, only matched against the last segment of a path,
+    and one for the others. Each of them matches the path itself and not the
+    content of a directory, like git: the parents of a path are checked
+    before it.
+
+    Attributes:
+        directory (str): The directory of the file, relative to the root,
+            '' or ending with '/'.
+        spec (pathspec.PathSpec): The patterns.
+        regex (Optional[Pattern[str]]): The combined patterns matched
+            against the whole path, None if the patterns can't be combined
+            and 'spec' must be used.
+        groups (Tuple[_PatternInfo, ...]): The pattern of each group of 'regex'.
+        any_depth (Optional[Pattern[str]]): The combined patterns matched
+            against the last segment, without their leading '(?:.+/)?'.
+        any_depth_groups (Tuple[_PatternInfo, ...]): The pattern of each
+            group of 'any_depth'.
+    """
+
+    directory: str
+    spec: pathspec.PathSpec
+    regex: Optional[Pattern[str]]
+    groups: Tuple[_PatternInfo, ...]
+    any_depth: Optional[Pattern[str]]
+    any_depth_groups: Tuple[_PatternInfo, ...]
+
+
+# The ignore files that apply to a directory, from the root down
+IgnoreChain = Tuple[IgnoreFile, ...]
+
+
+def _is_anchored(source: str) -> bool:
+    # Whether the regex can only match at the start of the string: it starts
+    # with '^' and has no '|' outside of its groups
+    if not source.startswith("^"):
+        return False
+    depth, index = 0, 0
+    while index < len(source):
+        char = source[index]
+        if char == "\\":
+            index += 1
+        elif char == "[":
+            # A ']' right after the '[' (or '[^') is part of the class
+            index += 2 if source.startswith("[^", index) else 1
+            if source.startswith("]", index):
+                index += 1
+            while index < len(source) and source[index] != "]":
+                index += 2 if source[index] == "\\" else 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return False
+        index += 1
+    return True
+
+
+def _source(regex: str, text: str) -> Optional[str]:
+    # The regex of a pattern, rewritten to match only the path itself like
+    # git does: the content of a directory is ignored with the directory,
+    # since the parents of a path are checked first. None if the regex
+    # doesn't have the shape of those written by pathspec.
+    for ending, suffixes, replacement in _CONTENT_PATTERNS:
+        if text.rstrip().endswith(ending):
+            suffix = next((suffix for suffix in suffixes if regex.endswith(suffix)), None)
+            base = regex[: -len(suffix)] if suffix is not None else ""
+            if not base.startswith("^") or base == "^":
+                return None
+            regex = base + replacement
+            break
+    return _NAMED_GROUP.sub("(?:", regex.replace(_DIR_MARK, "/$"))
+
+
+def _combine(alternatives: List[str]) -> Optional[Pattern[str]]:
+    # One group per alternative, None if they can't be combined
+    try:
+        combined = re.compile(
+            "|".join(f"({alternative})" for alternative in alternatives) or "(?!)"
+        )
+    except re.error:
+        return None
+    return combined if combined.groups == len(alternatives) else None
+
+
+def _compile(directory: str, spec: pathspec.PathSpec) -> IgnoreFile:
+    # The last matching pattern decides, so the patterns are tried in
+    # reverse order and the first matching alternative is the one. The
+    # alternatives of 'regex' are anchored to the start of the path, so that
+    # matching it finds a match of any of them, wherever pathspec would have
+    # searched it.
+    fallback = IgnoreFile(directory, spec, None, (), None, ())
+    alternatives: List[str] = []
+    groups: List[_PatternInfo] = []
+    any_depth: List[str] = []
+    any_depth_groups: List[_PatternInfo] = []
+    for index in reversed(range(len(spec.patterns))):
+        pattern = spec.patterns[index]
+        regex = getattr(pattern, "regex", None)
+        if pattern.include is None or regex is None:
+            continue
+        if not can_be_combined(regex):
+            return fallback
+        text = str(getattr(pattern, "pattern", "/"))
+        source = _source(regex.pattern, text)
+        if source is None:
+            return fallback
+        # e.g. '*.tmp' or 'build/', but not '**/a/b' which spans two segments
+        if source.startswith(_ANY_DEPTH) and "/" not in text.rstrip().rstrip("/"):
+            any_depth.append(source[len(_ANY_DEPTH) :])
+            any_depth_groups.append((index, pattern.include))
+        else:
+            alternatives.append(source if _is_anchored(source) else rf"[\s\S]*?(?:{source})")
+            groups.append((index, pattern.include))
+    if not alternatives and not any_depth:
+        return fallback
+    combined, any_depth_combined = _combine(alternatives), _combine(any_depth)
+    if combined is None or any_depth_combined is None:
+        return fallback
+    return IgnoreFile(
+        directory, spec, combined, tuple(groups), any_depth_combined, tuple(any_depth_groups)
+    )
+
+
+def _match(ignore_file: IgnoreFile, path: str) -> Optional[bool]:
+    # Whether the last matching pattern ignores the path, None if none matches
+    if ignore_file.regex is None or ignore_file.any_depth is None:
+        return ignore_file.spec.check_file(path).include
+    found: Optional[_PatternInfo] = None
+    match = ignore_file.regex.match(path)
+    if match is not None and match.lastindex is not None:
+        found = ignore_file.groups[match.lastindex - 1]
+    if ignore_file.any_depth_groups and (
+        found is None or found[0] < ignore_file.any_depth_groups[0][0]
+    ):
+        # The parent directories are matched on their own, so only the
+        # last segment of the path needs to be
+        match = ignore_file.any_depth.match(path, path.rfind("/", 0, len(path) - 1) + 1)
+        if match is not None and match.lastindex is not None:
+            info = ignore_file.any_depth_groups[match.lastindex - 1]
+            if found is None or info[0] > found[0]:
+                found = info
+    return None if found is None else found[1]
+
+
+def _load(directory: str, path: Path) -> Optional[IgnoreFile]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            patterns = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        # Missing file, or access and encoding issues
+        return None
+    spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+    return _compile(directory, spec) if len(spec) else None
+
+
+class IgnoreMatcher:
+    """The files of a directory tree that are excluded, like git does.
+
+    The .gitignore and .isopsignore of each directory apply to the files
+    below it, with the deeper files (and the later patterns of a file)
+    taking precedence, and .git/info/exclude applies to the whole tree.
+    Each ignore file is compiled once. A file inside an ignored directory
+    is always ignored, so ignored directories don't need to be walked.
+
+    Paths are relative to the root and use '/' as separator.
+    """
+
+    def __init__(self, root: Path) -> None:
+        """Load the ignore files of the root directory.
+
+        Args:
+            root (Path): The root of the tree.
+        """
+        self.root = Path(root)
+        self._chains: Dict[str, IgnoreChain] = {}
+        self._ignored_dirs: Dict[str, bool] = {"": False}
+
+        chain = []
+        for name in (GIT_EXCLUDE_FILE,) + IGNORE_FILES:
+            ignore_file = _load("", self.root / name)
+            if ignore_file is not None:
+                chain.append(ignore_file)
+        self._chains[""] = tuple(chain)
+
+    def chain(self, directory: str, names: Optional[Container[str]] = None) -> IgnoreChain:
+        """Return the compiled ignore files that apply to the content of a directory.
+
+        Args:
+            directory (str): The directory, '' for the root or ending with '/'.
+            names (Optional[Container[str]]): The names of the files in the
+                directory, if known, to avoid looking for missing ignore files.
+
+        Returns:
+            IgnoreChain: The ignore files, from the root down to the directory.
+        """
+        chain = self._chains.get(directory)
+        if chain is not None:
+            return chain
+
+        parent = directory[: directory.rstrip("/").rfind("/") + 1]
+        chain = self.chain(parent)
+        for name in IGNORE_FILES:
+            if names is not None and name not in names:
+                continue
+            ignore_file = _load(directory, self.root / directory / name)
+            if ignore_file is not None:
+                chain += (ignore_file,)
+        self._chains[directory] = chain
+        return chain
+
+    @staticmethod
+    def match(path: str, is_dir: bool, chain: IgnoreChain) -> bool:
+        """Tell whether a path is excluded by the ignore files of its directory.
+
+        Args:
+            path (str): The path relative to the root.
+            is_dir (bool): Whether the path is a directory.
+            chain (IgnoreChain): The ignore files of the directory of 'path'.
+
+        Returns:
+            bool: True if the path is ignored.
+        """
+        if is_dir:
+            path += "/"
+        # The deepest ignore file with a matching pattern decides
+        for ignore_file in reversed(chain):
+            include = _match(ignore_file, path[len(ignore_file.directory) :])
+            if include is not None:
+                return include
+        return False
+
+    def _is_dir_ignored(self, directory: str) -> bool:
+        # 'directory' ends with '/': it's ignored if one of its parents is
+        ignored = self._ignored_dirs.get(directory)
+        if ignored is None:
+            parent = directory[: directory.rstrip("/").rfind("/") + 1]
+            ignored = self._is_dir_ignored(parent) or self.match(
+                directory.rstrip("/"), True, self.chain(parent)
+            )
+            self._ignored_dirs[directory] = ignored
+        return ignored
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """Tell whether a path, or one of its parent directories, is excluded.
+
+        Args:
+            path (str): The path relative to the root.
+            is_dir (bool): Whether the path is a directory.
+
+        Returns:
+            bool: True if the path is ignored.
+        """
+        directory = path[: path.rfind("/") + 1]
+        return self._is_dir_ignored(directory) or self.match(path, is_dir, self.chain(directory))
+
+    def predicate(self, directory: str) -> Callable[[str], bool]:
+        """Return a predicate telling whether a file of a directory is ignored.
+
+        Args:
+            directory (str): The directory, '' for the root or ending with '/'.
+                It must not be ignored itself.
+
+        Returns:
+            Callable[[str], bool]: The predicate, taking the path (relative to
+                the root) of a file directly inside 'directory'.
+        """
+        chain = self.chain(directory)
+        if not chain:
+            return lambda path: False
+        return lambda path: self.match(path, False, chain)
@@ -0,0 +1,51 @@
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
+
+# The parsed documents of a YAML file, with its content, take up to about
+# this many times its size
+LOAD_FACTOR = 8
+
+
+class MemoryLimitError(Exception):
+    """Raised when checking a file makes the process grow past its memory limit."""
+
+    def __init__(self, path: Path, limit: int) -> None:
+        """Create the error.
+
+        Args:
+            path (Path): The file being checked.
+            limit (int): The memory limit, in bytes.
+        """
+        super().__init__(path, limit)
+        self.path = path
+        self.limit = limit
+
+    def __str__(self) -> str:
+        """Describe the error."""
+        return f"Checking {self.path} needs more than {self.limit // (1024 * 1024)} MiB."
+
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of the process.
+
+    Returns:
+        Optional[int]: The size in bytes, the peak size where the current one
+            isn't available, or None if neither is.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
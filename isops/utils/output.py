@@ -0,0 +1,107 @@
+import sys
+from pathlib import Path
+from typing import IO, Any, List, Optional
+
+import click
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class OutputWriter:
+    """A buffered writer of the human readable output.
+
+    Lines are accumulated and written in chunks of about 'buffer_size'
+    characters instead of one write (and flush) per key. When the output is
+    not a terminal the lines are not styled at all, instead of being styled
+    and then stripped. Call flush() once done.
+    """
+
+    def __init__(
+        self,
+        file: Optional[IO[Any]] = None,
+        color: Optional[bool] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        quiet: bool = False,
+    ) -> None:
+        """Create a writer with an empty buffer.
+
+        Args:
+            file (Optional[IO[Any]]): The stream to write to, stdout by default.
+            color (Optional[bool]): Force (or disable) the ANSI styles. By
+                default they are used only if 'file' is a terminal.
+            buffer_size (int): The number of buffered characters that
+                triggers a write.
+            quiet (bool): Don't print the SAFE keys.
+        """
+        self.file = file if file is not None else sys.stdout
+        if color is None:
+            isatty = getattr(self.file, "isatty", None)
+            color = bool(isatty and isatty())
+        self.color = color
+        self.buffer_size = buffer_size
+        self.quiet = quiet
+        self._chunks: List[str] = []
+        self._size = 0
+
+        self._safe = self.style("[SAFE]", bold=False, fg="green")
+        self._unsafe = self.style("[UNSAFE]", bold=False, fg="red")
+        self._utf16 = self.style(" [UTF-16 ENCODING]", bold=False, fg="yellow")
+
+    def style(self, text: str, **styles: Any) -> str:
+        """Style a text, if the output is styled.
+
+        Args:
+            text (str): The text to style.
+            **styles (Any): The click.style arguments, e.g. 'fg' or 'bold'.
+
+        Returns:
+            str: The styled text.
+        """
+        return click.style(text, **styles) if self.color else text
+
+    def write(self, text: str) -> None:
+        """Buffer some (already styled) text.
+
+        Args:
+            text (str): The text to write.
+        """
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def secho(self, message: str, nl: bool = True, **styles: Any) -> None:
+        """Buffer a message, like click.secho.
+
+        Args:
+            message (str): The message to write.
+            nl (bool): Append a newline.
+            **styles (Any): The click.style arguments, e.g. 'fg' or 'bold'.
+        """
+        self.write(self.style(message, **styles) + ("\n" if nl else ""))
+
+    def status(self, file: Path, key: str, is_safe: bool, encoding: Optional[str]) -> None:
+        """Buffer the status line of a key, with an optional encoding warning.
+
+        Args:
+            file (Path): The file path being checked.
+            key (str): The secret key name.
+            is_safe (bool): Whether the secret is safely encrypted.
+            encoding (Optional[str]): The detected file encoding, or None.
+        """
+        if is_safe and self.quiet:
+            return
+        status = self._safe if is_safe else self._unsafe
+        if encoding and encoding.startswith("utf-16"):
+            self.write(f"{file}::{key} {status}{self._utf16}\n")
+        else:
+            self.write(f"{file}::{key} {status}\n")
+
+    def flush(self) -> None:
+        """Write the buffered text."""
+        if not self._chunks:
+            return
+        text = "".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        click.echo(text, file=self.file, nl=False, color=self.color)
@@ -0,0 +1,85 @@
+from functools import lru_cache
+from typing import Dict, Optional
+
+from ruamel.yaml import YAML
+from ruamel.yaml.parser import Parser
+
+# "auto" uses the C parser (libyaml, from ruamel.yaml.clib) when it is installed
+PARSERS = ["auto", "c", "pure"]
+DEFAULT_PARSER = "auto"
+
+_parser = DEFAULT_PARSER
+# The shared safe YAML instance of each backend, by 'pure'
+_instances: Dict[bool, YAML] = {}
+
+
+class ParserUnavailableError(Exception):
+    """Raised when the C parser is requested but ruamel.yaml.clib is not installed."""
+
+
+@lru_cache(maxsize=None)
+def c_parser_available() -> bool:
+    """Tell whether the C parser can be used.
+
+    Returns:
+        bool: True if ruamel.yaml.clib is installed.
+    """
+    return YAML(typ="safe").Parser is not Parser
+
+
+def set_parser(parser: str) -> None:
+    """Select the parser backend used when none is given.
+
+    Args:
+        parser (str): One of PARSERS.
+
+    Raises:
+        ValueError: If the backend is not one of PARSERS.
+        ParserUnavailableError: If the C parser is not installed.
+    """
+    global _parser
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser: {parser}")
+    if parser == "c" and not c_parser_available():
+        raise ParserUnavailableError("The C parser is not available: install ruamel.yaml.clib.")
+    _parser = parser
+
+
+def get_parser() -> str:
+    """Return the parser backend used when none is given.
+
+    Returns:
+        str: One of PARSERS.
+    """
+    return _parser
+
+
+def get_yaml(parser: Optional[str] = None) -> YAML:
+    """Return the safe YAML instance of a parser backend.
+
+    The instance is created once and shared by all the loads of the process,
+    so it must not be used by several threads at once.
+
+    Args:
+        parser (Optional[str]): One of PARSERS, the one selected with
+            set_parser() by default.
+
+    Raises:
+        ParserUnavailableError: If the C parser is not installed.
+
+    Returns:
+        YAML: The YAML instance.
+    """
+    parser = parser or _parser
+    if parser == "c" and not c_parser_available():
+        raise ParserUnavailableError("The C parser is not available: install ruamel.yaml.clib.")
+    pure = parser == "pure"
+    yaml = _instances.get(pure)
+    if yaml is None:
+        yaml = _instances[pure] = YAML(typ="safe", pure=pure)
+    # Every load appends to 'doc_infos', which would grow without bound in a
+    # long-running process: it's only needed while a stream is being loaded
+    doc_infos = getattr(yaml, "doc_infos", None)
+    if doc_infos:
+        doc_infos.clear()
+    return yaml
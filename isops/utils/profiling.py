@@ -0,0 +1,244 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import (
+    ContextManager,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+PROFILE_FORMATS = ["table", "json"]
+PROFILE_TOP_FILES = 10
+
+# Stage name -> [wall time, CPU time, calls]
+Timings = Dict[str, List[float]]
+
+_T = TypeVar("_T")
+_DISABLED = nullcontext()
+
+
+class StageTimer:
+    """Accumulate the wall and CPU time spent in named stages.
+
+    A disabled timer does nothing, so the stages can be left in the hot
+    paths at (almost) no cost.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        """Create a timer with no recorded stage.
+
+        Args:
+            enabled (bool): If False, stages are not timed.
+        """
+        self.enabled = enabled
+        self.timings: Timings = {}
+
+    def stage(self, name: str) -> ContextManager:
+        """Time a block of code.
+
+        Args:
+            name (str): The stage the block belongs to. Repeated stages are
+                summed up.
+
+        Returns:
+            ContextManager: The context manager that times the block.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str) -> Generator[None, None, None]:
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.timings.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+            totals[2] += 1
+
+    def add(self, timings: Timings, prefix: str = "") -> None:
+        """Add the timings recorded by another timer, e.g. in a worker process.
+
+        Args:
+            timings (Timings): The timings to add.
+            prefix (str): Prepended to the name of each stage.
+        """
+        for name, (wall, cpu, calls) in timings.items():
+            totals = self.timings.setdefault(prefix + name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+
+
+class Profiler(StageTimer):
+    """Per-stage and per-file timings of a whole run."""
+
+    def __init__(self, enabled: bool = True, top: int = PROFILE_TOP_FILES) -> None:
+        """Create a profiler with no recorded stage or file.
+
+        Args:
+            enabled (bool): If False, nothing is recorded.
+            top (int): Number of slowest files to report.
+        """
+        super().__init__(enabled)
+        self.top = top
+        self.files = 0
+        self.cached_files = 0
+        self.bytes = 0
+        # Counters summed across the checked files, e.g. the key names looked up
+        self.counts: Dict[str, int] = {}
+        self._started = time.perf_counter()
+        # (wall time, CPU time, path) of each checked file
+        self._file_timings: List[Tuple[float, float, Path]] = []
+
+    def timed(self, name: str, iterable: Iterable[_T]) -> Generator[_T, None, None]:
+        """Time how long each item of an iterable takes to be produced.
+
+        Args:
+            name (str): The stage the time is added to.
+            iterable (Iterable[_T]): The iterable, e.g. a generator of results.
+
+        Yields:
+            Generator[_T, None, None]: The items of the iterable.
+        """
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.stage(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def record_file(
+        self, path: Path, timings: Optional[Timings], counts: Optional[Dict[str, int]] = None
+    ) -> None:
+        """Record the stages of a checked file.
+
+        Args:
+            path (Path): The checked file.
+            timings (Optional[Timings]): Its stages, None if it came from
+                the results cache.
+            counts (Optional[Dict[str, int]]): Its counters, e.g. the key
+                names looked up.
+        """
+        if not self.enabled:
+            return
+        self.files += 1
+        try:
+            self.bytes += path.stat().st_size
+        except OSError:
+            pass
+        for name, count in (counts or {}).items():
+            self.counts[name] = self.counts.get(name, 0) + count
+        if timings is None:
+            self.cached_files += 1
+            return
+        self.add(timings, prefix="check/")
+        wall = sum(wall for wall, _, _ in timings.values())
+        cpu = sum(cpu for _, cpu, _ in timings.values())
+        self._file_timings.append((wall, cpu, path))
+
+    def as_dict(self) -> Dict:
+        """Return the profile as a JSON serializable dictionary.
+
+        Returns:
+            Dict: The stages, the file throughput, the key names looked up
+                and the slowest files.
+        """
+        elapsed = time.perf_counter() - self._started
+        check_wall = self.timings.get("check", [0.0])[0]
+        lookups = self.counts.get("key_lookups", 0)
+        memo_hits = self.counts.get("key_memo_hits", 0)
+        slowest = sorted(self._file_timings, key=lambda timing: timing[0], reverse=True)
+
+        # Sub-stages ("check/read") are listed right after their stage
+        order: Dict[str, int] = {}
+        for name in self.timings:
+            order.setdefault(name.split("/", 1)[0], len(order))
+        names = sorted(self.timings, key=lambda name: (order[name.split("/", 1)[0]], "/" in name))
+
+        return {
+            "total": elapsed,
+            "stages": {
+                name: {
+                    "wall": self.timings[name][0],
+                    "cpu": self.timings[name][1],
+                    "calls": int(self.timings[name][2]),
+                }
+                for name in names
+            },
+            "files": {
+                "checked": self.files,
+                "cached": self.cached_files,
+                "bytes": self.bytes,
+                "files_per_second": self.files / check_wall if check_wall else None,
+                "bytes_per_second": self.bytes / check_wall if check_wall else None,
+            },
+            "keys": {
+                "lookups": lookups,
+                "memo_hits": memo_hits,
+                "memo_hit_rate": memo_hits / lookups if lookups else None,
+            },
+            "slowest_files": [
+                {"path": str(path), "wall": wall, "cpu": cpu}
+                for wall, cpu, path in slowest[: self.top]
+            ],
+        }
+
+    def report(self, format: str = "table") -> str:
+        """Format the profile.
+
+        Args:
+            format (str): One of PROFILE_FORMATS.
+
+        Returns:
+            str: The profile, as a table or as JSON.
+        """
+        profile = self.as_dict()
+        if format == "json":
+            return json.dumps(profile, indent=2)
+
+        lines = [f"{'Stage':<24}{'Wall (s)':>12}{'CPU (s)':>12}{'Calls':>10}"]
+        for name, stage in profile["stages"].items():
+            # Per-file stages are summed across worker processes
+            label = f"  {name.split('/', 1)[1]}" if "/" in name else name
+            lines.append(
+                f"{label:<24}{stage['wall']:>12.4f}{stage['cpu']:>12.4f}{stage['calls']:>10}"
+            )
+        lines.append(f"{'total':<24}{profile['total']:>12.4f}")
+
+        files = profile["files"]
+        line = f"Files: {files['checked']} ({files['cached']} cached), {files['bytes']} bytes"
+        if files["files_per_second"] is not None:
+            line += (
+                f", {files['files_per_second']:.1f} files/s"
+                f", {files['bytes_per_second'] / (1024 * 1024):.2f} MiB/s"
+            )
+        lines += ["", line]
+
+        keys = profile["keys"]
+        if keys["memo_hit_rate"] is not None:
+            lines.append(
+                f"Key names: {keys['lookups']} looked up"
+                f", {keys['memo_hit_rate']:.1%} found in the memo"
+            )
+
+        if profile["slowest_files"]:
+            lines += ["", "Slowest files:"]
+            for entry in profile["slowest_files"]:
+                lines.append(f"{entry['wall']:>12.4f}s  {entry['path']}")
+        return "\n".join(lines)
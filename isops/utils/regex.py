@@ -0,0 +1,23 @@
+import re
+from typing import Pattern
+
+_DEFAULT_FLAGS = re.compile("").flags
+# Backreferences and conditionals, whose meaning changes once the regexes are combined
+_GROUP_REFERENCE: Pattern[str] = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+def can_be_combined(pattern: Pattern[str]) -> bool:
+    """Tell whether a regex keeps its meaning as an alternative of a bigger regex.
+
+    Args:
+        pattern (Pattern[str]): The compiled regex.
+
+    Returns:
+        bool: True if it's a str regex with the default flags, and without
+            backreferences or conditionals.
+    """
+    return (
+        isinstance(pattern.pattern, str)
+        and pattern.flags == _DEFAULT_FLAGS
+        and not _GROUP_REFERENCE.search(pattern.pattern)
+    )
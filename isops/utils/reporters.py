@@ -0,0 +1,385 @@
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Type
+from xml.sax.saxutils import quoteattr
+
+import click
+
+from isops import __version__
+from isops.utils.helpers import KeyResult
+from isops.utils.output import OutputWriter
+
+DEFAULT_FORMAT = "text"
+
+REPORTERS: Dict[str, Type["Reporter"]] = {}
+
+
+def register_reporter(name: str) -> Callable[[Type["Reporter"]], Type["Reporter"]]:
+    """Register a reporter class under a '--format' name.
+
+    Args:
+        name (str): The name of the format.
+
+    Returns:
+        Callable[[Type[Reporter]], Type[Reporter]]: The class decorator.
+    """
+
+    def decorator(cls: Type["Reporter"]) -> Type["Reporter"]:
+        REPORTERS[name] = cls
+        return cls
+
+    return decorator
+
+
+def _format_path(key: KeyResult) -> str:
+    # e.g. "data.users[0].password", and its document if not the first
+    path = "".join(f"[{item}]" if isinstance(item, int) else f".{item}" for item in key.path)
+    path = path[1:]
+    return f"{path} (document {key.document})" if key.document else path
+
+
+class Reporter(ABC):
+    """Report the results of the checks as they are produced.
+
+    Reporters write one record per key (or file) to an OutputWriter and
+    keep nothing but what their format needs to be closed. Messages that
+    aren't results (config files, errors) go to stderr, so stdout only
+    contains the report.
+    """
+
+    def __init__(self, output: OutputWriter, summary: bool = False) -> None:
+        """Create a reporter.
+
+        Args:
+            output (OutputWriter): Where the report is written.
+            summary (bool): Report a summary at the end of the checks.
+        """
+        self.output = output
+        self.summary = summary
+
+    def message(self, message: str, **styles: Any) -> None:
+        """Report a message that isn't a result, e.g. a config file or an error.
+
+        Args:
+            message (str): The message.
+            **styles (Any): The click.style arguments, e.g. 'fg' or 'bold'.
+        """
+        click.secho(message, err=True, **styles)
+
+    def start(self) -> None:  # noqa: B027
+        """Start the checks, once the config files are loaded."""
+
+    @abstractmethod
+    def key(self, file: Path, key: KeyResult, encoding: Optional[str]) -> None:
+        """Report a checked key.
+
+        Args:
+            file (Path): The file the key is in.
+            key (KeyResult): The checked key.
+            encoding (Optional[str]): The detected file encoding, or None.
+        """
+
+    @abstractmethod
+    def invalid_file(self, file: Path) -> None:
+        """Report a file that isn't a valid YAML. The checks stop after it.
+
+        Args:
+            file (Path): The invalid file.
+        """
+
+    def finish(self, safe: int, unsafe: int, broken: Optional[Path]) -> None:  # noqa: B027
+        """End the report.
+
+        Args:
+            safe (int): The number of safe keys.
+            unsafe (int): The number of unsafe keys.
+            broken (Optional[Path]): The invalid file that stopped the checks.
+        """
+
+
+@register_reporter("text")
+class TextReporter(Reporter):
+    """The human readable report, optionally colored."""
+
+    def __init__(self, output: OutputWriter, summary: bool = False) -> None:
+        """Create a text reporter.
+
+        Args:
+            output (OutputWriter): Where the report is written.
+            summary (bool): Print a summary at the end of the checks.
+        """
+        super().__init__(output, summary)
+        self._unsafe_keys: List[str] = []
+
+    def message(self, message: str, **styles: Any) -> None:
+        """Print a message in the report.
+
+        Args:
+            message (str): The message.
+            **styles (Any): The click.style arguments, e.g. 'fg' or 'bold'.
+        """
+        self.output.secho(message, **styles)
+
+    def start(self) -> None:
+        """Separate the config files from the results."""
+        self.output.secho("---", bold=True)
+
+    def key(self, file: Path, key: KeyResult, encoding: Optional[str]) -> None:
+        """Print the status line of a key.
+
+        Args:
+            file (Path): The file the key is in.
+            key (KeyResult): The checked key.
+            encoding (Optional[str]): The detected file encoding, or None.
+        """
+        self.output.status(file, key.key, key.is_safe, encoding)
+        if self.summary and not key.is_safe:
+            self._unsafe_keys.append(f"UNSAFE secret '{key.key}' in '{file}'")
+
+    def invalid_file(self, file: Path) -> None:
+        """Print that a file isn't a valid YAML.
+
+        Args:
+            file (Path): The invalid file.
+        """
+        self.output.secho(f"{file} is not a valid YAML!", bold=True, fg="red")
+
+    def finish(self, safe: int, unsafe: int, broken: Optional[Path]) -> None:
+        """Print the summary, if requested.
+
+        Args:
+            safe (int): The number of safe keys.
+            unsafe (int): The number of unsafe keys.
+            broken (Optional[Path]): The invalid file that stopped the checks.
+        """
+        if not self.summary:
+            return
+        self.output.secho("---", bold=True)
+        self.output.secho("Summary:", bold=True, fg="blue")
+        if broken:
+            self.output.secho(
+                f"The yaml '{broken}' is broken, checks incomplete!", bold=True, fg="red"
+            )
+            return
+        for entry in self._unsafe_keys:
+            self.output.secho(entry, bold=False, fg="red")
+        self.output.secho(f"{safe} safe ", bold=True, nl=False, fg="green")
+        self.output.secho(f"{unsafe} unsafe", bold=True, fg="red")
+
+
+@register_reporter("jsonl")
+class JsonLinesReporter(Reporter):
+    """One JSON object per line and per key."""
+
+    def _record(self, record: Dict) -> None:
+        self.output.write(json.dumps(record) + "\n")
+
+    def key(self, file: Path, key: KeyResult, encoding: Optional[str]) -> None:
+        """Write the record of a key.
+
+        Args:
+            file (Path): The file the key is in.
+            key (KeyResult): The checked key.
+            encoding (Optional[str]): The detected file encoding, or None.
+        """
+        if key.is_safe and self.output.quiet:
+            return
+        self._record(
+            {
+                "file": str(file),
+                "key": key.key,
+                "path": list(key.path),
+                "document": key.document,
+                "safe": key.is_safe,
+                "encoding": encoding,
+            }
+        )
+
+    def invalid_file(self, file: Path) -> None:
+        """Write the record of an invalid file.
+
+        Args:
+            file (Path): The invalid file.
+        """
+        self._record({"file": str(file), "error": "not a valid YAML"})
+
+    def finish(self, safe: int, unsafe: int, broken: Optional[Path]) -> None:
+        """Write the summary record, if requested.
+
+        Args:
+            safe (int): The number of safe keys.
+            unsafe (int): The number of unsafe keys.
+            broken (Optional[Path]): The invalid file that stopped the checks.
+        """
+        if self.summary:
+            self._record(
+                {
+                    "summary": {
+                        "safe": safe,
+                        "unsafe": unsafe,
+                        "broken": str(broken) if broken else None,
+                    }
+                }
+            )
+
+
+@register_reporter("sarif")
+class SarifReporter(Reporter):
+    """A SARIF 2.1.0 log with one result per unsafe key."""
+
+    RULES = [
+        {
+            "id": "unencrypted-secret",
+            "shortDescription": {"text": "Secret not encrypted with sops"},
+        },
+        {"id": "invalid-yaml", "shortDescription": {"text": "File is not a valid YAML"}},
+    ]
+
+    def __init__(self, output: OutputWriter, summary: bool = False) -> None:
+        """Create a SARIF reporter.
+
+        Args:
+            output (OutputWriter): Where the report is written.
+            summary (bool): Ignored, the SARIF log has no summary.
+        """
+        super().__init__(output, summary)
+        self._started = False
+        self._results = 0
+
+    def _result(self, rule_id: str, file: Path, message: str) -> None:
+        self._start()
+        result = {
+            "ruleId": rule_id,
+            "level": "error",
+            "message": {"text": message},
+            "locations": [{"physicalLocation": {"artifactLocation": {"uri": file.as_posix()}}}],
+        }
+        separator = ",\n" if self._results else "\n"
+        self._results += 1
+        self.output.write(separator + json.dumps(result))
+
+    def _start(self) -> None:
+        # The log is only started once there is something to report, so
+        # that an error in the configuration doesn't leave it half written
+        if self._started:
+            return
+        self._started = True
+        header = json.dumps(
+            {
+                "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+                "version": "2.1.0",
+                "runs": [
+                    {
+                        "tool": {
+                            "driver": {
+                                "name": "isops",
+                                "version": __version__,
+                                "informationUri": "https://github.com/lorenzophys/isops",
+                                "rules": self.RULES,
+                            }
+                        },
+                        "results": [],
+                    }
+                ],
+            }
+        )
+        # The results are streamed into the (last) empty list of the log
+        self.output.write(header[: header.rindex("[]") + 1])
+
+    def key(self, file: Path, key: KeyResult, encoding: Optional[str]) -> None:
+        """Write a result for an unsafe key.
+
+        Args:
+            file (Path): The file the key is in.
+            key (KeyResult): The checked key.
+            encoding (Optional[str]): The detected file encoding, or None.
+        """
+        if not key.is_safe:
+            self._result(
+                "unencrypted-secret",
+                Path(file),
+                f"UNSAFE secret '{_format_path(key)}' in '{file}'",
+            )
+
+    def invalid_file(self, file: Path) -> None:
+        """Write a result for an invalid file.
+
+        Args:
+            file (Path): The invalid file.
+        """
+        self._result("invalid-yaml", Path(file), f"{file} is not a valid YAML!")
+
+    def finish(self, safe: int, unsafe: int, broken: Optional[Path]) -> None:
+        """Close the log.
+
+        Args:
+            safe (int): The number of safe keys.
+            unsafe (int): The number of unsafe keys.
+            broken (Optional[Path]): The invalid file that stopped the checks.
+        """
+        self._start()
+        self.output.write("\n]}]}\n")
+
+
+@register_reporter("junit")
+class JUnitReporter(Reporter):
+    """A JUnit XML report with one test case per key."""
+
+    def __init__(self, output: OutputWriter, summary: bool = False) -> None:
+        """Create a JUnit reporter.
+
+        Args:
+            output (OutputWriter): Where the report is written.
+            summary (bool): Ignored, the report has no summary.
+        """
+        super().__init__(output, summary)
+        self._started = False
+
+    def _start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        self.output.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n<testsuite name="isops">\n'
+        )
+
+    def _testcase(self, file: Path, name: str, failure: str = "") -> None:
+        self._start()
+        testcase = f"<testcase classname={quoteattr(str(file))} name={quoteattr(name)}"
+        if failure:
+            testcase += f"><failure message={quoteattr(failure)}/></testcase>\n"
+        else:
+            testcase += "/>\n"
+        self.output.write(testcase)
+
+    def key(self, file: Path, key: KeyResult, encoding: Optional[str]) -> None:
+        """Write the test case of a key.
+
+        Args:
+            file (Path): The file the key is in.
+            key (KeyResult): The checked key.
+            encoding (Optional[str]): The detected file encoding, or None.
+        """
+        if key.is_safe and self.output.quiet:
+            return
+        self._testcase(file, _format_path(key), "" if key.is_safe else "UNSAFE secret")
+
+    def invalid_file(self, file: Path) -> None:
+        """Write a failed test case for an invalid file.
+
+        Args:
+            file (Path): The invalid file.
+        """
+        self._testcase(file, "valid YAML", "not a valid YAML")
+
+    def finish(self, safe: int, unsafe: int, broken: Optional[Path]) -> None:
+        """Close the report.
+
+        Args:
+            safe (int): The number of safe keys.
+            unsafe (int): The number of unsafe keys.
+            broken (Optional[Path]): The invalid file that stopped the checks.
+        """
+        self._start()
+        self.output.write("</testsuite>\n</testsuites>\n")
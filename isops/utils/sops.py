@@ -1,5 +1,184 @@
+import math
 import re
-from typing import Match, Optional, Pattern
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Match,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Union,
+)
+
+from isops.utils.regex import can_be_combined
+
+DEFAULT_PATH_REGEX = r".ya?ml$"
+DEFAULT_ENCRYPTED_REGEX = r""
+
+ENCRYPTION_PATTERN: Pattern[str] = re.compile(
+    r"^ENC\[AES256_GCM,data:(.+),iv:(.+),tag:(.+),type:(.+)\]"
+)
+
+# The key names remembered by a KeyMatcher
+KEY_MATCHER_SIZE = 10000
+
+# The regexes of a RuleMatcher are combined in blocks of at least this many
+MIN_RULE_BLOCK_SIZE = 8
+
+
+class InvalidRuleError(ValueError):
+    """Raised when a creation rule has an invalid regex."""
+
+
+class CreationRule(NamedTuple):
+    """A sops creation rule with its regexes compiled once.
+
+    Attributes:
+        path_regex (Pattern[str]): The files the rule applies to.
+        encrypted_regex (Pattern[str]): The keys that must be encrypted.
+    """
+
+    path_regex: Pattern[str]
+    encrypted_regex: Pattern[str]
+
+    @classmethod
+    def from_config(cls, rule: Dict) -> "CreationRule":
+        """Compile a rule of the 'creation_rules' of a sops config file.
+
+        Args:
+            rule (Dict): The rule, as found in the config file. Missing
+                regexes get the default values.
+
+        Raises:
+            InvalidRuleError: If one of the regexes is not valid.
+
+        Returns:
+            CreationRule: The compiled rule.
+        """
+        compiled = []
+        for field, default in [
+            ("path_regex", DEFAULT_PATH_REGEX),
+            ("encrypted_regex", DEFAULT_ENCRYPTED_REGEX),
+        ]:
+            regex = rule.get(field, default)
+            try:
+                compiled.append(re.compile(regex))
+            except re.error:
+                raise InvalidRuleError(f"Invalid regex for '{field}': {regex}") from None
+        return cls(*compiled)
+
+
+class RuleMatcher:
+    """Find the first of a list of regexes that matches a path, like sops picks a creation rule.
+
+    A single alternation of all the regexes finds the leftmost match in the
+    path rather than the first matching regex, so it is only used to tell in
+    one search whether any regex matches (most files of a tree match none).
+    The regexes are also combined in blocks of about sqrt(n), compiled on
+    first use: the first block that matches is found with one search per
+    block, then the regex with one search per regex of the block. Regexes
+    that can't be combined, because of inline flags or references to their
+    groups, are tried one by one.
+    """
+
+    def __init__(self, regexes: Sequence[Union[str, Pattern[str]]]) -> None:
+        """Compile the regexes.
+
+        Args:
+            regexes (Sequence[Union[str, Pattern[str]]]): The regexes, in order.
+        """
+        self.patterns: List[Pattern[str]] = [re.compile(regex) for regex in regexes]
+        self.block_size = max(MIN_RULE_BLOCK_SIZE, math.isqrt(len(self.patterns)))
+        self._root: Optional[Pattern[str]] = None
+        self._blocks: Dict[int, Pattern[str]] = {}
+        if len(self.patterns) > 1 and all(can_be_combined(pattern) for pattern in self.patterns):
+            try:
+                self._root = self._combine(0, len(self.patterns))
+            except re.error:
+                # e.g. two regexes with the same group name
+                pass
+
+    def _combine(self, start: int, end: int) -> Pattern[str]:
+        return re.compile(
+            "|".join(f"(?:{pattern.pattern})" for pattern in self.patterns[start:end])
+        )
+
+    def first(self, path: str) -> Optional[int]:
+        """Find the first regex that matches a path.
+
+        Args:
+            path (str): The path, as matched by the 'path_regex' of the rules.
+
+        Returns:
+            Optional[int]: The index of the regex, or None if none matches.
+        """
+        if self._root is None:
+            return self._first(path, 0, len(self.patterns))
+        if not self._root.search(path):
+            return None
+
+        for start in range(0, len(self.patterns), self.block_size):
+            block = self._blocks.get(start)
+            if block is None:
+                block = self._blocks[start] = self._combine(start, start + self.block_size)
+            if block.search(path):
+                return self._first(path, start, start + self.block_size)
+        # Not reached: the root matched, so does some block
+        return None
+
+    def _first(self, path: str, start: int, end: int) -> Optional[int]:
+        for index in range(start, min(end, len(self.patterns))):
+            if self.patterns[index].search(path):
+                return index
+        return None
+
+
+class KeyMatcher(Dict[Any, bool]):
+    """Remember which key names match an 'encrypted_regex'.
+
+    Key names repeat across the files of a tree ('metadata', 'name',
+    'data'...), so 'search' replaces the search of the regex with a dict
+    lookup for all but the first occurrence of each name. Once 'max_size'
+    names are remembered the new ones are searched every time.
+    """
+
+    def __init__(
+        self, regex: Pattern[str], max_size: int = KEY_MATCHER_SIZE, counted: bool = False
+    ) -> None:
+        """Create a matcher that remembers no key name yet.
+
+        Args:
+            regex (Pattern[str]): The 'encrypted_regex'.
+            max_size (int): Maximum number of key names remembered.
+            counted (bool): Count the lookups, e.g. to profile the hit rate,
+                which makes them slower.
+        """
+        super().__init__()
+        self.regex = regex
+        self.max_size = max_size
+        # The lookups are only counted if 'counted', the misses always are
+        self.lookups = 0
+        self.misses = 0
+        self.search: Callable[[Any], bool] = self._counted_search if counted else self.__getitem__
+
+    def __missing__(self, key: Any) -> bool:
+        """Search the regex for a key name not remembered yet."""
+        self.misses += 1
+        matched = bool(self.regex.search(key))
+        if len(self) < self.max_size:
+            self[key] = matched
+        return matched
+
+    def _counted_search(self, key: Any) -> bool:
+        self.lookups += 1
+        return self[key]
+
+
+# An 'encrypted_regex', or its KeyMatcher
+KeyRegex = Union[Pattern[str], KeyMatcher]
 
 
 def verify_encryption_regex(value: str) -> Optional[Match[str]]:
@@ -12,7 +191,4 @@ def verify_encryption_regex(value: str) -> Optional[Match[str]]:
         Optional[Match[str]]: Returns the full match object or None
             if the value doesn't match.
     """
-    encryption_pattern: Pattern[str] = re.compile(
-        r"^ENC\[AES256_GCM,data:(.+),iv:(.+),tag:(.+),type:(.+)\]"
-    )
-    return encryption_pattern.fullmatch(value)
+    return ENCRYPTION_PATTERN.fullmatch(value)
@@ -0,0 +1,344 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from types import TracebackType
+from typing import Dict, Optional, Set, Tuple, Type
+
+from isops.utils.ignore import IGNORE_FILES, IgnoreMatcher
+
+DEFAULT_POLL_INTERVAL = 1.0
+# Changes closer than this are reported together, e.g. an editor saving several files
+DEFAULT_DEBOUNCE = 0.1
+
+# From <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _walk_dirs(path: Path, ignore: IgnoreMatcher) -> Tuple[Path, ...]:
+    # The directories of a tree, a directory of the tree of 'ignore', except
+    # .git and the ignored directories
+    dirs = []
+    for root, subdirs, _ in os.walk(path):
+        relative = Path(root).relative_to(ignore.root).as_posix()
+        prefix = "" if relative == "." else relative + "/"
+        subdirs[:] = [
+            subdir
+            for subdir in subdirs
+            if subdir != ".git" and not ignore.is_ignored(prefix + subdir, True)
+        ]
+        dirs.append(Path(root))
+    return tuple(dirs)
+
+
+def _snapshot(path: Path, ignore: IgnoreMatcher) -> Dict[Path, Tuple[int, int]]:
+    # The (mtime, size) of every file of a tree, except in ignored directories
+    snapshot = {}
+    for directory in _walk_dirs(path, ignore):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[directory / entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+    return snapshot
+
+
+class Watcher(ABC):
+    """Report the files of a directory tree that change.
+
+    The changed paths are built from the watched root, like the paths found
+    by find_all_files_by_rules, so they can be used as its candidate files.
+    A directory that is deleted or moved away may be reported instead of
+    the files it held. The directories excluded by the .gitignore and
+    .isopsignore files are not watched.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Start watching a directory tree.
+
+        Args:
+            path (Path): The root of the tree.
+        """
+        self.path = Path(path)
+        self._ignore = IgnoreMatcher(self.path)
+
+    def _reload_ignore_files(self, changed: Set[Path]) -> bool:
+        # Read the ignore files again if one of them changed
+        if not any(file.name in IGNORE_FILES for file in changed):
+            return False
+        self._ignore = IgnoreMatcher(self.path)
+        return True
+
+    @abstractmethod
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Wait for some files to be created, modified or deleted.
+
+        Args:
+            timeout (Optional[float]): Maximum time to wait, in seconds. None
+                waits until something changes.
+
+        Returns:
+            Set[Path]: The changed files, empty if the timeout expired.
+        """
+
+    @abstractmethod
+    def poll(self) -> Set[Path]:
+        """Return the files changed since the last call, without waiting.
+
+        Returns:
+            Set[Path]: The changed files, empty if nothing changed.
+        """
+
+    def close(self) -> None:  # noqa: B027
+        """Stop watching."""
+
+    def __enter__(self) -> "Watcher":
+        """Use the watcher as a context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        """Stop watching."""
+        self.close()
+
+
+class PollingWatcher(Watcher):
+    """A watcher that compares the mtime and size of every file at regular intervals."""
+
+    def __init__(self, path: Path, interval: float = DEFAULT_POLL_INTERVAL) -> None:
+        """Start watching a directory tree.
+
+        Args:
+            path (Path): The root of the tree.
+            interval (float): Time between two scans of the tree, in seconds.
+        """
+        super().__init__(path)
+        self.interval = interval
+        self._snapshot = _snapshot(self.path, self._ignore)
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Wait for some files to be created, modified or deleted.
+
+        Args:
+            timeout (Optional[float]): Maximum time to wait, in seconds. None
+                waits until something changes.
+
+        Returns:
+            Set[Path]: The changed files, empty if the timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+            changed = self.poll()
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def poll(self) -> Set[Path]:
+        """Scan the tree and return the files changed since the last scan.
+
+        Returns:
+            Set[Path]: The changed files, empty if nothing changed.
+        """
+        snapshot = _snapshot(self.path, self._ignore)
+        changed = {
+            file
+            for file in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(file) != self._snapshot.get(file)
+        }
+        if self._reload_ignore_files(changed):
+            # The directories that are no longer ignored are scanned too
+            snapshot = _snapshot(self.path, self._ignore)
+        self._snapshot = snapshot
+        return changed
+
+
+class InotifyWatcher(Watcher):
+    """A watcher driven by the Linux inotify events, with one watch per directory."""
+
+    def __init__(self, path: Path, debounce: float = DEFAULT_DEBOUNCE) -> None:
+        """Start watching a directory tree.
+
+        Args:
+            path (Path): The root of the tree.
+            debounce (float): Wait this long, in seconds, for more events
+                after the first one.
+
+        Raises:
+            OSError: If inotify is not available, or the tree has more
+                directories than the watches allowed to a user.
+        """
+        super().__init__(path)
+        self.debounce = debounce
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self._fd = self._check(libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC))
+        self._dirs: Dict[int, Path] = {}
+        try:
+            for directory in _walk_dirs(self.path, self._ignore):
+                self._add_watch(directory)
+        except OSError:
+            self.close()
+            raise
+
+    @staticmethod
+    def _check(result: int) -> int:
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return result
+
+    def _add_watch(self, directory: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        self._dirs[self._check(wd)] = directory
+
+    def _is_ignored(self, directory: Path) -> bool:
+        return directory.name == ".git" or self._ignore.is_ignored(
+            directory.relative_to(self.path).as_posix(), True
+        )
+
+    def _add_watches(self, directory: Path, changed: Set[Path]) -> None:
+        # Watch a new directory and report its files
+        for subdir in _walk_dirs(directory, self._ignore):
+            try:
+                self._add_watch(subdir)
+            except OSError:
+                continue
+            changed.update(entry for entry in subdir.iterdir() if entry.is_file())
+
+    def _watch_unignored_dirs(self, changed: Set[Path]) -> None:
+        # Watch the directories that are no longer ignored, once an ignore
+        # file changed. Watching a directory twice keeps the same watch.
+        if self._reload_ignore_files(changed):
+            for directory in _walk_dirs(self.path, self._ignore):
+                try:
+                    self._add_watch(directory)
+                except OSError:
+                    continue
+
+    def _read_events(self, changed: Set[Path]) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                # Some events were lost: everything may have changed
+                changed.update(_snapshot(self.path, self._ignore))
+                continue
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+
+            if mask & _IN_ISDIR:
+                # A new (or moved) directory is watched and its files reported
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and not self._is_ignored(path):
+                    self._add_watches(path, changed)
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    # Reported as is: the files it held are gone too
+                    changed.add(path)
+            elif not mask & _IN_CREATE:
+                # Created files are reported once they are written and closed
+                changed.add(path)
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Wait for some files to be created, modified or deleted.
+
+        Args:
+            timeout (Optional[float]): Maximum time to wait, in seconds. None
+                waits until something changes.
+
+        Returns:
+            Set[Path]: The changed files, empty if the timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed: Set[Path] = set()
+        while not changed:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return changed
+            self._read_events(changed)
+            # Coalesce the events that follow closely
+            while select.select([self._fd], [], [], self.debounce)[0]:
+                self._read_events(changed)
+            self._watch_unignored_dirs(changed)
+        return changed
+
+    def poll(self) -> Set[Path]:
+        """Read the events already queued, without waiting for more.
+
+        Returns:
+            Set[Path]: The changed files, empty if nothing changed.
+        """
+        changed: Set[Path] = set()
+        while select.select([self._fd], [], [], 0)[0]:
+            self._read_events(changed)
+        self._watch_unignored_dirs(changed)
+        return changed
+
+    def close(self) -> None:
+        """Stop watching."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(path: Path, interval: float = DEFAULT_POLL_INTERVAL) -> Watcher:
+    """Watch a directory tree with inotify, or by polling if it isn't available.
+
+    Args:
+        path (Path): The root of the tree.
+        interval (float): Time between two scans of the tree when polling.
+
+    Returns:
+        Watcher: The watcher.
+    """
+    try:
+        return InotifyWatcher(path)
+    except OSError:
+        return PollingWatcher(path, interval)
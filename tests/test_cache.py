@@ -0,0 +1,163 @@
+import pytest
+
+import isops.utils.cache as cache_module
+from isops.utils import DocumentCache, KeyResult
+from isops.utils.cache import (
+    BaseResultCache,
+    MemoryResultCache,
+    ResultCache,
+    fingerprint_files,
+)
+
+
+def test_document_cache_parses_each_file_once(tmp_path, monkeypatch):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("data:\n  key: value\n")
+    calls = []
+
+    real_load = cache_module.load_all_yaml_with_encoding
+
+    def counting_load(path):
+        calls.append(path)
+        return real_load(path)
+
+    monkeypatch.setattr(cache_module, "load_all_yaml_with_encoding", counting_load)
+    cache = DocumentCache()
+
+    first = cache.load(secret)
+    second = cache.load(secret)
+
+    assert first == ([{"data": {"key": "value"}}], "utf-8")
+    assert second is first
+    assert len(calls) == 1
+
+
+def test_document_cache_reloads_changed_file(tmp_path):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("data:\n  key: value\n")
+    cache = DocumentCache()
+
+    assert cache.load(secret)[0] == [{"data": {"key": "value"}}]
+
+    secret.write_text("data:\n  key: another value\n")
+
+    assert cache.load(secret)[0] == [{"data": {"key": "another value"}}]
+
+
+def test_document_cache_is_bounded(tmp_path):
+    files = []
+    for i in range(4):
+        secret = tmp_path / f"secret{i}.yaml"
+        secret.write_text(f"key: {i}\n")
+        files.append(secret)
+
+    size = files[0].stat().st_size
+    cache = DocumentCache(max_size=2 * size)
+    for secret in files:
+        cache.load(secret)
+
+    assert len(cache) == 2
+    assert cache.size == 2 * size
+
+
+def test_document_cache_disabled(tmp_path):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("key: value\n")
+    cache = DocumentCache(max_size=0)
+
+    assert cache.load(secret) == ([{"key": "value"}], "utf-8")
+    assert len(cache) == 0
+
+
+def test_document_cache_missing_file(tmp_path):
+    assert DocumentCache().load(tmp_path / "missing.yaml") == ([], None)
+
+
+def test_result_cache_roundtrip(tmp_path):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("data:\n  key: value\n")
+    result = (
+        [KeyResult(0, ("data", "good"), True), KeyResult(1, ("items", 0, "bad"), False)],
+        "utf-8",
+        True,
+    )
+
+    with ResultCache(tmp_path / "cache", "config") as cache:
+        key = cache.key(secret, ["^data$"])
+        assert cache.get(key) is None
+        cache.put(key, result)
+
+    with ResultCache(tmp_path / "cache", "config") as cache:
+        assert cache.get(key) == result
+
+    assert (tmp_path / "cache" / ".gitignore").read_text().endswith("*\n")
+
+
+def test_result_cache_key_changes_with_content_and_rules(tmp_path):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("data:\n  key: value\n")
+    key = ResultCache.key(secret, ["^data$"])
+
+    assert ResultCache.key(secret, ["^data$"]) == key
+    assert ResultCache.key(secret, ["^(data|stringData)$"]) != key
+
+    secret.write_text("data:\n  key: another value\n")
+
+    assert ResultCache.key(secret, ["^data$"]) != key
+    assert ResultCache.key(tmp_path / "missing.yaml", ["^data$"]) is None
+
+
+def test_result_cache_invalidated_by_config_change(tmp_path):
+    config = tmp_path / ".sops.yaml"
+    config.write_text("creation_rules: []\n")
+    fingerprint = fingerprint_files([config])
+
+    with ResultCache(tmp_path / "cache", fingerprint) as cache:
+        cache.put("key", ([], None, False))
+
+    config.write_text("creation_rules: [{}]\n")
+    assert fingerprint_files([config]) != fingerprint
+
+    with ResultCache(tmp_path / "cache", fingerprint_files([config])) as cache:
+        assert cache.get("key") is None
+
+
+def test_memory_result_cache_keys_follow_the_file(tmp_path):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("data: 1\n")
+    cache = MemoryResultCache()
+
+    key = cache.key(secret, ["^data$"])
+    assert cache.key(secret, ["^data$"]) == key
+    assert cache.key(secret, ["^(data|stringData)$"]) != key
+    assert cache.key(tmp_path / "missing.yaml", ["^data$"]) is None
+
+    cache.put(key, ([], None, True))
+    assert cache.get(key) == ([], None, True)
+
+    # Only the latest result of a file is kept
+    secret.write_text("data: 22\n")
+    new_key = cache.key(secret, ["^data$"])
+    assert new_key != key
+    cache.put(new_key, ([], None, False))
+    assert cache.get(key) is None
+    assert len(cache) == 1
+
+    cache.discard(secret)
+    assert cache.get(new_key) is None
+    assert len(cache) == 0
+
+
+def test_result_cache_needs_key_get_and_put():
+    with pytest.raises(TypeError):
+        BaseResultCache()
+
+    class NoPut(BaseResultCache):
+        def key(self, path, encrypted_regexes):
+            return None
+
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        NoPut()
@@ -0,0 +1,347 @@
+import os
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+import isops.utils.checker as checker_module
+import isops.utils.helpers as helpers_module
+from isops.utils import (
+    DocumentCache,
+    FileResult,
+    KeyResult,
+    check_bytes,
+    check_document,
+    check_file,
+    check_files,
+)
+from isops.utils.cache import ResultCache
+from isops.utils.memory import MemoryLimitError
+
+TESTS_PATH = os.path.dirname(os.path.realpath(__file__))
+SAMPLES_PATH = os.path.join(TESTS_PATH, "samples")
+ENC_VALUE = (
+    "ENC[AES256_GCM,data:XFJC29P4T44=,iv:LC2cNV1I2MT3pREbWwq8UFS62PS2LreFhxrrOrWt/1U=,"
+    "tag:0DyNMTHMUljO/ncBwbcxQQ==,type:str]"
+)
+
+
+def test_check_file_good_and_bad_keys():
+    path = Path(os.path.join(SAMPLES_PATH, "simple_secret.enc.yaml"))
+    result = check_file(path, ["^(data|metadata)$"])
+
+    assert result.path == path
+    assert result.is_valid
+    assert result.encoding == "utf-8"
+    assert result.keys == [
+        KeyResult(0, ("data", "username"), True),
+        KeyResult(0, ("data", "password"), True),
+        KeyResult(0, ("metadata", "name"), False),
+        KeyResult(0, ("metadata", "namespace"), False),
+        KeyResult(0, ("metadata", "resourceVersion"), False),
+        KeyResult(0, ("metadata", "uid"), False),
+    ]
+
+
+def test_check_file_one_entry_per_rule_and_document():
+    path = Path(os.path.join(SAMPLES_PATH, "yaml_blocks.yaml"))
+    result = check_file(path, ["^data$", "^kind$"])
+
+    assert result.keys == [
+        KeyResult(0, ("data", "username"), False),
+        KeyResult(0, ("data", "password"), False),
+        KeyResult(1, ("data", "username"), False),
+        KeyResult(1, ("data", "password"), False),
+        KeyResult(0, ("kind",), False),
+        KeyResult(1, ("kind",), False),
+    ]
+
+
+def test_check_file_same_key_name_under_different_parents(tmp_path):
+    path = tmp_path / "secret.yaml"
+    path.write_text(f"data:\n  password: {ENC_VALUE}\nother:\n  data:\n    password: plain\n")
+
+    assert check_file(path, ["data$"]).keys == [
+        KeyResult(0, ("data", "password"), True),
+        KeyResult(0, ("other", "data", "password"), False),
+    ]
+
+
+def test_check_file_broken_yaml(tmp_path):
+    path = tmp_path / "broken.yaml"
+    path.write_text("[")
+
+    assert check_file(path, ["^data$"]) == FileResult(path, [], None, False)
+
+
+def test_check_file_opens_the_file_once(tmp_path, monkeypatch):
+    path = tmp_path / "secret.yaml"
+    # Not prescanned nor streamed: it needs the documents to be built
+    path.write_text("base: &base\n  password: hunter2\ndata: *base\n")
+    opened = []
+    real_open = open
+
+    def spy_open(file, *args, **kwargs):
+        opened.append(file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", spy_open)
+    result = check_file(path, ["^data$"], DocumentCache())
+    monkeypatch.undo()
+
+    assert result.keys == [KeyResult(0, ("data", "password"), False)]
+    assert opened == [path]
+
+
+def test_check_file_mapped_same_result(monkeypatch):
+    paths = [Path(os.path.join(SAMPLES_PATH, name)) for name in sorted(os.listdir(SAMPLES_PATH))]
+    expected = [check_file(path, ["^(data|stringData)$"]) for path in paths]
+
+    monkeypatch.setattr(helpers_module, "MMAP_THRESHOLD", 0)
+
+    assert [check_file(path, ["^(data|stringData)$"]) for path in paths] == expected
+
+
+def test_check_file_streamed_same_result(monkeypatch):
+    paths = [Path(os.path.join(SAMPLES_PATH, name)) for name in sorted(os.listdir(SAMPLES_PATH))]
+    expected = [check_file(path, ["^(data|stringData)$"]) for path in paths]
+
+    monkeypatch.setattr(checker_module, "STREAM_THRESHOLD", 0)
+
+    assert [check_file(path, ["^(data|stringData)$"]) for path in paths] == expected
+
+
+def test_check_file_streamed_documents(tmp_path, monkeypatch):
+    path = tmp_path / "secret.yaml"
+    # Aliases need the documents to be built
+    path.write_text(f"base: &base\n  password: hunter2\ndata: *base\n---\n---\ndata: {ENC_VALUE}\n")
+    monkeypatch.setattr(checker_module, "STREAM_THRESHOLD", 0)
+
+    result = check_file(path, ["^data$", "^base$"])
+
+    assert result.is_valid
+    assert result.keys == [
+        KeyResult(0, ("data", "password"), False),
+        KeyResult(2, ("data",), True),
+        KeyResult(0, ("base", "password"), False),
+    ]
+
+
+def test_check_file_memory_limit(tmp_path, monkeypatch):
+    path = tmp_path / "secret.yaml"
+    path.write_text("base: &base\n  password: hunter2\ndata: *base\n")
+    monkeypatch.setattr(checker_module, "STREAM_THRESHOLD", 0)
+    monkeypatch.setattr(checker_module, "current_rss", lambda: 1024 * 1024 * 1024)
+
+    with pytest.raises(MemoryLimitError) as error:
+        check_file(path, ["^data$"], max_memory=512 * 1024 * 1024)
+
+    assert error.value.path == path
+    assert str(error.value) == f"Checking {path} needs more than 512 MiB."
+    # Under the limit the file is checked
+    assert check_file(path, ["^data$"], max_memory=2048 * 1024 * 1024).is_valid
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self/status")
+def test_check_file_streamed_memory_stays_flat(tmp_path):
+    # Each document is released once classified, so the peak RSS of the
+    # process doesn't grow with the size of the file
+    document = "---\nbase: &base\n  a: 1\nref: *base\ndata:\n" + "".join(
+        f"  key{i}: value number {i}\n" for i in range(500)
+    )
+    # VmHWM is the peak RSS of the process, unlike ru_maxrss not inherited from pytest
+    script = (
+        "import re, sys\n"
+        "from pathlib import Path\n"
+        "import isops.utils.checker as checker\n"
+        "checker.STREAM_THRESHOLD = 0\n"
+        "result = checker.check_file(Path(sys.argv[1]), ['^ref$'])\n"
+        "assert result.is_valid and result.keys\n"
+        "print(re.search(r'VmHWM:\\s+(\\d+)', open('/proc/self/status').read()).group(1))\n"
+    )
+    peaks = []
+    for count in [10, 160]:
+        path = tmp_path / f"bundle-{count}.yaml"
+        path.write_text(document * count)
+        output = subprocess.run(
+            [sys.executable, "-c", script, str(path)], capture_output=True, check=True, text=True
+        ).stdout
+        peaks.append(int(output))
+
+    # In KiB: the big file is about 2 MB, and loading it whole would
+    # take about 10 times that
+    assert peaks[1] - peaks[0] < 8 * 1024
+
+
+def test_check_files_keeps_task_order():
+    paths = [
+        Path(os.path.join(SAMPLES_PATH, name))
+        for name in ["simple_secret.yaml", "yaml_blocks.yaml", "simple_secret.enc.yaml"]
+    ]
+    tasks = [(path, ["^data$"]) for path in paths]
+
+    serial = list(check_files(tasks, DocumentCache()))
+    parallel = list(check_files(tasks, DocumentCache(), jobs=2))
+
+    assert [result.path for result in parallel] == paths
+    assert parallel == serial
+
+
+@pytest.mark.parametrize("prefetch", [1, 3, 10])
+def test_check_files_prefetch_same_results(tmp_path, prefetch):
+    paths = [Path(os.path.join(SAMPLES_PATH, name)) for name in sorted(os.listdir(SAMPLES_PATH))]
+    paths.append(tmp_path / "missing.yaml")
+    tasks = [(path, ["^(data|stringData)$"]) for path in paths]
+
+    serial = list(check_files(tasks, DocumentCache()))
+    ahead = list(check_files(tasks, DocumentCache(), prefetch=prefetch))
+
+    assert [result.path for result in ahead] == paths
+    assert ahead == serial
+
+
+def test_check_files_prefetch_reads_ahead_and_closes(monkeypatch):
+    paths = [Path(os.path.join(SAMPLES_PATH, "simple_secret.yaml"))] * 6
+    tasks = [(path, ["^data$"]) for path in paths]
+    events = []
+    read_ahead = threading.Event()
+    real_open_file = checker_module.open_file
+    real_check_content = checker_module._check_content
+
+    @contextmanager
+    def spy_open_file(path, *args):
+        with real_open_file(path, *args) as data:
+            events.append("open")
+            if events.count("open") > 1:
+                read_ahead.set()
+            yield data
+        events.append("close")
+
+    def counting_check_content(*args):
+        # Another file is read while this one is checked
+        assert read_ahead.wait(timeout=5)
+        events.append("check")
+        return real_check_content(*args)
+
+    monkeypatch.setattr(checker_module, "open_file", spy_open_file)
+    monkeypatch.setattr(checker_module, "_check_content", counting_check_content)
+
+    results = check_files(tasks, DocumentCache(), prefetch=3)
+    next(results)
+    results.close()
+
+    # The files read ahead are closed when the checks stop early
+    assert events.count("check") == 1
+    assert 2 <= events.count("open") <= 4
+    assert events.count("open") == events.count("close")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_check_files_fail_fast_stops_at_first_failure(tmp_path, jobs):
+    safe = Path(os.path.join(SAMPLES_PATH, "simple_secret.enc.yaml"))
+    unsafe = Path(os.path.join(SAMPLES_PATH, "simple_secret.yaml"))
+    broken = tmp_path / "broken.yaml"
+    broken.write_text("[")
+    tasks = [(path, ["^data$"]) for path in [safe, unsafe, broken, safe]]
+
+    results = list(check_files(tasks, DocumentCache(), jobs=jobs, fail_fast=True))
+    assert [result.path for result in results] == [safe, unsafe]
+
+    results = list(check_files(tasks[2:], DocumentCache(), jobs=jobs, fail_fast=True))
+    assert [result.path for result in results] == [broken]
+
+    results = list(check_files([tasks[0], tasks[3]], DocumentCache(), fail_fast=True))
+    assert [result.path for result in results] == [safe, safe]
+
+
+def test_check_files_fail_fast_with_cache(tmp_path):
+    safe = Path(os.path.join(SAMPLES_PATH, "simple_secret.enc.yaml"))
+    unsafe = Path(os.path.join(SAMPLES_PATH, "simple_secret.yaml"))
+    tasks = [(path, ["^data$"]) for path in [unsafe, safe]]
+
+    with ResultCache(tmp_path / "cache", "config") as cache:
+        first = list(check_files(tasks, DocumentCache(), results_cache=cache, fail_fast=True))
+        second = list(check_files(tasks, DocumentCache(), results_cache=cache, fail_fast=True))
+
+    assert [result.path for result in first] == [unsafe]
+    assert first == second
+
+
+def test_check_files_reports_unchanged_files_from_cache(tmp_path, monkeypatch):
+    secret = tmp_path / "secret.yaml"
+    secret.write_text("data:\n  key: value\n")
+    broken = tmp_path / "broken.yaml"
+    broken.write_text("[")
+    tasks = [(broken, ["^data$"]), (secret, ["^data$"])]
+
+    with ResultCache(tmp_path / "cache", "config") as cache:
+        first = list(check_files(tasks, DocumentCache(), results_cache=cache))
+
+    checked = []
+    real_check_file = checker_module.check_file
+
+    def counting_check_file(path, *args):
+        checked.append(path)
+        return real_check_file(path, *args)
+
+    monkeypatch.setattr(checker_module, "check_file", counting_check_file)
+    secret.write_text("data:\n  key: another value\n")
+
+    with ResultCache(tmp_path / "cache", "config") as cache:
+        second = list(check_files(tasks, DocumentCache(), results_cache=cache))
+
+    assert checked == [secret]
+    assert first == second
+    assert second[0] == FileResult(broken, [], None, False)
+
+
+def test_check_file_profile():
+    path = Path(os.path.join(SAMPLES_PATH, "simple_secret.yaml"))
+
+    assert check_file(path, ["^data$"]).timings is None
+
+    timings = check_file(path, ["^data$"], profile=True).timings
+    assert {"read", "decode", "prescan", "scan"} <= set(timings)
+    assert all(wall >= 0 and cpu >= 0 and calls == 1 for wall, cpu, calls in timings.values())
+
+
+def test_check_file_profile_counts_key_memo_hits():
+    path = Path(os.path.join(SAMPLES_PATH, "simple_secret.yaml"))
+    # A regex of its own, so that no other test filled its memo
+    regexes = ["^(data|memo-test)$"]
+
+    assert check_file(path, regexes).counts is None
+
+    # The key names of the first check are all remembered by the second one
+    first = check_file(path, regexes, profile=True).counts
+    second = check_file(path, regexes, profile=True).counts
+    assert first["key_lookups"] == second["key_lookups"] > 0
+    assert first["key_memo_hits"] < first["key_lookups"]
+    assert second["key_memo_hits"] == second["key_lookups"]
+
+
+@pytest.mark.parametrize(
+    "name", ["simple_secret.enc.yaml", "simple_secret_utf16.yaml", "yaml_blocks.yaml"]
+)
+def test_check_bytes_agrees_with_check_file(name):
+    path = Path(os.path.join(SAMPLES_PATH, name))
+    expected = check_file(path, ["^(data|metadata)$"])
+    result = check_bytes(path.read_bytes(), ["^(data|metadata)$"], path=path)
+
+    assert result == expected
+
+
+def test_check_bytes_broken_yaml():
+    assert check_bytes(b"[", ["^data$"]) == FileResult(Path("-"), [], None, False)
+
+
+def test_check_document_skips_the_sops_metadata():
+    document = {"data": {"password": ENC_VALUE, "user": "plain"}, "sops": {"data": "x"}}
+
+    assert check_document(document, ["^data$"], index=2) == [
+        KeyResult(2, ("data", "password"), True),
+        KeyResult(2, ("data", "user"), False),
+    ]
@@ -1,10 +1,19 @@
 import collections
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
 
 import pytest
 from click.testing import CliRunner
 from ruamel.yaml import YAML
 
+import isops.cli as cli_module
+import isops.utils.checker as checker_module
+import isops.utils.parser as parser_module
 from isops.cli import cli
+from isops.utils.parser import DEFAULT_PARSER, set_parser
 
 
 def assert_consistent_output(expected: str, actual: str) -> bool:
@@ -371,3 +380,488 @@ def test_cli_secret_is_a_block_of_yaml(tmp_path, example_dotspos_yaml, yaml_bloc
 
     assert result.exit_code == 1
     assert assert_consistent_output(expected_output, result.output)
+
+
+def test_cli_first_matching_rule_wins(tmp_path, simple_enc_secret_yaml):
+    # a file matched by several rules of the same config is checked
+    # only against the first one, like sops does
+
+    yaml = YAML(typ="safe")
+
+    config = {
+        "creation_rules": [
+            {"path_regex": "secret.yaml$", "encrypted_regex": "^data$"},
+            {"path_regex": ".yaml$", "encrypted_regex": "^metadata$"},
+        ]
+    }
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(config, dotsops)
+    secret = tmp_path / "root/secret.yaml"
+    yaml.dump(simple_enc_secret_yaml, secret)
+    root = tmp_path / "root"
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml"])
+    expected_output = (
+        f"Found config file: {dotsops}\n"
+        "---\n"
+        f"{secret}::password [SAFE]\n"
+        f"{secret}::username [SAFE]\n"
+    )
+
+    assert result.exit_code == 0
+    assert assert_consistent_output(expected_output, result.output)
+
+
+@pytest.mark.parametrize("jobs", ["0", "2"])
+def test_cli_jobs_same_output_as_serial(tmp_path, example_dotspos_yaml, yaml_blocks, jobs):
+    # checking the files in a process pool prints the same results, in path order
+
+    yaml = YAML(typ="safe")
+
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(example_dotspos_yaml, dotsops)
+    for i in range(5):
+        yaml.dump_all(yaml_blocks, tmp_path / f"root/{i}-secret.yaml")
+    root = tmp_path / "root"
+
+    runner = CliRunner()
+    serial = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--summary"])
+    parallel = runner.invoke(
+        cli, [str(root), "--config-regex", ".sops.ya?ml", "--summary", "--jobs", jobs]
+    )
+
+    assert serial.exit_code == parallel.exit_code == 1
+    assert serial.output == parallel.output
+    assert "0 safe 20 unsafe" in parallel.output
+
+
+def test_cli_discovery_threads_same_output(tmp_path, example_dotspos_yaml, yaml_blocks):
+    yaml = YAML(typ="safe")
+
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(example_dotspos_yaml, dotsops)
+    for i in range(5):
+        (tmp_path / f"root/dir{i}").mkdir()
+        yaml.dump_all(yaml_blocks, tmp_path / f"root/dir{i}/secret.yaml")
+    root = tmp_path / "root"
+
+    runner = CliRunner()
+    serial = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml"])
+    threaded = runner.invoke(
+        cli, [str(root), "--config-regex", ".sops.ya?ml", "--discovery-threads", "4"]
+    )
+
+    assert serial.exit_code == threaded.exit_code == 1
+    assert serial.output == threaded.output
+
+
+def test_cli_prefetch_same_output(tmp_path, example_dotspos_yaml, yaml_blocks):
+    yaml = YAML(typ="safe")
+
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(example_dotspos_yaml, dotsops)
+    for i in range(5):
+        yaml.dump_all(yaml_blocks, tmp_path / f"root/secret{i}.yaml")
+    (tmp_path / "root/broken-secret.yaml").write_text("[")
+    root = tmp_path / "root"
+
+    runner = CliRunner()
+    serial = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml"])
+    ahead = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--prefetch", "3"])
+
+    assert serial.exit_code == ahead.exit_code == 1
+    assert serial.output == ahead.output
+
+
+def test_cli_skips_files_deleted_before_their_check(
+    monkeypatch, tmp_path, example_dotspos_yaml, simple_enc_secret_yaml
+):
+    yaml = YAML(typ="safe")
+    root = tmp_path / "root"
+    root.mkdir()
+    yaml.dump(example_dotspos_yaml, root / ".sops.yaml")
+    yaml.dump(simple_enc_secret_yaml, root / "kept-secret.yaml")
+    yaml.dump(simple_enc_secret_yaml, root / "gone-secret.yaml")
+
+    def check_files(tasks, *args, **kwargs):
+        # Deleted after the tree was walked
+        (root / "gone-secret.yaml").unlink()
+        return checker_module.check_files(tasks, *args, **kwargs)
+
+    monkeypatch.setattr(cli_module, "check_files", check_files)
+    result = CliRunner().invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "-s"])
+
+    assert result.exit_code == 0
+    assert "gone-secret.yaml" not in result.output
+    assert "kept-secret.yaml::password [SAFE]" in result.output
+    assert "2 safe 0 unsafe" in result.output
+
+
+def test_cli_fail_fast_checks_recent_files_first(
+    tmp_path, example_dotspos_yaml, simple_secret_yaml, simple_enc_secret_yaml
+):
+    yaml = YAML(typ="safe")
+
+    root = tmp_path / "root"
+    root.mkdir()
+    yaml.dump(example_dotspos_yaml, root / ".sops.yaml")
+    for name in ["a-secret.yaml", "b-secret.yaml", "c-secret.yaml"]:
+        yaml.dump(simple_secret_yaml, root / name)
+    yaml.dump(simple_enc_secret_yaml, root / "d-secret.yaml")
+    # d-secret.yaml is the most recently modified, then b-secret.yaml
+    for age, name in enumerate(["d-secret.yaml", "b-secret.yaml", "a-secret.yaml"]):
+        os.utime(root / name, (1_700_000_000 - age, 1_700_000_000 - age))
+    os.utime(root / "c-secret.yaml", (1_600_000_000, 1_600_000_000))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--fail-fast", "-s"])
+
+    assert result.exit_code == 1
+    checked = [line.split("::")[0] for line in result.output.splitlines() if "::" in line]
+    assert sorted(set(checked)) == [str(root / "b-secret.yaml"), str(root / "d-secret.yaml")]
+    assert checked.index(str(root / "d-secret.yaml")) < checked.index(str(root / "b-secret.yaml"))
+    assert "Stopped at the first failure, 2 files not checked." in result.output
+
+    for name in ["a-secret.yaml", "b-secret.yaml", "c-secret.yaml"]:
+        (root / name).unlink()
+    safe = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--fail-fast"])
+    assert safe.exit_code == 0
+    assert "Stopped" not in safe.output
+
+
+def test_cli_parser_same_output(simple_dir_struct, yaml_blocks):
+    _, _, root, _ = simple_dir_struct(yaml_blocks)
+
+    runner = CliRunner()
+    auto = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml"])
+    pure = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--parser", "pure"])
+    set_parser(DEFAULT_PARSER)
+
+    assert auto.exit_code == pure.exit_code == 1
+    assert auto.output == pure.output
+
+
+def test_cli_parser_unavailable(monkeypatch, simple_dir_struct, yaml_blocks):
+    _, _, root, _ = simple_dir_struct(yaml_blocks)
+    monkeypatch.setattr(parser_module, "c_parser_available", lambda: False)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--parser", "c"])
+
+    assert result.exit_code == 2
+    assert "ruamel.yaml.clib" in result.output
+
+
+def test_cli_max_memory(monkeypatch, simple_dir_struct, simple_enc_secret_yaml):
+    _, secret, root, _ = simple_dir_struct(simple_enc_secret_yaml)
+    # Aliases need the documents to be built
+    Path(secret).write_text("base: &base\n  password: hunter2\ndata: *base\n")
+    monkeypatch.setattr(checker_module, "STREAM_THRESHOLD", 0)
+    monkeypatch.setattr(checker_module, "current_rss", lambda: 512 * 1024 * 1024)
+
+    runner = CliRunner()
+    within = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--max-memory", "1024"])
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--max-memory", "256"])
+
+    assert "UNSAFE" in within.output
+    assert result.exit_code == 1
+    assert "UNSAFE" not in result.output
+    assert f"Checking {secret} needs more than 256 MiB." in result.output
+
+
+def test_cli_jobs_broken_yaml(tmp_path, example_dotspos_yaml, simple_enc_secret_yaml):
+    # a broken file stops the checks also when they run in a process pool
+
+    yaml = YAML(typ="safe")
+
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(example_dotspos_yaml, dotsops)
+    yaml.dump(simple_enc_secret_yaml, tmp_path / "root/a-secret.yaml")
+    broken = tmp_path / "root/b-secret.yaml"
+    broken.write_text("[")
+    root = tmp_path / "root"
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "-j", "2"])
+
+    assert result.exit_code == 1
+    assert result.output.endswith(f"{broken} is not a valid YAML!\n")
+
+
+def test_cli_result_cache(tmp_path, example_dotspos_yaml, simple_secret_yaml):
+    # the second run reports the same results from the cache
+
+    yaml = YAML(typ="safe")
+
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(example_dotspos_yaml, dotsops)
+    secret = tmp_path / "root/secret.yaml"
+    yaml.dump(simple_secret_yaml, secret)
+    root = tmp_path / "root"
+    cache_dir = tmp_path / "cache"
+
+    runner = CliRunner()
+    args = [str(root), "--config-regex", ".sops.ya?ml", "--cache-dir", str(cache_dir), "-s"]
+    first = runner.invoke(cli, args)
+    second = runner.invoke(cli, args)
+
+    assert (cache_dir / "results.sqlite").is_file()
+    assert first.exit_code == second.exit_code == 1
+    assert first.output == second.output
+
+
+def test_cli_staged_checks_only_changed_files(
+    tmp_path, example_dotspos_yaml, simple_secret_yaml, simple_enc_secret_yaml
+):
+    # with --staged the unsafe secret that is not staged is not checked
+
+    yaml = YAML(typ="safe")
+
+    root = tmp_path / "root"
+    root.mkdir()
+    yaml.dump(example_dotspos_yaml, root / ".sops.yaml")
+    yaml.dump(simple_secret_yaml, root / "old-secret.yaml")
+    staged = root / "new-secret.yaml"
+    yaml.dump(simple_enc_secret_yaml, staged)
+
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    subprocess.run(["git", "-C", str(root), "add", staged.name], check=True)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--staged"])
+    expected_output = (
+        f"Found config file: {root / '.sops.yaml'}\n"
+        "---\n"
+        f"{staged}::password [SAFE]\n"
+        f"{staged}::username [SAFE]\n"
+    )
+
+    assert result.exit_code == 0
+    assert assert_consistent_output(expected_output, result.output)
+
+
+def test_cli_since_outside_git_repo(tmp_path, example_dotspos_yaml):
+    yaml = YAML(typ="safe")
+
+    root = tmp_path / "root"
+    root.mkdir()
+    yaml.dump(example_dotspos_yaml, root / ".sops.yaml")
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--since", "HEAD"])
+
+    assert result.exit_code == 1
+    assert "Cannot list the changed files:" in result.output
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_cli_profile(tmp_path, example_dotspos_yaml, simple_secret_yaml, jobs):
+    # the profile is printed after the results
+
+    yaml = YAML(typ="safe")
+
+    dotsops = tmp_path / "root/.sops.yaml"
+    dotsops.parent.mkdir()
+    yaml.dump(example_dotspos_yaml, dotsops)
+    secret = tmp_path / "root/secret.yaml"
+    yaml.dump(simple_secret_yaml, secret)
+    root = tmp_path / "root"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, [str(root), "--config-regex", ".sops.ya?ml", "--profile", "json", "-j", jobs]
+    )
+
+    assert result.exit_code == 1
+    assert f"{secret}::password [UNSAFE]" in result.output
+    profile = json.loads(result.output[result.output.index("{") :])
+    assert {"config", "discovery", "check", "output"} <= set(profile["stages"])
+    assert profile["files"]["checked"] == 1
+    assert profile["slowest_files"][0]["path"] == str(secret)
+
+    result = runner.invoke(cli, [str(root), "--config-regex", ".sops.ya?ml", "--profile"])
+
+    assert "Stage" in result.output
+    assert "Slowest files:" in result.output
+
+
+@pytest.mark.parametrize("flag", ["-q", "--quiet", "--only-unsafe"])
+def test_cli_quiet(simple_dir_struct, simple_enc_secret_yaml, flag):
+    # the SAFE keys aren't printed but they are still counted
+
+    path_to_dotsops, path_to_yaml, root, _ = simple_dir_struct(simple_enc_secret_yaml)
+    runner = CliRunner()
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--summary", flag])
+
+    assert result.exit_code == 0
+    assert result.output == (
+        f"Found config file: {path_to_dotsops}\n" "---\n" "---\n" "Summary:\n" "2 safe 0 unsafe\n"
+    )
+
+
+def test_cli_format_jsonl(simple_dir_struct, simple_secret_yaml):
+    # one record per key, the other messages aren't records
+
+    _, path_to_yaml, root, _ = simple_dir_struct(simple_secret_yaml)
+    runner = CliRunner()
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--format", "jsonl", "-s"])
+
+    records = [json.loads(line) for line in result.output.splitlines() if line.startswith("{")]
+    assert result.exit_code == 1
+    assert records == [
+        {
+            "file": path_to_yaml,
+            "key": "password",
+            "path": ["data", "password"],
+            "document": 0,
+            "safe": False,
+            "encoding": "utf-8",
+        },
+        {
+            "file": path_to_yaml,
+            "key": "username",
+            "path": ["data", "username"],
+            "document": 0,
+            "safe": False,
+            "encoding": "utf-8",
+        },
+        {"summary": {"safe": 0, "unsafe": 2, "broken": None}},
+    ]
+    assert "Found config file" in result.output
+
+
+def test_cli_same_key_name_under_different_parents(simple_dir_struct):
+    # each key is classified on its own, not by its name
+
+    secret = {
+        "data": {"password": "ENC[AES256_GCM,data:a,iv:b,tag:c,type:str]"},
+        "stringData": {"nested": {"password": "plain"}},
+    }
+    _, path_to_yaml, root, _ = simple_dir_struct(secret)
+    runner = CliRunner()
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--summary"])
+
+    assert result.exit_code == 1
+    assert f"{path_to_yaml}::password [SAFE]\n" in result.output
+    assert f"{path_to_yaml}::password [UNSAFE]\n" in result.output
+    assert "1 safe 1 unsafe" in result.output
+
+
+class FakeWatcher:
+    """Apply some changes to the tree, one per wait, then stop the watch."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def wait(self, timeout=None):
+        if not self.changes:
+            raise KeyboardInterrupt
+        return self.changes.pop(0)()
+
+
+def test_cli_watch_checks_only_changed_files(
+    monkeypatch, simple_dir_struct, simple_enc_secret_yaml, simple_secret_yaml
+):
+    dotsops, path_to_yaml, root, _ = simple_dir_struct(simple_enc_secret_yaml)
+    yaml = YAML(typ="safe")
+    new_secret = f"{root}/new-secret.yaml"
+    loaded_configs = []
+
+    def add_unsafe_secret():
+        yaml.dump(simple_secret_yaml, Path(new_secret))
+        return {Path(new_secret)}
+
+    def delete_unsafe_secret():
+        Path(new_secret).unlink()
+        return {Path(new_secret)}
+
+    def touch_config():
+        Path(dotsops).touch()
+        return {Path(dotsops)}
+
+    monkeypatch.setattr(
+        "isops.cli.create_watcher",
+        lambda path: FakeWatcher([add_unsafe_secret, delete_unsafe_secret, touch_config]),
+    )
+    find_configs = cli_module.find_all_files_by_regex
+    monkeypatch.setattr(
+        "isops.cli.find_all_files_by_regex",
+        lambda *args: loaded_configs.append(args) or find_configs(*args),
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--watch", "-s"])
+    passes = result.output.split("Summary:\n")
+
+    assert result.exit_code == 0
+    assert len(passes) == 4
+    # only the new file is checked, the other counts are reused
+    assert f"{path_to_yaml}::" not in passes[1]
+    assert f"{new_secret}::password [UNSAFE]" in passes[1]
+    assert "2 safe 2 unsafe" in passes[2]
+    # deleting the file doesn't check anything, the config change checks everything again
+    assert "Config files changed, reloading the rules." in passes[2]
+    assert f"{path_to_yaml}::password [SAFE]" in passes[2]
+    assert f"{new_secret}::" not in passes[2]
+    assert passes[3] == "2 safe 0 unsafe\n"
+    assert len(loaded_configs) == 2
+
+
+def test_cli_watch_forgets_the_files_of_a_deleted_directory(
+    monkeypatch, simple_dir_struct, simple_enc_secret_yaml, simple_secret_yaml
+):
+    _, path_to_yaml, root, _ = simple_dir_struct(simple_enc_secret_yaml)
+    yaml = YAML(typ="safe")
+    directory = Path(root) / "team"
+    new_secret = directory / "new-secret.yaml"
+
+    def add_unsafe_secret():
+        directory.mkdir()
+        yaml.dump(simple_secret_yaml, new_secret)
+        return {new_secret}
+
+    def delete_directory():
+        shutil.rmtree(directory)
+        return {directory}
+
+    def touch_secret():
+        Path(path_to_yaml).touch()
+        return {Path(path_to_yaml)}
+
+    monkeypatch.setattr(
+        "isops.cli.create_watcher",
+        lambda path: FakeWatcher([add_unsafe_secret, delete_directory, touch_secret]),
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [root, "--config-regex", ".sops.ya?ml", "--watch", "-s"])
+    passes = result.output.split("Summary:\n")
+
+    assert result.exit_code == 0
+    assert len(passes) == 4
+    assert f"{new_secret}::password [UNSAFE]" in passes[1]
+    assert "2 safe 2 unsafe" in passes[2]
+    # the files of the deleted directory aren't counted anymore
+    assert passes[3] == "2 safe 0 unsafe\n"
+
+
+def test_cli_watch_needs_a_directory(simple_dir_struct, simple_enc_secret_yaml):
+    _, path_to_yaml, _, _ = simple_dir_struct(simple_enc_secret_yaml)
+    runner = CliRunner()
+    result = runner.invoke(cli, [path_to_yaml, "--config-regex", ".sops.ya?ml", "--watch"])
+
+    assert result.exit_code == 2
+    assert "--watch needs a directory." in result.output
@@ -0,0 +1,266 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import click
+import pytest
+from click.testing import CliRunner
+from ruamel.yaml import YAML
+
+import isops.client as client_module
+import isops.daemon as daemon_module
+from isops.cli import cli
+from isops.client import _SHORT_VALUE_OPTIONS, _runs_locally, build_id, request
+from isops.daemon import Daemon, Session
+from isops.scanner import Scanner
+from isops.utils.watch import PollingWatcher
+
+
+@pytest.fixture
+def tree(tmp_path, example_dotspos_yaml, simple_secret_yaml, simple_enc_secret_yaml):
+    # creation_rules:
+    #     - path_regex: (.*)?secret.yaml$
+    #         encrypted_regex: "^(data|stringData)$"
+    yaml = YAML(typ="safe")
+    root = tmp_path / "root"
+    (root / "apps").mkdir(parents=True)
+    yaml.dump(example_dotspos_yaml, root / ".sops.yaml")
+    yaml.dump(simple_enc_secret_yaml, root / "secret.yaml")
+    yaml.dump(simple_secret_yaml, root / "apps" / "secret.yaml")
+    return root
+
+
+@pytest.fixture
+def session(tree):
+    session = Session(tree, ".sops.ya?ml")
+    yield session
+    session.close()
+
+
+def _scanner(session):
+    return Scanner.from_config_files(session.config_files(), session.documents)
+
+
+def _files(session):
+    return [file for file, _ in session.tasks(_scanner(session))]
+
+
+def test_session_tasks_follow_the_changed_files(session, tree, simple_enc_secret_yaml):
+    assert _files(session) == [tree / "apps" / "secret.yaml", tree / "secret.yaml"]
+
+    # The changes are seen by the very next call
+    YAML(typ="safe").dump(simple_enc_secret_yaml, tree / "apps" / "other-secret.yaml")
+    (tree / "secret.yaml").unlink()
+    assert _files(session) == [tree / "apps" / "other-secret.yaml", tree / "apps" / "secret.yaml"]
+
+
+def test_session_tasks_drop_deleted_directories(session, tree):
+    assert len(session.tasks(_scanner(session))) == 2
+
+    (tree / "apps" / "secret.yaml").unlink()
+    (tree / "apps").rmdir()
+    assert _files(session) == [tree / "secret.yaml"]
+
+
+def test_session_reloads_when_config_changes(session, tree, example_dotspos_yaml):
+    assert session.config_files() == [tree / ".sops.yaml"]
+    assert len(session.tasks(_scanner(session))) == 2
+
+    config = dict(example_dotspos_yaml)
+    config["creation_rules"] = [
+        {"path_regex": "apps/.*\\.yaml$", "encrypted_regex": "^(data|stringData)$"}
+    ]
+    YAML(typ="safe").dump(config, tree / ".sops.yaml")
+    assert _files(session) == [tree / "apps" / "secret.yaml"]
+
+
+def test_daemon_sessions_are_bounded(tmp_path):
+    daemon = Daemon(max_sessions=2)
+    try:
+        first = daemon.session(tmp_path, ".sops.yaml", 0)
+        assert daemon.session(tmp_path, ".sops.yaml", 0) is first
+        daemon.session(tmp_path, "other", 0)
+        daemon.session(tmp_path, "another", 0)
+        assert daemon.session(tmp_path, ".sops.yaml", 0) is not first
+    finally:
+        daemon.close()
+
+
+def test_daemon_handle_same_output_as_cli(tree):
+    args = [str(tree), "--config-regex", ".sops.ya?ml", "--summary"]
+    expected = CliRunner().invoke(cli, args)
+
+    daemon = Daemon()
+    try:
+        request = {"build": build_id(), "cwd": os.getcwd(), "args": args}
+        first = daemon.handle(request)
+        second = daemon.handle(request)
+    finally:
+        daemon.close()
+
+    assert first["exit_code"] == second["exit_code"] == expected.exit_code == 1
+    assert first["stdout"] + first["stderr"] == second["stdout"] + second["stderr"]
+    assert first["stdout"] + first["stderr"] == expected.output
+
+
+@pytest.mark.parametrize("watcher", ["inotify", "polling"])
+def test_daemon_handle_sees_the_changes_right_away(
+    monkeypatch, tree, simple_secret_yaml, simple_enc_secret_yaml, watcher
+):
+    if watcher == "polling":
+        monkeypatch.setattr(daemon_module, "create_watcher", PollingWatcher)
+    elif not sys.platform.startswith("linux"):
+        pytest.skip("inotify is only available on Linux")
+    (tree / "apps" / "secret.yaml").unlink()
+    args = [str(tree), "--config-regex", ".sops.ya?ml"]
+    request = {"build": build_id(), "cwd": os.getcwd(), "args": args}
+
+    daemon = Daemon()
+    try:
+        assert daemon.handle(request)["exit_code"] == 0
+
+        # A new unsafe file is reported by the request sent just after it's written
+        YAML(typ="safe").dump(simple_secret_yaml, tree / "new-secret.yaml")
+        response = daemon.handle(request)
+        assert response["exit_code"] == 1
+        assert "new-secret.yaml::password [UNSAFE]" in response["stdout"]
+
+        # A deleted file is no longer checked, rather than reported as broken
+        (tree / "new-secret.yaml").unlink()
+        response = daemon.handle(request)
+        assert response["exit_code"] == 0
+        assert "new-secret.yaml" not in response["stdout"] + response["stderr"]
+    finally:
+        daemon.close()
+
+
+def test_daemon_handle_rejects_other_installations_and_watch(tree):
+    daemon = Daemon()
+    try:
+        response = daemon.handle({"build": "other", "cwd": os.getcwd(), "args": [str(tree)]})
+        assert "error" in response
+
+        args = [str(tree), "--config-regex", ".sops.ya?ml", "--watch"]
+        response = daemon.handle({"build": build_id(), "cwd": os.getcwd(), "args": args})
+        assert response["exit_code"] == 2
+        assert "can't be sent to a daemon" in response["stderr"]
+    finally:
+        daemon.close()
+
+
+def test_cli_serve_needs_socket(tree):
+    result = CliRunner().invoke(cli, [str(tree), "--config-regex", ".sops.ya?ml", "--serve"])
+    assert result.exit_code == 2
+    assert "--serve needs --socket" in result.output
+
+
+def test_cli_serve_rejects_watch(tree):
+    args = [str(tree), "--config-regex", ".sops.ya?ml", "--serve", "--watch"]
+    result = CliRunner().invoke(cli, args + ["--socket", str(tree / "isops.sock")])
+    assert result.exit_code == 2
+    assert "--watch and --serve are mutually exclusive." in result.output
+    assert not (tree / "isops.sock").exists()
+
+
+def test_client_runs_checks_locally_without_daemon(monkeypatch, tree, capsys):
+    monkeypatch.setattr(sys, "argv", ["isops"])
+    args = [str(tree), "--config-regex", ".sops.ya?ml", "--socket", str(tree / "missing.sock")]
+    assert request(str(tree / "missing.sock"), args) is None
+
+    with pytest.raises(SystemExit) as exit_info:
+        client_module.main(args)
+    assert exit_info.value.code == 1
+    assert "apps/secret.yaml::password [UNSAFE]" in capsys.readouterr().out
+
+
+def test_client_runs_watch_locally(monkeypatch, tree, capsys):
+    class InterruptedWatcher:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def wait(self, timeout=None):
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(sys, "argv", ["isops"])
+    monkeypatch.setattr(client_module, "request", lambda *args: pytest.fail("forwarded"))
+    monkeypatch.setattr("isops.cli.create_watcher", lambda path: InterruptedWatcher())
+    args = [str(tree), "--config-regex", ".sops.ya?ml", "--socket", str(tree / "isops.sock")]
+
+    with pytest.raises(SystemExit) as exit_info:
+        client_module.main(args + ["-qw"])
+    assert exit_info.value.code == 1
+    assert "apps/secret.yaml::password [UNSAFE]" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    "args, local",
+    [
+        (["-q", "-s"], False),
+        (["-qs"], False),
+        (["-qw"], True),
+        (["-wq"], True),
+        (["-sqh"], True),
+        (["--watch"], True),
+        (["--watch=1"], True),
+        (["--help"], True),
+        (["--serve"], True),
+        # the rest of the group is the value of '-r'
+        (["-qr.w.yaml"], False),
+        # a value that looks like a local option only runs the checks here
+        (["-r", "-w"], True),
+        (["--", "-w"], False),
+    ],
+)
+def test_client_runs_locally(args, local):
+    assert _runs_locally(args) == local
+
+
+def test_client_knows_the_short_options_with_a_value():
+    options = {
+        opt
+        for param in cli.params
+        if isinstance(param, click.Option) and not param.is_flag
+        for opt in param.opts
+        if not opt.startswith("--")
+    }
+
+    assert _SHORT_VALUE_OPTIONS == options
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix domain sockets")
+def test_serve_answers_clients(tmp_path, tree):
+    socket_path = tmp_path / "isops.sock"
+    args = [str(tree), "--config-regex", ".sops.ya?ml", "--socket", str(socket_path)]
+    server = subprocess.Popen(
+        [sys.executable, "-c", "from isops.client import main; main()", *args, "--serve"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not socket_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        response = request(str(socket_path), args)
+        assert response is not None
+        assert response["exit_code"] == 1
+        assert "apps/secret.yaml::password [UNSAFE]" in response["stdout"]
+
+        # A second daemon doesn't take over the socket
+        second = subprocess.run(
+            [sys.executable, "-c", "from isops.client import main; main()", *args, "--serve"],
+            capture_output=True,
+            text=True,
+        )
+        assert second.returncode == 1
+        assert "Another daemon is listening" in second.stdout
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    assert not socket_path.exists()
@@ -0,0 +1,67 @@
+import subprocess
+
+import pytest
+
+from isops.utils.git import GitError, changed_files
+
+
+def _git(repo, *args):
+    subprocess.run(
+        ["git", "-C", str(repo), "-c", "user.name=isops", "-c", "user.email=isops@test", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "sub").mkdir(parents=True)
+    (repo / "committed.yaml").write_text("test: 1")
+    (repo / "sub" / "committed.yaml").write_text("test: 2")
+    (repo / "deleted.yaml").write_text("test: 3")
+    _git(repo, "init", "-q")
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-q", "-m", "initial")
+    return repo
+
+
+def test_changed_files_staged(git_repo):
+    (git_repo / "sub" / "committed.yaml").write_text("test: changed")
+    (git_repo / "new.yaml").write_text("test: new")
+    (git_repo / "unstaged.yaml").write_text("test: unstaged")
+    (git_repo / "deleted.yaml").unlink()
+    _git(git_repo, "add", "sub/committed.yaml", "new.yaml", "deleted.yaml")
+
+    files = changed_files(git_repo, staged=True)
+
+    assert sorted(files) == [git_repo / "new.yaml", git_repo / "sub" / "committed.yaml"]
+
+
+def test_changed_files_since_ref(git_repo):
+    (git_repo / "sub" / "committed.yaml").write_text("test: changed")
+    _git(git_repo, "commit", "-q", "-am", "second")
+    (git_repo / "committed.yaml").write_text("test: changed")
+
+    files = changed_files(git_repo, since="HEAD~1")
+
+    assert sorted(files) == [git_repo / "committed.yaml", git_repo / "sub" / "committed.yaml"]
+
+
+def test_changed_files_only_inside_path(git_repo):
+    (git_repo / "sub" / "committed.yaml").write_text("test: changed")
+    (git_repo / "committed.yaml").write_text("test: changed")
+
+    files = changed_files(git_repo / "sub", since="HEAD")
+
+    assert files == [git_repo / "sub" / "committed.yaml"]
+
+
+def test_changed_files_unknown_ref(git_repo):
+    with pytest.raises(GitError):
+        changed_files(git_repo, since="idontexist")
+
+
+def test_changed_files_not_a_repo(tmp_path):
+    with pytest.raises(GitError):
+        changed_files(tmp_path, staged=True)
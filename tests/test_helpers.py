@@ -1,17 +1,31 @@
+import mmap
 import os
+import re
 from pathlib import Path
 
 import pytest
 from ruamel.yaml import YAML
 
+import isops.utils.helpers as helpers_module
 from isops.utils import (
+    KeyResult,
     all_dict_values,
+    detect_bytes_encoding,
     detect_encoding,
     find_all_files_by_regex,
+    find_all_files_by_rules,
     find_by_key,
+    iter_all_yaml,
     load_all_yaml,
+    load_all_yaml_bytes,
     load_all_yaml_with_encoding,
+    open_file,
+    prescan_yaml,
+    read_file,
+    scan_yaml_events,
+    verify_encryption_regex,
 )
+from isops.utils.checker import _classify_keys
 
 TESTS_PATH = os.path.dirname(os.path.realpath(__file__))
 SAMPLES_PATH = os.path.join(TESTS_PATH, "samples")
@@ -224,6 +238,68 @@ def test_load_all_yaml_with_encoding_utf16():
     assert data[0]["metadata"]["name"] == "mysecret-utf16"
 
 
+def test_load_all_yaml_bytes_agrees_with_files():
+    for name in ["simple_secret_utf16.yaml", "yaml_blocks.yaml"]:
+        path = Path(os.path.join(SAMPLES_PATH, name))
+        data = path.read_bytes()
+
+        assert detect_bytes_encoding(data) == detect_encoding(path)
+        assert load_all_yaml_bytes(data) == load_all_yaml_with_encoding(path)
+
+
+def test_read_file_maps_big_files(tmp_path, monkeypatch):
+    path = tmp_path / "secret.yaml"
+    path.write_bytes(b"data:\n  password: hunter2\n")
+    (tmp_path / "empty.yaml").write_bytes(b"")
+
+    with read_file(path) as data:
+        assert isinstance(data, bytes)
+        assert data == path.read_bytes()
+
+    monkeypatch.setattr(helpers_module, "MMAP_THRESHOLD", 0)
+    with read_file(path) as data:
+        assert isinstance(data, mmap.mmap)
+        assert data[:] == path.read_bytes()
+        assert scan_yaml_events(data, [re.compile("^data$")]) == (
+            [KeyResult(0, ("data", "password"), False)],
+            True,
+        )
+    assert data.closed
+    # Empty files can't be mapped
+    with read_file(tmp_path / "empty.yaml") as data:
+        assert data == b""
+
+
+def test_open_file_streams_huge_files(tmp_path):
+    path = tmp_path / "bundle.yaml"
+    path.write_bytes(b"a: 1\n---\nb: 2\n")
+
+    with open_file(path, stream_threshold=1024) as data:
+        assert data == path.read_bytes()
+    with open_file(path, stream_threshold=8) as stream:
+        assert not isinstance(stream, bytes)
+        assert list(iter_all_yaml(stream)) == [{"a": 1}, {"b": 2}]
+
+
+def test_read_file_missing(tmp_path):
+    with pytest.raises(OSError):
+        with read_file(tmp_path / "missing.yaml"):
+            pass
+
+
+def test_load_all_yaml_with_encoding_mapped(monkeypatch):
+    paths = [Path(os.path.join(SAMPLES_PATH, name)) for name in sorted(os.listdir(SAMPLES_PATH))]
+    expected = [load_all_yaml_with_encoding(path) for path in paths]
+
+    monkeypatch.setattr(helpers_module, "MMAP_THRESHOLD", 0)
+
+    assert [load_all_yaml_with_encoding(path) for path in paths] == expected
+
+
+def test_load_all_yaml_bytes_invalid():
+    assert load_all_yaml_bytes(b"[") == ([], None)
+
+
 def test_load_all_yaml_with_encoding_utf8():
     """Test that load_all_yaml_with_encoding returns correct data and encoding for UTF-8 files"""
     path = Path(os.path.join(SAMPLES_PATH, "simple_secret.yaml"))
@@ -304,3 +380,320 @@ def test_find_all_files_without_gitignore(tmp_path):
     assert "file1.yaml" in found_names
     assert "file2.yaml" in found_names
     assert "file3.yaml" in found_names
+
+
+def test_find_all_files_by_rules_first_match_wins(tmp_path):
+    """Test that only the first matching rule of each rule set is assigned"""
+    (tmp_path / "secret.yaml").write_text("test: 1")
+    (tmp_path / "secret.enc.yaml").write_text("test: 2")
+    (tmp_path / "README.md").write_text("test")
+
+    rule_sets = [[r"secret\.yaml$", r"\.yaml$"], [r"\.enc\.yaml$"]]
+    found = {f.name: matches for f, matches in find_all_files_by_rules(rule_sets, tmp_path)}
+
+    assert found == {
+        "secret.yaml": [(0, 0)],
+        "secret.enc.yaml": [(0, 1), (1, 0)],
+    }
+
+
+def test_find_all_files_by_rules_walks_once(tmp_path, monkeypatch):
+    """Test that the tree is walked once regardless of the number of rules"""
+    (tmp_path / "file.yaml").write_text("test: 1")
+    calls = []
+    real_scandir = os.scandir
+
+    def counting_scandir(*args, **kwargs):
+        calls.append(args)
+        return real_scandir(*args, **kwargs)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    rule_sets = [[rf"file{i}\.yaml$" for i in range(10)] + [r"\.yaml$"]] * 4
+    found = list(find_all_files_by_rules(rule_sets, tmp_path))
+
+    assert len(calls) == 1
+    assert found == [(tmp_path / "file.yaml", [(0, 10), (1, 10), (2, 10), (3, 10)])]
+
+
+@pytest.mark.parametrize("threads", [0, 4])
+def test_find_all_files_paths(tmp_path, monkeypatch, threads):
+    """Test that the files are found with the same paths as the root given"""
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "file.yaml").write_text("test: 1")
+    (tmp_path / "file.yaml").write_text("test: 1")
+    (tmp_path / "link").symlink_to(tmp_path / "a")
+    (tmp_path / "file-link.yaml").symlink_to(tmp_path / "file.yaml")
+    expected = [Path("a/b/file.yaml"), Path("file-link.yaml"), Path("file.yaml")]
+
+    for root in [tmp_path, tmp_path / "a" / ".."]:
+        found = sorted(find_all_files_by_regex(re.compile(r"\.yaml$"), root, threads=threads))
+        assert found == [root / file for file in expected]
+
+    monkeypatch.chdir(tmp_path)
+    found = sorted(find_all_files_by_regex(re.compile(r"^a/.*\.yaml$"), Path("."), threads))
+    assert found == [Path("a/b/file.yaml")]
+
+
+def test_find_all_files_by_rules_respects_gitignore(tmp_path):
+    """Test that find_all_files_by_rules respects .gitignore patterns"""
+    (tmp_path / "ignored_dir").mkdir()
+    (tmp_path / "file.yaml").write_text("test: 1")
+    (tmp_path / "ignored.yaml").write_text("test: 2")
+    (tmp_path / "ignored_dir" / "file.yaml").write_text("test: 3")
+    (tmp_path / ".gitignore").write_text("ignored_dir/\nignored.yaml\n")
+
+    found = [f for f, _ in find_all_files_by_rules([[r"\.yaml$"]], tmp_path)]
+
+    assert found == [tmp_path / "file.yaml"]
+
+
+def test_find_all_files_respects_nested_ignore_files(tmp_path, monkeypatch):
+    """Test that the nested .gitignore, .isopsignore and .git/info/exclude are respected"""
+    (tmp_path / ".git" / "info").mkdir(parents=True)
+    (tmp_path / ".git" / "info" / "exclude").write_text("*.local.yaml\n")
+    (tmp_path / "app" / "generated").mkdir(parents=True)
+    (tmp_path / "app" / "fixtures").mkdir()
+    (tmp_path / "app" / ".gitignore").write_text("generated/\n")
+    (tmp_path / "app" / ".isopsignore").write_text("fixtures/\n")
+    for name in [
+        "a.yaml",
+        "a.local.yaml",
+        "app/b.yaml",
+        "app/generated/c.yaml",
+        "app/fixtures/d.yaml",
+    ]:
+        (tmp_path / name).write_text("test: 1")
+
+    walked = []
+    scandir = os.scandir
+
+    def spy_scandir(directory):
+        walked.append(Path(directory))
+        return scandir(directory)
+
+    monkeypatch.setattr(os, "scandir", spy_scandir)
+    found = sorted(find_all_files_by_regex(re.compile(r"\.yaml$"), tmp_path))
+
+    assert found == [tmp_path / "a.yaml", tmp_path / "app" / "b.yaml"]
+    # the ignored directories are not walked
+    assert sorted(walked) == [tmp_path, tmp_path / "app"]
+
+    candidates = [tmp_path / "app" / "generated" / "c.yaml", tmp_path / "app" / "b.yaml"]
+    found = [f for f, _ in find_all_files_by_rules([[r"\.yaml$"]], tmp_path, candidates)]
+    assert found == [tmp_path / "app" / "b.yaml"]
+
+
+ENC_VALUE = (
+    "ENC[AES256_GCM,data:XFJC29P4T44=,iv:LC2cNV1I2MT3pREbWwq8UFS62PS2LreFhxrrOrWt/1U=,"
+    "tag:0DyNMTHMUljO/ncBwbcxQQ==,type:str]"
+)
+EXAMPLE_PATH = os.path.join(os.path.dirname(TESTS_PATH), "example")
+CORPUS = [
+    os.path.join(directory, name)
+    for directory in [
+        SAMPLES_PATH,
+        os.path.join(EXAMPLE_PATH, "dev"),
+        os.path.join(EXAMPLE_PATH, "prod"),
+    ]
+    for name in sorted(os.listdir(directory))
+]
+
+
+def _full_parse_keys(documents, encrypted_regex):
+    keys = []
+    for index, document in enumerate(documents):
+        if document is None:
+            continue
+        classified = list(_classify_keys(document, encrypted_regex.search, index))
+        # The single walk finds the same keys as find_by_key and all_dict_values
+        document = {key: value for key, value in document.items() if key != "sops"}
+        assert [(key.key, key.is_safe) for key in classified] == [
+            (key, bool(verify_encryption_regex(value)))
+            for match in find_by_key(document, encrypted_regex)
+            for key, value in all_dict_values(match)
+        ]
+        keys += classified
+    return keys
+
+
+@pytest.mark.parametrize("path", CORPUS)
+@pytest.mark.parametrize("encrypted_regex", ["^(data|stringData)$", "^data$", "^metadata$", ""])
+def test_prescan_yaml_agrees_with_full_parse(path, encrypted_regex):
+    """Test that the pre-scanner never contradicts the full parser on the corpus"""
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return
+
+    pattern = re.compile(encrypted_regex)
+    keys = prescan_yaml(text, pattern)
+
+    if keys is not None:
+        assert keys == _full_parse_keys(YAML(typ="safe").load_all(text), pattern)
+        assert all(key.is_safe for key in keys)
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        os.path.join(SAMPLES_PATH, "simple_secret.enc.yaml"),
+        os.path.join(EXAMPLE_PATH, "dev", "api-key-secret.yaml"),
+        os.path.join(EXAMPLE_PATH, "prod", "db-password-secret.yaml"),
+    ],
+)
+def test_prescan_yaml_proves_encrypted_files_safe(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+
+    assert prescan_yaml(text, re.compile("^(data|stringData)$"))
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        (f"data:\n  key: {ENC_VALUE}\nkind: Secret\n", [(0, ("data", "key"))]),
+        (
+            f"data:\n- a: {ENC_VALUE}\n- plain\n- b: {ENC_VALUE}\n",
+            [(0, ("data", 0, "a")), (0, ("data", 2, "b"))],
+        ),
+        (
+            f"x:\n  data:\n    k: {ENC_VALUE}  # comment\n  data2: plain\n",
+            [(0, ("x", "data", "k"))],
+        ),
+        (f"data: {ENC_VALUE}\n---\n---\ndata: {ENC_VALUE}\n", [(0, ("data",)), (2, ("data",))]),
+        (f"---\ndata: {ENC_VALUE}\n---\ndata: {ENC_VALUE}\n", [(0, ("data",)), (1, ("data",))]),
+        (
+            "sops:\n    pgp:\n    - enc: |\n        data: plain\n      fp: x\n    data: plain\n",
+            [],
+        ),
+        (f"data:\n  a: []\n  b: {{}}\nx: |\n  data: plain\nz: {ENC_VALUE}\n", []),
+    ],
+)
+def test_prescan_yaml_safe_files(text, expected):
+    expected = [KeyResult(document, path, True) for document, path in expected]
+
+    assert prescan_yaml(text, re.compile("^data$")) == expected
+    assert _full_parse_keys(YAML(typ="safe").load_all(text), re.compile("^data$")) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "# only a comment\n",
+        "data:\n  key: plain\n",
+        f'data:\n  key: "{ENC_VALUE}"\n',
+        "data:\n  key:\n",
+        "data:\n  key: |\n    multi\n",
+        f"data: {{key: {ENC_VALUE}}}\n",
+        f"data:\n  key: &anchor {ENC_VALUE}\n",
+        f"data:\n\tkey: {ENC_VALUE}\n",
+        f"data:\n  key: {ENC_VALUE}\n  key: {ENC_VALUE}\n",
+        f"data:\n  key: {ENC_VALUE}\n wrong: indent\n",
+        f"- data:\n    key: {ENC_VALUE}\n",
+        "x: |\n    a\n  b\n",
+        "x: plain\n  continued\n",
+        "x: a: b\n",
+        "%YAML 1.1\n---\nx: y\n",
+        "true: x\n",
+    ],
+)
+def test_prescan_yaml_needs_full_parse(text):
+    assert prescan_yaml(text, re.compile("^data$")) is None
+
+
+@pytest.mark.parametrize("path", CORPUS)
+def test_scan_yaml_events_agrees_with_full_parse(path):
+    """Test that the event scanner finds the same keys as the full parser on the corpus"""
+    regexes = [re.compile("^(data|stringData)$"), re.compile("^metadata$"), re.compile("")]
+    scanned = scan_yaml_events(Path(path), regexes)
+    if scanned is None:
+        return
+
+    keys, is_valid = scanned
+    if not is_valid:
+        assert not load_all_yaml_with_encoding(Path(path))[0]
+        return
+    documents, _ = load_all_yaml_with_encoding(Path(path))
+    assert keys == [key for regex in regexes for key in _full_parse_keys(documents, regex)]
+
+
+def test_scan_yaml_events_classifies_keys(tmp_path):
+    """Test that the event scanner checks nested keys and skips the sops metadata"""
+    path = tmp_path / "secret.yaml"
+    path.write_text(
+        "---\n"
+        "data:\n"
+        f"  a: {ENC_VALUE}\n"
+        "  b: plain\n"
+        "  nested:\n"
+        "    - c: plain\n"
+        "other: plain\n"
+        "sops:\n"
+        "  data: plain\n"
+        "---\n"
+        "---\n"
+        "data: {d: plain}\n"
+    )
+
+    keys, is_valid = scan_yaml_events(path, [re.compile("^data$")])
+
+    assert is_valid
+    assert keys == [
+        KeyResult(0, ("data", "a"), True),
+        KeyResult(0, ("data", "b"), False),
+        KeyResult(0, ("data", "nested", 0, "c"), False),
+        KeyResult(2, ("data", "d"), False),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "data: &anchor {a: plain}\nother: *anchor\n",
+        "data: !!binary aGVsbG8=\n",
+        "data: !custom {a: plain}\n",
+        "data:\n  1: plain\n",
+        "? [a, b]\n: plain\n",
+        "- data: plain\n",
+        "%YAML 1.1\n---\ndata: {a: plain}\n",
+    ],
+)
+def test_scan_yaml_events_needs_full_parse(tmp_path, text):
+    """Test that the event scanner falls back on what it can't classify from the events"""
+    path = tmp_path / "secret.yaml"
+    path.write_text(text)
+
+    assert scan_yaml_events(path, [re.compile("^data$")]) is None
+
+
+@pytest.mark.parametrize("text", ["data: [a\n", "a: b: c\n", ""])
+def test_scan_yaml_events_invalid_yaml(tmp_path, text):
+    """Test that the event scanner reports invalid or empty files as not valid"""
+    path = tmp_path / "secret.yaml"
+    path.write_text(text)
+
+    assert scan_yaml_events(path, [re.compile("^data$")]) == ([], False)
+
+
+def test_scan_yaml_events_memory_does_not_grow_with_the_file(tmp_path):
+    """Test that the event scanner doesn't keep the documents in memory"""
+    import tracemalloc
+
+    path = tmp_path / "big.yaml"
+    with open(path, "w") as f:
+        f.write("kind: Secret\ndata:\n")
+        for i in range(20000):
+            f.write(f"  key{i}: {ENC_VALUE}\n")
+
+    tracemalloc.start()
+    try:
+        keys, is_valid = scan_yaml_events(path, [re.compile("^metadata$")])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert (keys, is_valid) == ([], True)
+    assert peak < path.stat().st_size // 10
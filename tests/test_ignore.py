@@ -0,0 +1,182 @@
+import random
+import re
+import shutil
+import subprocess
+
+import pathspec
+import pytest
+
+from isops.utils.helpers import find_all_files_by_regex
+from isops.utils.ignore import IgnoreMatcher, _compile
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / ".git" / "info").mkdir(parents=True)
+    (tmp_path / ".git" / "info" / "exclude").write_text("*.local.yaml\n")
+    (tmp_path / ".gitignore").write_text("vendor/\n*.tmp.yaml\n**/docs/build\n")
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app" / ".gitignore").write_text("generated/\n!keep.tmp.yaml\n")
+    (tmp_path / "app" / ".isopsignore").write_text("fixtures/\n")
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "path, is_dir, ignored",
+    [
+        ("secret.yaml", False, False),
+        ("secret.tmp.yaml", False, True),
+        ("secret.local.yaml", False, True),
+        ("vendor", True, True),
+        ("vendor/secret.yaml", False, True),
+        ("app/secret.yaml", False, False),
+        ("app/generated", True, True),
+        ("app/generated/secret.yaml", False, True),
+        ("app/fixtures/secret.yaml", False, True),
+        # the deeper ignore file takes precedence
+        ("app/keep.tmp.yaml", False, False),
+        ("other/keep.tmp.yaml", False, True),
+        ("app/docs/build", True, True),
+        ("app/build", True, False),
+        # 'generated/' is relative to 'app'
+        ("generated/secret.yaml", False, False),
+    ],
+)
+def test_ignore_matcher(tree, path, is_dir, ignored):
+    assert IgnoreMatcher(tree).is_ignored(path, is_dir) == ignored
+
+
+def test_ignore_matcher_files_in_ignored_directories_cant_be_included(tmp_path):
+    (tmp_path / ".gitignore").write_text("vendor/\n!vendor/keep.yaml\n")
+
+    assert IgnoreMatcher(tmp_path).is_ignored("vendor/keep.yaml")
+
+
+def test_ignore_matcher_chain_is_compiled_once(tree):
+    matcher = IgnoreMatcher(tree)
+
+    chain = matcher.chain("app/")
+
+    assert [ignore_file.directory for ignore_file in chain] == ["", "", "app/", "app/"]
+    assert matcher.chain("app/") is chain
+    # the ignore files that aren't listed are not looked for
+    assert matcher.chain("app/sub/", names=["secret.yaml"]) == chain
+
+
+def test_ignore_matcher_predicate(tree):
+    is_ignored = IgnoreMatcher(tree).predicate("app/")
+
+    assert is_ignored("app/x.tmp.yaml")
+    assert not is_ignored("app/keep.tmp.yaml")
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["a.yaml", "a.tmp", "build/", "build", "x/build/", "docs/a.md", "docs/keep.md", "x/docs/a/"],
+)
+def test_ignore_matcher_agrees_with_pathspec(tmp_path, path):
+    patterns = ["*.tmp", "build/", "/docs/*", "!docs/keep.md", "**/docs/a", "a.*", "!a.yaml"]
+    (tmp_path / ".gitignore").write_text("\n".join(patterns))
+    spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+
+    matcher = IgnoreMatcher(tmp_path)
+    ignored = matcher.match(path.rstrip("/"), path.endswith("/"), matcher.chain(""))
+
+    assert ignored == bool(spec.check_file(path).include)
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "*.tmp",
+        "build/",
+        "/build",
+        "/a/**",
+        "a/**/",
+        "a/**/b",
+        "**/docs",
+        "docs/*.md",
+        "!keep.yaml",
+        "[ab]/",
+        "?.yaml",
+    ],
+)
+def test_ignore_file_patterns_are_combined(pattern):
+    # Falling back to pathspec is correct but slow: a pathspec release that
+    # writes these regexes differently must be noticed
+    ignore_file = _compile("", pathspec.PathSpec.from_lines("gitwildmatch", [pattern, "*.local"]))
+
+    assert ignore_file.regex is not None
+    assert ignore_file.any_depth is not None
+
+
+@pytest.mark.parametrize(
+    "patterns, path, is_dir, ignored",
+    [
+        # the last matching pattern wins, whatever the kind of the patterns
+        (["/*", "!*/"], "build", True, False),
+        (["/*", "!*/"], "build/secret.yaml", False, False),
+        (["/*", "!*/"], "secret.yaml", False, True),
+        (["*/"], "build", True, True),
+        (["*/"], "secret.yaml", False, False),
+        # a pattern matches the path, not the content of a directory
+        (["build/", "!build/"], "build/secret.yaml", False, False),
+        (["a/**"], "a", True, False),
+        (["a/**"], "a/secret.yaml", False, True),
+        (["a/**/"], "a/secret.yaml", False, False),
+        (["a/**/"], "a/b", True, True),
+    ],
+)
+def test_ignore_matcher_last_matching_pattern_wins(tmp_path, patterns, path, is_dir, ignored):
+    (tmp_path / ".gitignore").write_text("\n".join(patterns))
+
+    assert IgnoreMatcher(tmp_path).is_ignored(path, is_dir) == ignored
+
+
+def test_ignore_matcher_reincluded_directories_are_walked(tmp_path):
+    (tmp_path / ".gitignore").write_text("/*\n!*/\n")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / ".sops.yaml").write_text("creation_rules: []")
+    (tmp_path / "build" / "secret.yaml").write_text("password: 1")
+    (tmp_path / "secret.yaml").write_text("password: 1")
+
+    files = find_all_files_by_regex(re.compile(""), tmp_path)
+
+    assert sorted(file.relative_to(tmp_path).as_posix() for file in files) == [
+        "build/.sops.yaml",
+        "build/secret.yaml",
+    ]
+
+
+_GIT_PATTERNS = [
+    "*", "*/", "/*", "!*/", "*.yaml", "!*.yaml", "*.tmp.yaml", "?.yaml", "x*.yaml", "c*",
+    "!c.yaml", "!**/c.yaml", "!keep.yaml", "a/", "!a/", "/a", "!/a", "b", "!b/", "/a/b",
+    "!/a/b/", "/a/*", "a/*/c.yaml", "build/", "!build/", "/build", "**/build/", "build/**",
+    "**", "**/b", "/**/b", "a/**", "!a/**", "a/**/", "b/**/*.yaml", "*.yaml/", "[ab]/",
+]  # fmt: skip
+_GIT_DIRS = ["", "a/", "b/", "build/", "a/b/", "a/build/", "b/c/", "build/a/"]
+_GIT_FILES = ["x.yaml", "keep.yaml", "c.yaml", "y.tmp.yaml", "z.txt"]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+@pytest.mark.parametrize("seed", range(100))
+def test_ignore_matcher_agrees_with_git(tmp_path, seed):
+    rng = random.Random(seed)
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    for directory in _GIT_DIRS:
+        (tmp_path / directory).mkdir(exist_ok=True)
+        for name in rng.sample(_GIT_FILES, rng.randint(1, 3)):
+            (tmp_path / directory / name).write_text("test: 1")
+    for directory in [""] + rng.sample(_GIT_DIRS[1:], rng.randint(0, 2)):
+        patterns = rng.sample(_GIT_PATTERNS, rng.randint(1, 4))
+        (tmp_path / directory / ".gitignore").write_text("\n".join(patterns) + "\n")
+
+    listed = subprocess.run(
+        ["git", "-C", str(tmp_path), "ls-files", "-o", "--exclude-standard"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+    files = find_all_files_by_regex(re.compile(""), tmp_path)
+
+    assert sorted(file.relative_to(tmp_path).as_posix() for file in files) == sorted(listed)
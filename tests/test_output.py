@@ -0,0 +1,53 @@
+import io
+from pathlib import Path
+
+from isops.utils.output import OutputWriter
+
+
+def test_output_writer_buffers_until_flush():
+    file = io.StringIO()
+    output = OutputWriter(file)
+
+    output.status(Path("secret.yaml"), "password", False, "utf-8")
+    output.secho("---", bold=True)
+    assert file.getvalue() == ""
+
+    output.flush()
+    assert file.getvalue() == "secret.yaml::password [UNSAFE]\n---\n"
+
+
+def test_output_writer_writes_when_the_buffer_is_full():
+    file = io.StringIO()
+    output = OutputWriter(file, buffer_size=30)
+
+    output.secho("a" * 10)
+    assert file.getvalue() == ""
+    output.secho("b" * 20)
+    assert file.getvalue() == "a" * 10 + "\n" + "b" * 20 + "\n"
+
+
+def test_output_writer_styles_only_with_color():
+    file = io.StringIO()
+    plain = OutputWriter(file)
+    plain.status(Path("secret.yaml"), "password", True, "utf-16-le")
+    plain.flush()
+
+    assert file.getvalue() == "secret.yaml::password [SAFE] [UTF-16 ENCODING]\n"
+
+    file = io.StringIO()
+    colored = OutputWriter(file, color=True)
+    colored.status(Path("secret.yaml"), "password", True, None)
+    colored.flush()
+
+    assert file.getvalue() == "secret.yaml::password \x1b[32m\x1b[22m[SAFE]\x1b[0m\n"
+
+
+def test_output_writer_quiet():
+    file = io.StringIO()
+    output = OutputWriter(file, quiet=True)
+
+    output.status(Path("secret.yaml"), "username", True, None)
+    output.status(Path("secret.yaml"), "password", False, None)
+    output.flush()
+
+    assert file.getvalue() == "secret.yaml::password [UNSAFE]\n"
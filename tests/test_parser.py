@@ -0,0 +1,84 @@
+import os
+import re
+from pathlib import Path
+
+import pytest
+from ruamel.yaml.parser import Parser
+
+import isops.utils.parser as parser_module
+from isops.utils import load_all_yaml_bytes, scan_yaml_events
+from isops.utils.parser import (
+    DEFAULT_PARSER,
+    ParserUnavailableError,
+    c_parser_available,
+    get_parser,
+    get_yaml,
+    set_parser,
+)
+
+TESTS_PATH = os.path.dirname(os.path.realpath(__file__))
+SAMPLES_PATH = os.path.join(TESTS_PATH, "samples")
+
+requires_c_parser = pytest.mark.skipif(
+    not c_parser_available(), reason="ruamel.yaml.clib is not installed"
+)
+
+
+@pytest.fixture(autouse=True)
+def default_parser():
+    yield
+    set_parser(DEFAULT_PARSER)
+
+
+def test_get_yaml_reuses_the_instance():
+    assert get_yaml() is get_yaml()
+    assert get_yaml("pure") is get_yaml("pure")
+    assert get_yaml("pure").Parser is Parser
+
+
+def test_set_parser():
+    set_parser("pure")
+
+    assert get_parser() == "pure"
+    assert get_yaml() is get_yaml("pure")
+
+
+def test_set_parser_unknown():
+    with pytest.raises(ValueError):
+        set_parser("rust")
+
+
+def test_set_parser_c_unavailable(monkeypatch):
+    monkeypatch.setattr(parser_module, "c_parser_available", lambda: False)
+
+    with pytest.raises(ParserUnavailableError):
+        set_parser("c")
+    with pytest.raises(ParserUnavailableError):
+        get_yaml("c")
+    # 'auto' falls back to the pure-Python parser
+    set_parser("auto")
+
+
+def test_get_yaml_does_not_grow():
+    for _ in range(10):
+        list(get_yaml().load_all("a: 1\n---\nb: 2\n"))
+
+    assert len(get_yaml().doc_infos) <= 1
+
+
+@requires_c_parser
+def test_get_yaml_c_parser():
+    assert get_yaml("c").Parser is not Parser
+    assert get_yaml("auto") is get_yaml("c")
+
+
+@requires_c_parser
+@pytest.mark.parametrize("name", sorted(os.listdir(SAMPLES_PATH)))
+def test_parsers_same_results(name):
+    data = Path(os.path.join(SAMPLES_PATH, name)).read_bytes()
+    regexes = [re.compile("^(data|stringData)$")]
+
+    assert load_all_yaml_bytes(data, get_yaml("c")) == load_all_yaml_bytes(data, get_yaml("pure"))
+    assert scan_yaml_events(data, regexes, get_yaml("c")) == scan_yaml_events(
+        data, regexes, get_yaml("pure")
+    )
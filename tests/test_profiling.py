@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+from isops.utils.profiling import Profiler, StageTimer
+
+
+def test_stage_timer_sums_repeated_stages():
+    timer = StageTimer()
+    for _ in range(3):
+        with timer.stage("parse"):
+            pass
+
+    wall, cpu, calls = timer.timings["parse"]
+    assert calls == 3
+    assert wall >= 0 and cpu >= 0
+
+
+def test_stage_timer_disabled():
+    timer = StageTimer(enabled=False)
+    with timer.stage("parse"):
+        pass
+
+    assert timer.timings == {}
+
+
+def test_profiler_timed_closes_the_iterable():
+    profiler = Profiler()
+    closed = []
+
+    def numbers():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    timed = profiler.timed("check", numbers())
+    assert next(timed) == 0
+    timed.close()
+
+    assert closed == [True]
+    assert profiler.timings["check"][2] == 1
+
+
+def test_profiler_report(tmp_path):
+    slow, fast = tmp_path / "slow.yaml", tmp_path / "fast.yaml"
+    slow.write_text("data: {}\n")
+    fast.write_text("data: {}\n")
+
+    profiler = Profiler(top=1)
+    with profiler.stage("discovery"):
+        pass
+    profiler.record_file(slow, {"scan": [2.0, 1.0, 1]}, {"key_lookups": 6, "key_memo_hits": 2})
+    profiler.record_file(
+        fast, {"scan": [1.0, 1.0, 1], "read": [0.5, 0.0, 1]}, {"key_lookups": 2, "key_memo_hits": 2}
+    )
+    profiler.record_file(Path(tmp_path / "cached.yaml"), None)
+
+    profile = json.loads(profiler.report("json"))
+    assert list(profile["stages"]) == ["discovery", "check/scan", "check/read"]
+    assert profile["stages"]["check/scan"] == {"wall": 3.0, "cpu": 2.0, "calls": 2}
+    assert profile["files"]["checked"] == 3
+    assert profile["files"]["cached"] == 1
+    assert profile["files"]["bytes"] == 18
+    assert profile["slowest_files"] == [{"path": str(slow), "wall": 2.0, "cpu": 1.0}]
+    assert profile["keys"] == {"lookups": 8, "memo_hits": 4, "memo_hit_rate": 0.5}
+
+    table = profiler.report("table")
+    assert table.startswith("Stage")
+    assert f"2.0000s  {slow}" in table
+    assert "Key names: 8 looked up, 50.0% found in the memo" in table
+    assert str(fast) not in table
@@ -0,0 +1,23 @@
+import re
+
+import pytest
+
+from isops.utils.regex import can_be_combined
+
+
+@pytest.mark.parametrize(
+    "pattern, combined",
+    [
+        (re.compile(r"\.ya?ml$"), True),
+        (re.compile(r"^(?P<name>[^/]+)/secret\.yaml$"), True),
+        # the group numbers and names change once combined
+        (re.compile(r"(a)\1"), False),
+        (re.compile(r"(?P<a>a)(?P=a)"), False),
+        (re.compile(r"(a)?(?(1)b|c)"), False),
+        # flags apply to the whole regex
+        (re.compile(r"secret", re.IGNORECASE), False),
+        (re.compile(rb"secret"), False),
+    ],
+)
+def test_can_be_combined(pattern, combined):
+    assert can_be_combined(pattern) == combined
@@ -0,0 +1,122 @@
+import io
+import json
+import xml.dom.minidom
+from pathlib import Path
+
+import pytest
+
+from isops.utils import KeyResult
+from isops.utils.output import OutputWriter
+from isops.utils.reporters import REPORTERS, Reporter
+
+SECRET = Path("dir/secret.yaml")
+BROKEN = Path("dir/broken.yaml")
+
+
+def _report(name, summary=False, quiet=False, broken=False):
+    file = io.StringIO()
+    output = OutputWriter(file, quiet=quiet)
+    reporter = REPORTERS[name](output, summary=summary)
+    reporter.start()
+    reporter.key(SECRET, KeyResult(0, ("data", "username"), True), "utf-8")
+    reporter.key(SECRET, KeyResult(1, ("data", "users", 0, "pass<word>"), False), "utf-8")
+    if broken:
+        reporter.invalid_file(BROKEN)
+    reporter.finish(1, 1, BROKEN if broken else None)
+    output.flush()
+    return file.getvalue()
+
+
+def test_reporters_registry():
+    assert list(REPORTERS) == ["text", "jsonl", "sarif", "junit"]
+
+
+def test_text_reporter():
+    assert _report("text", summary=True) == (
+        "---\n"
+        "dir/secret.yaml::username [SAFE]\n"
+        "dir/secret.yaml::pass<word> [UNSAFE]\n"
+        "---\n"
+        "Summary:\n"
+        "UNSAFE secret 'pass<word>' in 'dir/secret.yaml'\n"
+        "1 safe 1 unsafe\n"
+    )
+
+
+@pytest.mark.parametrize("quiet", [True, False])
+def test_jsonl_reporter(quiet):
+    records = [json.loads(line) for line in _report("jsonl", True, quiet, True).splitlines()]
+
+    expected = [
+        {
+            "file": "dir/secret.yaml",
+            "key": "username",
+            "path": ["data", "username"],
+            "document": 0,
+            "safe": True,
+            "encoding": "utf-8",
+        },
+        {
+            "file": "dir/secret.yaml",
+            "key": "pass<word>",
+            "path": ["data", "users", 0, "pass<word>"],
+            "document": 1,
+            "safe": False,
+            "encoding": "utf-8",
+        },
+        {"file": "dir/broken.yaml", "error": "not a valid YAML"},
+        {"summary": {"safe": 1, "unsafe": 1, "broken": "dir/broken.yaml"}},
+    ]
+    assert records == (expected[1:] if quiet else expected)
+
+
+@pytest.mark.parametrize("broken", [True, False])
+def test_sarif_reporter(broken):
+    log = json.loads(_report("sarif", broken=broken))
+
+    assert log["version"] == "2.1.0"
+    (run,) = log["runs"]
+    assert run["tool"]["driver"]["name"] == "isops"
+    assert [result["ruleId"] for result in run["results"]] == ["unencrypted-secret"] + (
+        ["invalid-yaml"] if broken else []
+    )
+    assert run["results"][0]["message"]["text"] == (
+        "UNSAFE secret 'data.users[0].pass<word> (document 1)' in 'dir/secret.yaml'"
+    )
+    location = run["results"][0]["locations"][0]["physicalLocation"]
+    assert location["artifactLocation"]["uri"] == "dir/secret.yaml"
+
+
+def test_sarif_reporter_nothing_to_report():
+    file = io.StringIO()
+    output = OutputWriter(file)
+    reporter = REPORTERS["sarif"](output)
+    reporter.start()
+    output.flush()
+    assert file.getvalue() == ""
+
+    reporter.finish(0, 0, None)
+    output.flush()
+    assert json.loads(file.getvalue())["runs"][0]["results"] == []
+
+
+def test_junit_reporter():
+    document = xml.dom.minidom.parseString(_report("junit", broken=True))
+
+    testcases = document.getElementsByTagName("testcase")
+    assert [testcase.getAttribute("name") for testcase in testcases] == [
+        "data.username",
+        "data.users[0].pass<word> (document 1)",
+        "valid YAML",
+    ]
+    assert [len(testcase.getElementsByTagName("failure")) for testcase in testcases] == [0, 1, 1]
+    assert testcases[0].getAttribute("classname") == "dir/secret.yaml"
+
+
+def test_reporter_needs_key_and_invalid_file():
+    class NoInvalidFile(Reporter):
+        def key(self, file, key, encoding):
+            pass
+
+    with pytest.raises(TypeError):
+        NoInvalidFile(OutputWriter(io.StringIO()))
@@ -0,0 +1,85 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from isops import CreationRule, FileResult, InvalidRuleError, KeyResult, Scanner
+
+TESTS_PATH = os.path.dirname(os.path.realpath(__file__))
+SAMPLES_PATH = os.path.join(TESTS_PATH, "samples")
+ENC_VALUE = (
+    "ENC[AES256_GCM,data:XFJC29P4T44=,iv:LC2cNV1I2MT3pREbWwq8UFS62PS2LreFhxrrOrWt/1U=,"
+    "tag:0DyNMTHMUljO/ncBwbcxQQ==,type:str]"
+)
+
+
+@pytest.fixture
+def scanner():
+    return Scanner(
+        [
+            [
+                CreationRule.from_config({"path_regex": r"secret\.yaml$"}),
+                CreationRule.from_config({"path_regex": r"\.yaml$", "encrypted_regex": "^data$"}),
+            ]
+        ]
+    )
+
+
+def test_scanner_first_matching_rule_wins(scanner):
+    assert [regex.pattern for regex in scanner.encrypted_regexes("a/secret.yaml")] == [""]
+    assert [regex.pattern for regex in scanner.encrypted_regexes("a/other.yaml")] == ["^data$"]
+    assert scanner.encrypted_regexes("a/other.json") == []
+
+
+def test_scanner_scan_bytes(scanner):
+    data = f"data:\n  password: {ENC_VALUE}\n  user: plain\nkind: Secret\n".encode()
+
+    assert scanner.scan_bytes(data, "app.yaml") == FileResult(
+        Path("app.yaml"),
+        [KeyResult(0, ("data", "password"), True), KeyResult(0, ("data", "user"), False)],
+        "utf-8",
+        True,
+    )
+    assert scanner.scan_bytes(data, "app.json").keys == []
+    assert not scanner.scan_bytes(b"data: [", "app.yaml").is_valid
+
+
+def test_scanner_scan_document(scanner):
+    document = {"data": {"password": ENC_VALUE}, "kind": "Secret"}
+
+    assert scanner.scan_document(document, "app.yaml") == [KeyResult(0, ("data", "password"), True)]
+    assert scanner.scan_document(document, "app.json") == []
+
+
+def test_scanner_from_config_regex_and_scan_path(tmp_path):
+    shutil.copy(os.path.join(SAMPLES_PATH, ".sops.yaml"), tmp_path / ".sops.yaml")
+    shutil.copy(os.path.join(SAMPLES_PATH, "simple_secret.yaml"), tmp_path / "simple_secret.yaml")
+    (tmp_path / "notes.txt").write_text("data: plain\n")
+
+    scanner = Scanner.from_config_regex(r"\.sops\.yaml$", tmp_path)
+    assert scanner.config_files == [tmp_path / ".sops.yaml"]
+
+    results = list(scanner.scan_path(tmp_path))
+    assert [result.path for result in results] == [tmp_path / "simple_secret.yaml"]
+    assert results[0].keys
+    assert list(scanner.scan_path(tmp_path / "simple_secret.yaml")) == results
+    assert list(scanner.scan_path(tmp_path / "notes.txt")) == []
+
+
+def test_scanner_from_config_files_skips_configs_without_rules(tmp_path):
+    config = tmp_path / ".sops.yaml"
+    config.write_text("sops: {}\n---\ncreation_rules:\n  - path_regex: x\n")
+
+    scanner = Scanner.from_config_files([config])
+
+    assert scanner.config_files == [config]
+    assert len(scanner.rule_sets) == 1
+
+
+def test_scanner_invalid_rule(tmp_path):
+    config = tmp_path / ".sops.yaml"
+    config.write_text("creation_rules:\n  - path_regex: '['\n")
+
+    with pytest.raises(InvalidRuleError):
+        Scanner.from_config_files([config])
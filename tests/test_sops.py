@@ -1,4 +1,16 @@
-from isops.utils import verify_encryption_regex
+import random
+import re
+
+import pytest
+
+from isops.utils import (
+    CreationRule,
+    InvalidRuleError,
+    KeyMatcher,
+    RuleMatcher,
+    verify_encryption_regex,
+)
+from isops.utils.sops import DEFAULT_ENCRYPTED_REGEX, DEFAULT_PATH_REGEX
 
 
 def test_verify_encryption_regex(simple_enc_secret_yaml):
@@ -12,3 +24,85 @@ def test_verify_encryption_regex(simple_enc_secret_yaml):
 
     not_secret = simple_enc_secret_yaml["sops"]["lastmodified"]
     assert verify_encryption_regex(not_secret) is None
+
+
+def test_creation_rule_from_config():
+    rule = CreationRule.from_config({"path_regex": r"\.enc\.yaml$", "encrypted_regex": "^data$"})
+
+    assert rule.path_regex.pattern == r"\.enc\.yaml$"
+    assert rule.encrypted_regex.pattern == "^data$"
+
+
+def test_creation_rule_from_config_defaults():
+    rule = CreationRule.from_config({"pgp": "FBC7B9E2A4F9289AC0C1D4843D16CEE4A27381B4"})
+
+    assert rule.path_regex.pattern == DEFAULT_PATH_REGEX
+    assert rule.encrypted_regex.pattern == DEFAULT_ENCRYPTED_REGEX
+
+
+@pytest.mark.parametrize("field", ["path_regex", "encrypted_regex"])
+def test_creation_rule_from_config_invalid_regex(field):
+    with pytest.raises(InvalidRuleError, match=f"Invalid regex for '{field}': \\["):
+        CreationRule.from_config({field: "["})
+
+
+def _first(regexes, path):
+    # The first matching regex, one at a time
+    return next((i for i, regex in enumerate(regexes) if re.search(regex, path)), None)
+
+
+def test_rule_matcher_returns_first_rule_not_leftmost_match():
+    # The second regex matches earlier in the path, but the first one wins
+    regexes = [r"prod/.*\.yaml$", r"^overlays/", r"\.yaml$"]
+    matcher = RuleMatcher(regexes)
+
+    assert matcher.first("overlays/prod/secret.yaml") == 0
+    assert matcher.first("overlays/dev/secret.yaml") == 1
+    assert matcher.first("base/secret.yaml") == 2
+    assert matcher.first("base/secret.json") is None
+    assert RuleMatcher([]).first("secret.yaml") is None
+
+
+@pytest.mark.parametrize(
+    "odd_regex",
+    [r"(?i)SECRET\.yaml$", r"(a)\1/secret\.yaml$", r"(?P<n>a)(?P=n)/secret\.yaml$", r"(?P<x>.)"],
+)
+def test_rule_matcher_regexes_that_cant_be_combined(odd_regex):
+    # Inline flags and group references would change meaning, and a group name
+    # used twice can't be compiled in one alternation
+    regexes = [rf"team{i}/.*\.yaml$" for i in range(20)] + [r"^(?P<x>z)/", odd_regex]
+    matcher = RuleMatcher(regexes)
+
+    for path in ["aa/secret.yaml", "team3/secret.yaml", "x/Secret.YAML", "", "team19/a.yml"]:
+        assert matcher.first(path) == _first(regexes, path)
+
+
+@pytest.mark.parametrize("rules", [1, 7, 8, 9, 100])
+def test_rule_matcher_same_as_one_regex_at_a_time(rules):
+    generator = random.Random(rules)
+    regexes = [
+        generator.choice([rf"team{i}/.*\.yaml$", rf"^env{i % 5}/", rf"/app{i}\.ya?ml$", rf"{i}$"])
+        for i in range(rules)
+    ]
+    matcher = RuleMatcher(regexes)
+
+    for _ in range(500):
+        path = (
+            f"env{generator.randrange(6)}/team{generator.randrange(rules + 2)}/"
+            f"app{generator.randrange(rules + 2)}.{generator.choice(['yaml', 'yml', 'json'])}"
+        )
+        assert matcher.first(path) == _first(regexes, path)
+
+
+def test_key_matcher_remembers_key_names():
+    matcher = KeyMatcher(re.compile("^(data|stringData)$"), max_size=2, counted=True)
+
+    keys = ["data", "metadata", "data", "name", "name", "stringData", "metadata"]
+    assert [matcher.search(key) for key in keys] == [True, False, True, False, False, True, False]
+    # Only the first two names are remembered
+    assert dict(matcher) == {"data": True, "metadata": False}
+    assert matcher.lookups == 7
+    assert matcher.misses == 5
+
+    with pytest.raises(TypeError):
+        matcher.search(1)
@@ -0,0 +1,130 @@
+import pytest
+
+from isops.utils.watch import InotifyWatcher, PollingWatcher, Watcher, create_watcher
+
+
+def _inotify_watcher(path):
+    try:
+        return InotifyWatcher(path)
+    except OSError:
+        pytest.skip("inotify is not available")
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def new_watcher(request):
+    if request.param == "inotify":
+        return _inotify_watcher
+    return lambda path: PollingWatcher(path, interval=0.01)
+
+
+def test_watcher_reports_created_modified_and_deleted_files(tmp_path, new_watcher):
+    existing = tmp_path / "existing.yaml"
+    existing.write_text("a: 1\n")
+
+    with new_watcher(tmp_path) as watcher:
+        assert watcher.wait(timeout=0.05) == set()
+
+        existing.write_text("a: 2\n")
+        created = tmp_path / "created.yaml"
+        created.write_text("a: 1\n")
+        assert watcher.wait(timeout=5) == {existing, created}
+
+        existing.unlink()
+        assert watcher.wait(timeout=5) == {existing}
+
+
+def test_watcher_poll_reports_the_changes_without_waiting(tmp_path, new_watcher):
+    existing = tmp_path / "existing.yaml"
+    existing.write_text("a: 1\n")
+
+    with new_watcher(tmp_path) as watcher:
+        assert watcher.poll() == set()
+
+        created = tmp_path / "created.yaml"
+        created.write_text("a: 1\n")
+        existing.unlink()
+        assert watcher.poll() == {existing, created}
+        assert watcher.poll() == set()
+
+
+def test_watcher_new_directories_are_watched(tmp_path, new_watcher):
+    with new_watcher(tmp_path) as watcher:
+        nested = tmp_path / "a" / "b"
+        nested.mkdir(parents=True)
+        (nested / "first.yaml").write_text("a: 1\n")
+        assert watcher.wait(timeout=5) == {nested / "first.yaml"}
+
+        (nested / "second.yaml").write_text("a: 1\n")
+        assert watcher.wait(timeout=5) == {nested / "second.yaml"}
+
+
+def test_watcher_ignores_git_directory(tmp_path, new_watcher):
+    (tmp_path / ".git").mkdir()
+
+    with new_watcher(tmp_path) as watcher:
+        (tmp_path / ".git" / "index").write_text("")
+        assert watcher.wait(timeout=0.2) == set()
+
+
+def test_watcher_skips_ignored_directories(tmp_path, new_watcher):
+    (tmp_path / ".gitignore").write_text("vendor/\n")
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app" / ".isopsignore").write_text("fixtures/\n")
+    for directory in ("vendor/lib", "app/fixtures"):
+        (tmp_path / directory).mkdir(parents=True)
+
+    with new_watcher(tmp_path) as watcher:
+        (tmp_path / "vendor" / "lib" / "secret.yaml").write_text("a: 1\n")
+        (tmp_path / "app" / "fixtures" / "secret.yaml").write_text("a: 1\n")
+        # new directories are skipped too
+        (tmp_path / "vendor" / "new").mkdir()
+        (tmp_path / "vendor" / "new" / "secret.yaml").write_text("a: 1\n")
+        (tmp_path / "app" / "fixtures" / "new").mkdir()
+        (tmp_path / "app" / "fixtures" / "new" / "secret.yaml").write_text("a: 1\n")
+        assert watcher.wait(timeout=0.2) == set()
+
+        (tmp_path / "app" / "secret.yaml").write_text("a: 1\n")
+        assert watcher.wait(timeout=5) == {tmp_path / "app" / "secret.yaml"}
+
+
+def test_watcher_watches_directories_no_longer_ignored(tmp_path, new_watcher):
+    (tmp_path / ".gitignore").write_text("vendor/\n")
+    (tmp_path / "vendor").mkdir()
+
+    with new_watcher(tmp_path) as watcher:
+        (tmp_path / ".gitignore").write_text("")
+        assert watcher.wait(timeout=5) == {tmp_path / ".gitignore"}
+
+        (tmp_path / "vendor" / "secret.yaml").write_text("a: 1\n")
+        assert watcher.wait(timeout=5) == {tmp_path / "vendor" / "secret.yaml"}
+
+
+def test_watcher_needs_wait_and_poll(tmp_path):
+    class NoPoll(Watcher):
+        def wait(self, timeout=None):
+            return set()
+
+    with pytest.raises(TypeError):
+        NoPoll(tmp_path)
+
+
+def test_create_watcher_falls_back_to_polling(tmp_path, monkeypatch):
+    def unavailable(path):
+        raise OSError("inotify is not available")
+
+    monkeypatch.setattr("isops.utils.watch.InotifyWatcher", unavailable)
+
+    with create_watcher(tmp_path, interval=0.5) as watcher:
+        assert isinstance(watcher, PollingWatcher)
+        assert watcher.interval == 0.5
+
+
+def test_inotify_watcher_reports_deleted_directories(tmp_path):
+    nested = tmp_path / "a"
+    nested.mkdir()
+    (nested / "first.yaml").write_text("a: 1\n")
+
+    with _inotify_watcher(tmp_path) as watcher:
+        (nested / "first.yaml").unlink()
+        nested.rmdir()
+        assert nested in watcher.wait(timeout=5)